@@ -0,0 +1,157 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import random
+from typing import List, NamedTuple
+
+
+class GenAxes(NamedTuple):
+    num_funcs: int = 4              # number of functions besides `main`
+    stmts_per_func: int = 8         # top-level statements in each function
+    expr_depth: int = 2             # max depth of binary operators in an expression
+    if_chain_len: int = 2           # number of `else if` arms of each if statement
+    loop_nesting: int = 1           # depth of each nest of while loops
+    num_globals: int = 4            # number of global `let`/`const` variables
+    num_str_literals: int = 4       # number of distinct string literals (all printed by `main`)
+    loop_trips: int = 3             # iterations of each while loop (keeps the generated programs cheap to run)
+    
+    def scaled(self, axis: str, val: int):
+        return self._replace(**{axis: val})
+
+
+class C0ProgramGenerator(object):
+    r"""
+    Generates a valid and terminating C0 program from a seed and the sizes of some independent axes (`GenAxes`).
+    
+    Each function `f{i}(a: int, b: int) -> int` declares four int locals, a double local and the counters of its
+    loops, runs `stmts_per_func` random statements (assignments, if/else chains, while nests, a call of its
+    predecessor `f{i-1}`), prints a local and returns. `main` prints every string literal and calls the last function,
+    so every function is executed exactly once and the running time stays linear in the size of the program.
+    
+    Examples:
+        
+        >>> src = C0ProgramGenerator(seed=0, axes=GenAxes(num_funcs=10)).generate()
+    
+    """
+    
+    _CMP_OPS = ('<', '>', '<=', '>=', '==', '!=')
+    _ARITH_OPS = ('+', '-', '*')
+    
+    def __init__(self, seed: int = 0, axes: GenAxes = GenAxes()):
+        self._rng = random.Random(seed)
+        self._axes = axes
+        self._lines: List[str] = []
+        self._ind = 0
+        self._int_names: List[str] = []
+    
+    def generate(self) -> str:
+        ax = self._axes
+        self._lines, self._ind = [], 0
+        global_names = []
+        for k in range(ax.num_globals):
+            kw = 'const' if k % 2 else 'let'
+            self._emit(f'{kw} g{k}: int = {self._rng.randrange(100)};')
+            global_names.append(f'g{k}')
+        for i in range(ax.num_funcs):
+            self._gen_func(i, global_names)
+        
+        self._emit('fn main() -> void {')
+        self._ind += 1
+        for k in range(ax.num_str_literals):
+            self._emit(f'putstr("message #{k}: {self._rng.randrange(10 ** 6)}"); putln();')
+        if ax.num_funcs:
+            self._emit(f'putint(f{ax.num_funcs - 1}(1, 2)); putln();')
+        self._ind -= 1
+        self._emit('}')
+        return '\n'.join(self._lines) + '\n'
+    
+    def _emit(self, line: str):
+        self._lines.append('    ' * self._ind + line)
+    
+    def _gen_func(self, i: int, global_names: List[str]):
+        ax = self._axes
+        self._emit(f'fn f{i}(a: int, b: int) -> int {{')
+        self._ind += 1
+        self._int_names = ['a', 'b', *global_names]
+        for k in range(4):
+            self._emit(f'let v{k}: int = {self._gen_expr(ax.expr_depth)};')
+            self._int_names.append(f'v{k}')
+        self._emit('let d: double = 1.5;')
+        for k in range(ax.loop_nesting):
+            self._emit(f'let w{k}: int;')
+        
+        called = i == 0
+        for _ in range(ax.stmts_per_func):
+            kind = self._rng.random()
+            if not called and kind < 0.1:
+                called = True
+                self._emit(f'v0 = f{i - 1}({self._gen_expr(1)}, {self._gen_expr(1)});')
+            elif kind < 0.3:
+                self._gen_if_chain()
+            elif kind < 0.45 and ax.loop_nesting > 0:
+                self._gen_while_nest(0)
+            elif kind < 0.55:
+                self._emit(f'd = d * 0.5 + ({self._gen_expr(1)}) as double;')
+            else:
+                self._gen_assignment()
+        if not called:
+            self._emit(f'v0 = f{i - 1}({self._gen_expr(1)}, {self._gen_expr(1)});')
+        
+        self._emit(f'putint(v{self._rng.randrange(4)}); putchar(32); putdouble(d); putln();')
+        self._emit(f'return {self._gen_expr(ax.expr_depth)};')
+        self._ind -= 1
+        self._emit('}')
+    
+    def _gen_assignment(self):
+        self._emit(f'v{self._rng.randrange(4)} = {self._gen_expr(self._axes.expr_depth)};')
+    
+    def _gen_cond(self) -> str:
+        return f'{self._gen_expr(1)} {self._rng.choice(self._CMP_OPS)} {self._gen_expr(1)}'
+    
+    def _gen_if_chain(self):
+        self._emit(f'if {self._gen_cond()} {{')
+        for _ in range(self._axes.if_chain_len):
+            self._ind += 1
+            self._gen_assignment()
+            self._ind -= 1
+            self._emit(f'}} else if {self._gen_cond()} {{')
+        self._ind += 1
+        self._gen_assignment()
+        self._ind -= 1
+        self._emit('} else {')
+        self._ind += 1
+        self._gen_assignment()
+        self._ind -= 1
+        self._emit('}')
+    
+    def _gen_while_nest(self, level: int):
+        w = f'w{level}'
+        self._emit(f'{w} = 0;')
+        self._emit(f'while {w} < {self._axes.loop_trips} {{')
+        self._ind += 1
+        self._gen_assignment()
+        if level + 1 < self._axes.loop_nesting:
+            self._gen_while_nest(level + 1)
+        self._emit(f'{w} = {w} + 1;')
+        self._ind -= 1
+        self._emit('}')
+    
+    def _gen_expr(self, depth: int) -> str:
+        rng = self._rng
+        if depth <= 0 or rng.random() < 0.25:
+            r = rng.random()
+            if r < 0.5:
+                return rng.choice(self._int_names)
+            elif r < 0.9:
+                return str(rng.randrange(1000))
+            else:
+                return f'-{rng.choice(self._int_names)}'
+        lhs, rhs = self._gen_expr(depth - 1), self._gen_expr(depth - 1)
+        if rng.random() < 0.1:
+            return f'({lhs}) / {rng.randrange(1, 10)}'
+        return f'({lhs} {rng.choice(self._ARITH_OPS)} {rhs})'
+
+
+if __name__ == '__main__':
+    print(C0ProgramGenerator(seed=0, axes=GenAxes(num_funcs=2, stmts_per_func=6)).generate())
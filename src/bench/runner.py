@@ -0,0 +1,147 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict, List, NamedTuple
+
+from bench.generator import C0ProgramGenerator, GenAxes
+from lexical.tokenizer import LexicalTokenizer
+from obj.assembler import Assembler
+from syntactic.analyzer import SyntacticAnalyzer
+from utils.log import C0Logger
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# the values of each axis to sweep over (the other axes stay at their values in `BASE_AXES`)
+BASE_AXES = GenAxes(num_funcs=32, stmts_per_func=16)
+SWEEPS: Dict[str, List[int]] = {
+    'num_funcs': [32, 64, 128, 256],
+    'stmts_per_func': [16, 32, 64, 128],
+    'expr_depth': [2, 3, 4, 5],
+    'if_chain_len': [2, 4, 8, 16],
+    'loop_nesting': [1, 2, 4, 8],
+    'num_globals': [4, 64, 256, 1024],
+    'num_str_literals': [4, 256, 1024, 4096],
+}
+SUPER_LINEAR_SLOPE = 1.25   # a log-log slope of time over tokens above this is reported as super-linear
+
+
+class Measurement(NamedTuple):
+    axis: str
+    val: int
+    lines: int
+    tokens: int
+    instrs: int
+    lex_s: float
+    parse_s: float
+    asm_s: float
+    
+    @property
+    def total_s(self):
+        return self.lex_s + self.parse_s + self.asm_s
+    
+    def throughputs(self) -> Dict[str, float]:
+        return {
+            'lines_per_s': self.lines / self.total_s,
+            'tokens_per_s': self.tokens / (self.lex_s + self.parse_s),
+            'instrs_per_s': self.instrs / (self.parse_s + self.asm_s),
+        }
+
+
+def measure(axis: str, val: int, seed: int, repeat: int) -> Measurement:
+    src = C0ProgramGenerator(seed=seed, axes=BASE_AXES.scaled(axis, val)).generate()
+    lg = C0Logger(None)
+    best = [math.inf] * 3
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        lex = LexicalTokenizer(lg, src)
+        tokens, str_literals = lex.parse_tokens()
+        t1 = time.perf_counter()
+        global_symbols, global_funcs = SyntacticAnalyzer(lg, tokens, str_literals).analyze_tokens()
+        t2 = time.perf_counter()
+        Assembler(lg, global_symbols, global_funcs).dump()
+        t3 = time.perf_counter()
+        best = [min(b, t) for b, t in zip(best, (t1 - t0, t2 - t1, t3 - t2))]
+    return Measurement(
+        axis=axis, val=val, lines=src.count('\n'), tokens=len(tokens),
+        instrs=sum(len(f.instructions) for f in global_funcs),
+        lex_s=best[0], parse_s=best[1], asm_s=best[2],
+    )
+
+
+def log_log_slope(ms: List[Measurement]) -> float:
+    # least squares fit of log(total time) against log(number of tokens); 1.0 means linear scaling
+    xs = [math.log(m.tokens) for m in ms]
+    ys = [math.log(m.total_s) for m in ms]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    den = sum((x - mx) ** 2 for x in xs)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / den if den else 0.0
+
+
+def run(axes: List[str], seed: int, repeat: int) -> Dict:
+    results = {}
+    for axis in axes:
+        ms = [measure(axis, val, seed, repeat) for val in SWEEPS[axis]]
+        results[axis] = {
+            'slope': log_log_slope(ms),
+            'points': [{**m._asdict(), **m.throughputs()} for m in ms],
+        }
+    return results
+
+
+def report(results: Dict, baseline: Dict) -> bool:
+    ok = True
+    for axis, res in results.items():
+        base = baseline.get(axis, None)
+        slope_s = f'slope={res["slope"]:.2f}'
+        if base is not None:
+            slope_s += f' (baseline {base["slope"]:.2f})'
+        flag = ''
+        if res['slope'] > SUPER_LINEAR_SLOPE:
+            flag, ok = '  <-- SUPER-LINEAR', False
+        print(f'== {axis}: {slope_s}{flag}')
+        print(f'   {"val":>6s} {"lines":>8s} {"tokens":>9s} {"instrs":>9s} {"total ms":>9s} {"lines/s":>10s} {"tokens/s":>10s} {"instrs/s":>10s}')
+        for i, p in enumerate(res['points']):
+            line = (
+                f'   {p["val"]:6d} {p["lines"]:8d} {p["tokens"]:9d} {p["instrs"]:9d} {(p["lex_s"] + p["parse_s"] + p["asm_s"]) * 1000:9.1f} '
+                f'{p["lines_per_s"]:10.0f} {p["tokens_per_s"]:10.0f} {p["instrs_per_s"]:10.0f}'
+            )
+            if base is not None and i < len(base['points']):
+                line += f'  ({p["tokens_per_s"] / base["points"][i]["tokens_per_s"] - 1:+.0%} tokens/s vs baseline)'
+            print(line)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compiler throughput benchmark over generated C0 programs')
+    parser.add_argument('--axes', type=str, nargs='*', default=list(SWEEPS.keys()), choices=list(SWEEPS.keys()))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', type=str, default=None, help='also write the results to this file')
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', default=False)
+    args = parser.parse_args()
+    
+    results = run(args.axes, args.seed, args.repeat)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+    ok = report(results, baseline)
+    if args.json is not None:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump({**baseline, **results}, fp, indent=2)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
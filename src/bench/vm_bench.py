@@ -0,0 +1,148 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import argparse
+import io
+import json
+import math
+import time
+from functools import partial
+from typing import Dict, List, NamedTuple
+
+from bench.generator import C0ProgramGenerator, GenAxes
+from lexical.tokenizer import LexicalTokenizer
+from obj.assembler import Assembler
+from syntactic.analyzer import SyntacticAnalyzer
+from utils.log import C0Logger
+from vm.loader import load_o0
+from vm.machine import VirtualMachine
+from vm.threaded import ThreadedVirtualMachine
+
+ENGINES = {
+    'dispatch': VirtualMachine,
+    'fused': partial(VirtualMachine, fusing=True),
+    'threaded': ThreadedVirtualMachine,
+}
+
+# loop-heavy programs, so that most of the time is spent in the interpreter loop rather than in calls or I/O
+PROGRAMS: Dict[str, GenAxes] = {
+    'flat': GenAxes(num_funcs=16, stmts_per_func=32, loop_nesting=0),
+    'loops': GenAxes(num_funcs=16, stmts_per_func=16, loop_nesting=2, loop_trips=16),
+    'deep_loops': GenAxes(num_funcs=8, stmts_per_func=16, loop_nesting=4, loop_trips=8),
+    'branchy': GenAxes(num_funcs=16, stmts_per_func=16, if_chain_len=8, loop_nesting=2, loop_trips=16),
+}
+
+# small programs on the corners of the semantics, whose outputs must agree between the engines before measuring
+EDGE_CASES: Dict[str, str] = {
+    # CMP_F gives 0 if an operand is NaN: == holds and != does not, in conditions of if and while alike
+    'nan_cmp': '''
+        fn main() -> void {
+            let z: double = 0.0;
+            let n: double = z / z;
+            let one: double = 1.0;
+            let k: int = 0;
+            if n == n { putint(1); } else { putint(0); }
+            if n != n { putint(1); } else { putint(0); }
+            if n != one { putint(1); } else { putint(0); }
+            if n < one { putint(1); } else { putint(0); }
+            if n >= one { putint(1); } else { putint(0); }
+            if n <= one { putint(1); } else { putint(0); }
+            while n != n { k = k + 1; if k == 3 { break; } }
+            putint(k);
+            while n == n { k = k + 1; if k == 3 { break; } }
+            putint(k);
+            putln();
+        }
+    ''',
+}
+
+
+class VmMeasurement(NamedTuple):
+    program: str
+    engine: str
+    instrs: int         # the number of executed instructions (counted by the dispatch engine)
+    dispatches: int     # the number of dispatched (maybe fused) instructions, 0 for the threaded engine
+    prep_s: float       # decoding, and translating for the threaded engine
+    run_s: float
+    
+    @property
+    def ops_per_s(self):
+        return self.instrs / self.run_s
+
+
+def compile_o0(src: str) -> bytes:
+    lg = C0Logger(None)
+    lex = LexicalTokenizer(lg, src)
+    global_symbols, global_funcs = SyntacticAnalyzer(lg, lex.iter_tokens(), lex.str_literals).analyze_tokens()
+    return bytes(Assembler(lg, global_symbols, global_funcs).dump())
+
+
+def measure(name: str, axes: GenAxes, engines: List[str], seed: int, repeat: int) -> List[VmMeasurement]:
+    program = load_o0(compile_o0(C0ProgramGenerator(seed=seed, axes=axes).generate()))
+    ref_out = io.StringIO()
+    n = VirtualMachine(program, fin=io.StringIO(), fout=ref_out).run()
+    ms = []
+    for engine in engines:
+        best_prep, best_run = math.inf, math.inf
+        for _ in range(repeat):
+            out = io.StringIO()
+            t0 = time.perf_counter()
+            vm = ENGINES[engine](program, fin=io.StringIO(), fout=out, **({'eager': True} if engine == 'threaded' else {}))
+            t1 = time.perf_counter()
+            vm.run()
+            dispatches = vm.num_executed
+            t2 = time.perf_counter()
+            best_prep, best_run = min(best_prep, t1 - t0), min(best_run, t2 - t1)
+            if out.getvalue() != ref_out.getvalue():
+                raise AssertionError(f'the output of the {engine} engine differs on "{name}"')
+        ms.append(VmMeasurement(program=name, engine=engine, instrs=n, dispatches=dispatches, prep_s=best_prep, run_s=best_run))
+    return ms
+
+
+def check_edge_cases(engines: List[str]):
+    for name, src in EDGE_CASES.items():
+        program = load_o0(compile_o0(src))
+        outs = {}
+        for engine in engines:
+            out = io.StringIO()
+            ENGINES[engine](program, fin=io.StringIO(), fout=out).run()
+            outs[engine] = out.getvalue()
+        if len(set(outs.values())) > 1:
+            raise AssertionError(f'the outputs of the engines differ on "{name}": {outs}')
+
+
+def report(ms: List[VmMeasurement]):
+    print(f'{"program":>12s} {"engine":>10s} {"instrs":>10s} {"dispatches":>10s} {"prep ms":>9s} {"run ms":>9s} {"ops/s":>10s} {"speedup":>8s}')
+    base_run_s = {}
+    for m in ms:
+        base_run_s.setdefault(m.program, m.run_s)
+        print(
+            f'{m.program:>12s} {m.engine:>10s} {m.instrs:10d} {m.dispatches:10d} {m.prep_s * 1000:9.1f} {m.run_s * 1000:9.1f} '
+            f'{m.ops_per_s:10.0f} {base_run_s[m.program] / m.run_s:7.2f}x'
+        )
+    for engine in dict.fromkeys(m.engine for m in ms):
+        total_instrs = sum(m.instrs for m in ms if m.engine == engine)
+        total_s = sum(m.run_s for m in ms if m.engine == engine)
+        print(f'{"total":>12s} {engine:>10s} {total_instrs:10d} {"":10s} {"":9s} {total_s * 1000:9.1f} {total_instrs / total_s:10.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ops/sec benchmark of the o0 virtual machine over generated C0 programs')
+    parser.add_argument('--programs', type=str, nargs='*', default=list(PROGRAMS.keys()), choices=list(PROGRAMS.keys()))
+    parser.add_argument('--engines', type=str, nargs='*', default=list(ENGINES.keys()), choices=list(ENGINES.keys()))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', type=str, default=None, help='also write the results to this file')
+    args = parser.parse_args()
+    
+    check_edge_cases(args.engines)
+    ms = [m for name in args.programs for m in measure(name, PROGRAMS[name], args.engines, args.seed, args.repeat)]
+    report(ms)
+    if args.json is not None:
+        with open(args.json, 'w') as fp:
+            json.dump([{**m._asdict(), 'ops_per_s': m.ops_per_s} for m in ms], fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import argparse
+import json
+import sys
+import time
+import traceback
+
+from lexical.lex_err import TokenCompilationError
+from lexical.tokenizer import LexicalTokenizer
+from obj.assembler import Assembler
+from opt.cfg import remove_unreachable_blocks
+from opt.dce import eliminate_dead_code
+from opt.peephole import PeepholeOptimizer
+from syntactic.analyzer import SyntacticAnalyzer
+from syntactic.syn_err import SyntacticCompilationError
+from utils.log import C0Logger
+from utils.misc import r_open
+from vm.batch import BatchRunner, find_cases
+from vm.vm_err import VirtualMachineError
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compile a C0 program once and run it over many inputs in parallel')
+    parser.add_argument('-i', type=str, required=True, help='the C0 source (or the o0 file with --o0)')
+    parser.add_argument('inputs', type=str, nargs='+', help='the input files, or directories of input files')
+    parser.add_argument('--o0', action='store_true', default=False, help='the program is an o0 file, do not compile it')
+    parser.add_argument('--expected-dir', type=str, default=None, help='where to find the expected outputs (next to the inputs by default: a.in -> a.out/a.ans, a.input.txt -> a.output.txt)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='the number of worker processes (the number of cpus by default)')
+    parser.add_argument('-O', type=int, default=0, dest='opt_level', help='optimization level: 1 enables the sharing of local slots, the peephole pass and the dead code elimination (default: 0)')
+    parser.add_argument('--engine', type=str, default='dispatch', choices=['dispatch', 'threaded'])
+    parser.add_argument('--fuse', action='store_true', default=False, help='dispatch superinstructions (the dispatch engine only)')
+    parser.add_argument('--json', type=str, default=None, help='also write the results to this json file')
+    
+    args: argparse.Namespace = parser.parse_args()
+    st_t = time.perf_counter()
+    if args.o0:
+        with open(args.i, 'rb') as fin:
+            data = fin.read()
+    else:
+        lg = C0Logger(None)
+        try:
+            with r_open(args.i) as fin:
+                lex = LexicalTokenizer(lg=lg, raw_input=fin)
+                global_symbols, global_funcs = SyntacticAnalyzer(
+                    lg=lg, tokens=lex.iter_tokens(), str_literals=lex.str_literals, reuse_local_slots=args.opt_level > 0,
+                ).analyze_tokens()
+            if args.opt_level > 0:
+                remove_unreachable_blocks(global_funcs)
+                PeepholeOptimizer().optimize_funcs(global_funcs)
+                global_symbols, global_funcs, _ = eliminate_dead_code(global_symbols, global_funcs)
+            data = bytes(Assembler(lg, global_symbols, global_funcs).dump())
+        except (TokenCompilationError, SyntacticCompilationError):
+            traceback.print_exc()
+            exit(-1)
+    compile_s = time.perf_counter() - st_t
+    
+    cases = find_cases(args.inputs, args.expected_dir)
+    runner = BatchRunner(data, engine=args.engine, fusing=args.fuse, workers=args.workers)
+    try:
+        results = runner.run(cases)
+    except VirtualMachineError:     # the program cannot be loaded
+        traceback.print_exc()
+        exit(-1)
+    
+    width = max([len(r.name) for r in results] + [4])
+    for r in results:
+        line = f'{r.name:<{width}}  {r.status:<9}  {r.run_s * 1000:9.2f}ms'
+        if r.instrs:
+            line += f'  {r.instrs:>12} instrs'
+        if r.error:
+            line += f'  {r.error}'
+        print(line)
+    
+    counts = {s: sum(r.status == s for r in results) for s in ('passed', 'failed', 'unchecked', 'error')}
+    cpu_s = sum(r.run_s for r in results)
+    instrs = sum(r.instrs for r in results)
+    print(f'\n{len(results)} cases: ' + ', '.join(f'{n} {s}' for s, n in counts.items() if n))
+    print(f'compiled in {compile_s * 1000:.2f}ms, ran in {runner.wall_s * 1000:.2f}ms wall / {cpu_s * 1000:.2f}ms in the cases '
+          f'({len(results) / max(runner.wall_s, 1e-9):.1f} cases/sec' + (f', {instrs / max(runner.wall_s, 1e-9):.0f} instrs/sec)' if instrs else ')'))
+    
+    if args.json is not None:
+        with open(args.json, 'w') as fp:
+            json.dump({
+                'compile_s': compile_s, 'wall_s': runner.wall_s, 'counts': counts,
+                'cases': [r._asdict() for r in results],
+            }, fp, indent=2)
+    if counts['failed'] or counts['error']:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
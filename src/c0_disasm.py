@@ -0,0 +1,83 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import argparse
+import struct
+import sys
+from typing import Iterator, Optional
+
+from obj.reader import O0Reader, O0FormatError, O0FuncView
+from vm.instruction import InstrType
+
+_BRANCHES = {InstrType.BR, InstrType.BR_FALSE, InstrType.BR_TRUE}
+
+
+def _fmt_value(value: memoryview) -> str:
+    byts = bytes(value)
+    if len(byts) != 8 and all(0x20 <= x < 0x7f for x in byts):
+        return repr(byts.decode('ascii'))
+    return ' '.join(f'{x:02x}' for x in byts)
+
+
+def _fmt_operand(r: O0Reader, ip: int, it: InstrType, x: Optional[int]) -> str:
+    if x is None:
+        return ''
+    s = f' {x}'
+    if it in _BRANCHES:
+        s += f'  ; -> {ip + 1 + x}'
+    elif it == InstrType.CALLNAME and x < r.num_globals:
+        s += f'  ; {r.global_str(x)!r}'
+    elif it == InstrType.PUSH and not -(1 << 31) <= x < 1 << 31:
+        s += f'  ; f64 {struct.unpack(">d", struct.pack(">q", x))[0]!r}'
+    return s
+
+
+def iter_disasm(r: O0Reader, func_name: Optional[str] = None, headers_only: bool = False) -> Iterator[str]:
+    if func_name is None:
+        yield f'globals ({r.num_globals}):'
+        for g in r.iter_globals():
+            yield f'  #{g.idx:<5d} {"const" if g.is_const else "var  "} [{len(g.value)}] {_fmt_value(g.value)}'
+        yield f'functions ({r.num_funcs}):'
+    for f in r.iter_functions():
+        name = r.func_name(f)
+        if func_name is not None and name != func_name:
+            continue
+        yield (
+            f'  fn #{f.idx} {name} (rets={f.num_ret_vals}, args={f.num_args}, locs={f.num_loc_vars}, '
+            f'instrs={f.num_instrs}, bytes={f.body_end - f.body_start})'
+        )
+        if not headers_only:
+            yield from _iter_func_body(r, f)
+
+
+def _iter_func_body(r: O0Reader, f: O0FuncView) -> Iterator[str]:
+    for ip, (it, x) in enumerate(r.iter_instructions(f)):
+        yield f'    {ip:6d}: {it.name.lower()}{_fmt_operand(r, ip, it, x)}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='disassembler of o0 files by Keyu Tian')
+    parser.add_argument('-i', type=str, required=True, help='the o0 file to disassemble')
+    parser.add_argument('-o', type=str, required=False, default=None, help='the output file (stdout by default)')
+    parser.add_argument('--func', type=str, default=None, help='only disassemble the function with this name')
+    parser.add_argument('--headers', action='store_true', default=False, help='only print the headers of the functions')
+    
+    args: argparse.Namespace = parser.parse_args()
+    fout = sys.stdout if args.o is None else open(args.o, 'w')
+    try:
+        with O0Reader.open(args.i) as r:
+            fout.writelines(f'{line}\n' for line in iter_disasm(r, args.func, args.headers))
+            trailing = r.trailing_bytes()
+            if trailing:
+                print(f'warning: {trailing} trailing bytes after the functions', file=sys.stderr)
+    except O0FormatError as e:
+        print(f'error: {e}', file=sys.stderr)
+        exit(-1)
+    finally:
+        if fout is not sys.stdout:
+            fout.close()
+
+
+if __name__ == '__main__':
+    main()
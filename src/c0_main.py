@@ -8,16 +8,23 @@ import os
 import sys
 import time
 import traceback
+from contextlib import nullcontext
 from pprint import pformat as pf
 
 from lexical.lex_err import TokenCompilationError
 from lexical.tokenizer import LexicalTokenizer
 from meta import LOCAL
 from obj.assembler import Assembler
+from obj.listing import iter_listing
+from opt.cfg import remove_unreachable_blocks
+from opt.dce import eliminate_dead_code
+from opt.peephole import PeepholeOptimizer
 from syntactic.analyzer import SyntacticAnalyzer
 from syntactic.syn_err import SyntacticCompilationError
-from utils.log import C0Logger, create_logger
+from utils.log import C0Logger, LazyFmt, create_logger
 from utils.misc import r_open, time_str, wb_open, w_open
+from utils.profiler import PhaseProfiler, NULL_PROFILER
+from vm.verifier import StackVerificationError, verify_funcs
 
 
 def main():
@@ -25,35 +32,81 @@ def main():
     parser.add_argument('-i', type=str, required=True)
     parser.add_argument('-o', type=str, required=False, default=None)
     parser.add_argument('--verbose', action='store_true', default=False)
+    parser.add_argument('--compact-tokens', action='store_true', default=False, help='store tokens as a struct of arrays instead of streaming them')
+    parser.add_argument('--listing', action='store_true', default=False, help='print a human-readable listing of the object file')
+    parser.add_argument('-O', type=int, default=0, dest='opt_level', help='optimization level: 1 enables the sharing of local slots, the peephole pass and the dead code elimination (default: 0)')
+    parser.add_argument('--opt-report', action='store_true', default=False, help='print the instructions removed by each pass, the dead functions and globals and the shrunk frames to stderr')
+    parser.add_argument('--verify', action='store_true', default=False, help='verify the stack effects of the generated code before assembling it')
+    parser.add_argument('--profile', type=str, nargs='?', const='-', default=None, help='report time and memory of each phase as JSON lines to the given file (stderr by default)')
     
     args: argparse.Namespace = parser.parse_args()
     logger = create_logger('c0-lg', os.path.join('..', 'log', f'{time_str(True)}.log')) if args.verbose else None
     # noinspection PyTypeChecker
     lg: logging.Logger = C0Logger(logger) # just for the code completion
     
+    if args.profile is None:
+        prof = NULL_PROFILER
+    else:
+        to_stderr = args.profile == '-'
+        prof = PhaseProfiler(sys.stderr if to_stderr else w_open(args.profile, mode='a'), tag=args.i, own_fp=not to_stderr)
+    
     with r_open(args.i) as fin, wb_open(args.o) as fout:
-        obj_hint_fp = w_open(args.o + '.txt') if LOCAL else sys.stdout
-        raw_input = fin.read()
+        s = None
         try:
-            tokens, str_literals = LexicalTokenizer(lg=lg, raw_input=raw_input).parse_tokens()
             st_t = time.time()
-            s = SyntacticAnalyzer(lg=lg, tokens=tokens, str_literals=str_literals)
-            str_literals, global_symbols, global_funcs = s.analyze_tokens()
-            b_arr = Assembler(lg, str_literals, global_symbols, global_funcs).dump()
-            fout.write(b_arr)
-            print('\n'.join(b_arr.hints), file=obj_hint_fp)
-            if LOCAL:
-                obj_hint_fp.close()
+            lex = LexicalTokenizer(lg=lg, raw_input=fin, prof=prof)
+            # tokens are streamed into the analyzer unless they are to be logged or lexing is profiled on its own
+            if args.compact_tokens:
+                tokens = lex.parse_compact_tokens()
+            else:
+                tokens = lex.parse_tokens()[0] if lg.verbose or prof.enabled else lex.iter_tokens()
+            s = SyntacticAnalyzer(lg=lg, tokens=tokens, str_literals=lex.str_literals, prof=prof, reuse_local_slots=args.opt_level > 0)
+            global_symbols, global_funcs = s.analyze_tokens()
+            if args.opt_level > 0:
+                with prof.phase('optimize'):
+                    num_unreachable = remove_unreachable_blocks(global_funcs)
+                    opt = PeepholeOptimizer()
+                    opt.optimize_funcs(global_funcs)
+                    global_symbols, global_funcs, dce_report = eliminate_dead_code(global_symbols, global_funcs)
+                if args.opt_report:
+                    print(f'cfg: unreachable instructions -{num_unreachable}', file=sys.stderr)
+                    for rule, n in opt.removed.most_common():
+                        print(f'peephole: {rule:<16} -{n}', file=sys.stderr)
+                    print(f'peephole: {"total":<16} -{sum(opt.removed.values())}', file=sys.stderr)
+                    for line in dce_report.lines():
+                        print(f'dce: {line}', file=sys.stderr)
+                    shrunk = {name: sizes for name, sizes in s.frame_sizes.items() if sizes[1] < sizes[0]}
+                    for name, (declared, slots) in shrunk.items():
+                        print(f'frame: {name:<16} {declared} -> {slots} slots', file=sys.stderr)
+                    declared, slots = (sum(sizes[k] for sizes in s.frame_sizes.values()) for k in (0, 1))
+                    print(f'frame: {"total":<16} {declared} -> {slots} slots ({len(shrunk)} functions shrunk)', file=sys.stderr)
+            if args.verify:
+                with prof.phase('verify'):
+                    stack_infos = verify_funcs(global_symbols, global_funcs)
+                lg.info('max operand stack depths: %s', LazyFmt(lambda: {k: v.max_depth for k, v in stack_infos.items()}))
+            b_arr = Assembler(lg, global_symbols, global_funcs, prof=prof).dump()
+            with prof.phase('write'):
+                fout.write(b_arr)
+                fout.flush()
+            if args.listing or LOCAL:
+                with (w_open(args.o + '.txt') if LOCAL else nullcontext(sys.stdout)) as obj_hint_fp:
+                    obj_hint_fp.writelines(f'{line}\n' for line in iter_listing(b_arr))
             
             dt = (time.time() - st_t) * 1000
-            lg.info(f'str_literals = ({len(str_literals)}) \n {pf(str_literals)}')
-            lg.info(f'global_symbols = ({len(global_symbols)}) \n {pf(global_symbols)}')
-            lg.info(f'global_funcs = ({len(global_funcs)}) \n {pf(global_funcs)}')
-            lg.info(f'time cost: {dt:.2f}ms')
+            lg.info('global_symbols = (%d) \n %s', len(global_symbols), LazyFmt(pf, global_symbols))
+            lg.info('global_funcs = (%d) \n %s', len(global_funcs), LazyFmt(pf, global_funcs))
+            lg.info('time cost: %.2fms', dt)
+        except StackVerificationError:
+            traceback.print_exc()
+            exit(-1)
         except (TokenCompilationError, SyntacticCompilationError):
             traceback.print_exc()
-            print(f'@ {" ".join([str(t.val) for t in s._tokens[s._tk_top:s._tk_top+20]])} ...')
+            if s is not None:
+                consumed, upcoming = s.token_context()
+                print(f'... {" ".join([str(t.val) for t in consumed])} @ {" ".join([str(t.val) for t in upcoming])} ...')
             exit(-1)
+        finally:
+            prof.close()
 
 
 if __name__ == '__main__':
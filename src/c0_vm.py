@@ -0,0 +1,70 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import argparse
+import sys
+import time
+import traceback
+
+from vm.loader import load_o0
+from vm.machine import VirtualMachine
+from vm.profiler import ExecutionProfiler
+from vm.threaded import ThreadedVirtualMachine
+from vm.vm_err import VirtualMachineError
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pure-python virtual machine for o0 files by Keyu Tian')
+    parser.add_argument('-i', type=str, required=True, help='the o0 file to run')
+    parser.add_argument('--engine', type=str, default='dispatch', choices=['dispatch', 'threaded'], help='interpret each instruction, or translate the functions into python code first')
+    parser.add_argument('--fuse', action='store_true', default=False, help='dispatch superinstructions for the common sequences (the dispatch engine only)')
+    parser.add_argument('--stats', action='store_true', default=False, help='report the number of executed instructions and ops/sec to stderr')
+    parser.add_argument('--prof-json', type=str, default=None, help='profile the execution (on the dispatch engine, without fusion) and write the profile to this json file')
+    parser.add_argument('--prof-folded', type=str, default=None, help='profile the execution and write the instructions of each call stack to this file (for flame graphs)')
+    parser.add_argument('--prof-sample', type=int, default=0, help='only look at every N-th instruction when profiling (0: look at all of them)')
+    
+    args: argparse.Namespace = parser.parse_args()
+    with open(args.i, 'rb') as fin:
+        data = fin.read()
+    
+    profiling = args.prof_json is not None or args.prof_folded is not None
+    prof = None
+    try:
+        if profiling:
+            vm = VirtualMachine(load_o0(data), fin=sys.stdin, fout=sys.stdout)
+            prof = ExecutionProfiler(vm, sample_every=args.prof_sample)
+        elif args.engine == 'threaded':
+            vm = ThreadedVirtualMachine(load_o0(data), fin=sys.stdin, fout=sys.stdout)
+        else:
+            vm = VirtualMachine(load_o0(data), fin=sys.stdin, fout=sys.stdout, fusing=args.fuse)
+        st_t = time.perf_counter()
+        try:
+            vm.run() if prof is None else prof.run()
+        finally:
+            sys.stdout.flush()
+        dt = time.perf_counter() - st_t
+    except VirtualMachineError:
+        traceback.print_exc()
+        exit(-1)
+    finally:
+        if prof is not None:
+            if args.prof_json is not None:
+                with open(args.prof_json, 'w') as fp:
+                    prof.dump_json(fp)
+            if args.prof_folded is not None:
+                with open(args.prof_folded, 'w') as fp:
+                    prof.dump_folded(fp)
+    
+    if args.stats and args.engine == 'threaded' and not profiling:
+        print(f'executed in {dt * 1000:.2f}ms (translating the functions included)', file=sys.stderr)
+    elif args.stats:
+        print(f'executed {vm.num_executed} instructions in {dt * 1000:.2f}ms ({vm.num_executed / max(dt, 1e-9):.0f} ops/sec)', file=sys.stderr)
+    if args.stats and vm.mem.heap_stats().num_allocs:
+        h = vm.mem.heap_stats()
+        print(f'heap: {h.num_allocs} allocs, {h.num_frees} frees, {h.live_bytes} bytes live (peak {h.peak_live_bytes}), '
+              f'{h.heap_bytes} bytes used, {h.fragmentation:.1%} fragmented', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,68 +4,28 @@
 
 import re
 
-from lexical.lex_err import QuoteMismatchErr
 from meta import FS_ENCODING
 
 
-def is_alpha(s: str) -> bool:
-    return all(ord('a') <= ord(ch) <= ord('z') or ord('A') <= ord(ch) <= ord('Z') for ch in s)
-
-
-def is_al_udl(s: str) -> bool:
-    return all(ord('a') <= ord(ch) <= ord('z') or ord('A') <= ord(ch) <= ord('Z') or ch == '_' for ch in s)
-
-
-def is_decimal(s: str) -> bool:
-    return all(ord('0') <= ord(ch) <= ord('9') for ch in s)
-
-
-def is_al_num_udl(s: str) -> bool:
-    return all(
-        ord('a') <= ord(ch) <= ord('z') or ord('A') <= ord(ch) <= ord('Z')
-        or ord('0') <= ord(ch) <= ord('9') or ch == '_'
-        for ch in s
+# the master pattern of the single-pass scanner; blanks and comments ahead of a token are swallowed by the same match,
+# alternatives are tried in order, so doubles go before integers and two-char operators go before one-char ones;
+# a number running into a letter, a digit or '_' (or an integer into '.') is left to the unknown-word path, e.g. 123abc
+token_reg = re.compile(r'''
+    (?:\s+|//[^\n]*)*
+    (?:
+        (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op>->|==|!=|<=|>=|[-+*/=<>(){},:;])
+      | (?P<dbl>\d+\.\d+(?:[eE][+-]?\d+)?(?![A-Za-z0-9_]))
+      | (?P<uint>\d+(?![A-Za-z0-9_.]))
+      | (?P<str>"(?:[^"\\\n]|\\[\\"'nrt])*")
+      | (?P<chr>'(?:[^"\\\n]|\\[\\"'nrt])')
+      | (?P<quote>")
+      | (?P<eof>\Z)
+      | (?P<unknown>.)
     )
-
-
-def is_identifier(s: str) -> bool:
-    return is_al_udl(s[:1]) and is_al_num_udl(s[1:])
-
-
-def remove_inline_comment(line: str) -> str:
-    tag = chr(500) * 2
-    ln = re.sub(r'\\\"', tag, line)
-    for p in map(lambda m: m.start(), re.finditer('//', ln)):
-        lefts = ln[:p]
-        if lefts.count('"') % 2 == 0:
-            ln = lefts
-            break
-    if ln.count('"') % 2 == 1:
-        raise QuoteMismatchErr('quote missing')
-    ln = ln.replace(tag, r'\"')
-    return ln
-
-
-str_literal_reg = re.compile(r'\"([^\"\\]|\\[\\\"\'nrt])*\"')
-dbl_literal_reg = re.compile(r'\d+\.\d+[eE][+-]?\d+|\d+\.\d+')
-chr_literal_reg = re.compile(r'\'([^\"\\]|\\[\\\"\'nrt])\'')
-
-STR_LITERAL_REFERENCE, DBL_LITERAL_REFERENCE = chr(352), chr(270)
+''', re.VERBOSE | re.DOTALL)
+unknown_word_reg = re.compile(r'[^\s\-+*/=<>(){},:;]+|\S')     # the word reported, up to a blank or an operator
 
 
 def escaping(s: str):
     return s.encode(FS_ENCODING).decode('unicode_escape')
-
-
-def extract_str_dbl_chr_literals(codes):
-    str_literals, dbl_literals = [], []
-    _ex_str = lambda m: f"{STR_LITERAL_REFERENCE}{len(str_literals)}" \
-                        f"{str_literals.append(escaping(m.group()[1:-1])) or ''}"
-    _ex_dbl = lambda m: f"{DBL_LITERAL_REFERENCE}{len(dbl_literals)}" \
-                        f"{dbl_literals.append(eval(m.group())) or ''}"
-    _ex_chr = lambda m: str(ord(escaping(m.group()[1:-1])))
-    
-    codes = str_literal_reg.sub(_ex_str, codes)
-    codes = dbl_literal_reg.sub(_ex_dbl, codes)
-    codes = chr_literal_reg.sub(_ex_chr, codes)
-    return codes, str_literals, dbl_literals
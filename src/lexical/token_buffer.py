@@ -0,0 +1,98 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from array import array
+from typing import Dict, Iterator, List, Tuple
+
+from lexical.tokentype import Token, TokenType, STR_TO_TOKEN_TYPE
+
+
+TOKEN_TYPES: Tuple[TokenType, ...] = tuple(TokenType)
+TOKEN_TYPE_CODES: Dict[TokenType, int] = {tt: code for code, tt in enumerate(TOKEN_TYPES)}
+
+_IDENT_CODE, _UINT_CODE, _DBL_CODE, _STR_CODE, _EOF_CODE = map(TOKEN_TYPE_CODES.__getitem__, (
+    TokenType.IDENTIFIER, TokenType.UINT_LITERAL, TokenType.DBL_LITERAL, TokenType.STR_LITERAL, TokenType.EOF_TOKEN
+))
+_EOF_VALS = ('EOF sentry', 'EOF sentry for meta peek')
+
+
+class CompactTokenBuffer(object):
+    r"""
+    Stores tokens as a struct of arrays instead of a list of `Token`s:
+        
+        * types: array('B'), the code of the token type (an index of `TOKEN_TYPES`)
+        * payloads: array('q'), the value of an unsigned integer literal, or an index of the interned identifiers,
+          the interned doubles or the string literals
+        * offsets: array('I'), the offset of the token in the source
+    
+    `Token`s are only materialized when they are read (`token_at`), and the ones of key words, symbols and identifiers
+    are shared, so reading does not allocate for most tokens.
+    
+    """
+    
+    def __init__(self, str_literals: List[str]):
+        self.types, self.payloads, self.offsets = array('B'), array('q'), array('I')
+        self.str_literals = str_literals
+        self.idents: List[str] = []
+        self.dbls: List[float] = []
+        self._dbl_indices: Dict[float, int] = {}
+        # word -> (type code, payload); key words and symbols are known in advance, identifiers are interned on the fly
+        self._words: Dict[str, Tuple[int, int]] = {w: (TOKEN_TYPE_CODES[tt], 0) for w, tt in STR_TO_TOKEN_TYPE.items()}
+        self._const_tokens: List[Token] = [Token(tt, tt.value) for tt in TOKEN_TYPES]
+        self._ident_tokens: List[Token] = []
+    
+    def __len__(self):
+        return len(self.types)
+    
+    def __iter__(self) -> Iterator[Token]:
+        return map(self.token_at, range(len(self.types)))
+    
+    def push_word(self, w: str, offset: int):
+        code_payload = self._words.get(w, None)
+        if code_payload is None:
+            code_payload = self._words[w] = (_IDENT_CODE, len(self.idents))
+            self.idents.append(w)
+            self._ident_tokens.append(Token(TokenType.IDENTIFIER, w))
+        self.types.append(code_payload[0])
+        self.payloads.append(code_payload[1])
+        self.offsets.append(offset)
+    
+    def push_uint(self, val: int, offset: int):
+        self.types.append(_UINT_CODE)
+        self.payloads.append(val - (1 << 64) if val >= 1 << 63 else val)   # stored as the i64 of the same bits
+        self.offsets.append(offset)
+    
+    def push_dbl(self, val: float, offset: int):
+        idx = self._dbl_indices.get(val, None)
+        if idx is None:
+            idx = self._dbl_indices[val] = len(self.dbls)
+            self.dbls.append(val)
+        self.types.append(_DBL_CODE)
+        self.payloads.append(idx)
+        self.offsets.append(offset)
+    
+    def push_str(self, str_literal_idx: int, offset: int):
+        self.types.append(_STR_CODE)
+        self.payloads.append(str_literal_idx)
+        self.offsets.append(offset)
+    
+    def push_eof_sentries(self, offset: int):
+        for i in range(len(_EOF_VALS)):
+            self.types.append(_EOF_CODE)
+            self.payloads.append(i)
+            self.offsets.append(offset)
+    
+    def token_at(self, i: int) -> Token:
+        code, p = self.types[i], self.payloads[i]
+        if code == _IDENT_CODE:
+            return self._ident_tokens[p]
+        elif code == _UINT_CODE:
+            return Token(TokenType.UINT_LITERAL, p if p >= 0 else p + (1 << 64))
+        elif code == _DBL_CODE:
+            return Token(TokenType.DBL_LITERAL, self.dbls[p])
+        elif code == _STR_CODE:
+            return Token(TokenType.STR_LITERAL, p)
+        elif code == _EOF_CODE:
+            return Token(TokenType.EOF_TOKEN, _EOF_VALS[p])
+        return self._const_tokens[code]
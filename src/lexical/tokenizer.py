@@ -3,12 +3,19 @@
 # All rights reserved.
 
 import logging
+from collections import deque
 from pprint import pformat
-from typing import List, Optional, Tuple
+from typing import IO, Any, Callable, Iterator, List, Tuple, Union
 
-from lexical.lex_err import UnknownTokenErr
-from lexical.str_utils import is_identifier, is_decimal, remove_inline_comment, extract_str_dbl_chr_literals, STR_LITERAL_REFERENCE, DBL_LITERAL_REFERENCE
-from lexical.tokentype import Token, TokenType, STR_TO_TOKEN_TYPE, SPREADING_OPERANDS, SHRINKING_OPERANDS
+from lexical.lex_err import QuoteMismatchErr, UnknownTokenErr
+from lexical.str_utils import token_reg, unknown_word_reg, escaping
+from lexical.token_buffer import CompactTokenBuffer
+from lexical.tokentype import Token, TokenType, STR_TO_TOKEN_TYPE
+from utils.log import LazyFmt
+from utils.profiler import PhaseProfiler, NULL_PROFILER
+
+# called with the value of a token and its offset in the input
+_OnLexeme = Callable[[Any, int], Any]
 
 
 class LexicalTokenizer(object):
@@ -17,18 +24,24 @@ class LexicalTokenizer(object):
     
     Methods:
     
-        parse_tokens_from_raw_input:
-            Parses all tokens from the separated words
+        parse_tokens:
+            Parses all tokens from the raw input
         
-        _pre_process:
-            Performs pre-processing for the later lexical analysis, including:
+        iter_tokens:
+            Generates tokens one by one; when the raw input is a file, it is read in chunks of whole lines so that
+            only one chunk is kept in memory
         
-            * Comments removing.
-            * Literals extracting.
-            * Words splitting.
-    
-        _extract_str_dbl_chr_literals:
-            Extracts string, double and character literals, converting them to references or integer values.
+        parse_compact_tokens:
+            Parses all tokens into a `CompactTokenBuffer` (a struct of arrays) instead of a list of `Token`s
+        
+        _lex:
+            Sweeps over the raw input once with the master pattern `str_utils.token_reg` for both `_scan` (tokens)
+            and `_scan_into` (a `CompactTokenBuffer`), including:
+        
+            * Comments and blanks skipping.
+            * Literals extracting (string literals are collected to `str_literals` and referenced by their indices;
+              character literals are converted to integer values).
+            * Key words, symbols and identifiers recognizing.
     
     Examples:
     
@@ -40,40 +53,99 @@ class LexicalTokenizer(object):
     
     """
     
-    def __init__(self, lg: logging.Logger, raw_input: str):
-        self.lg, self.raw_input = lg, raw_input
+    def __init__(self, lg: logging.Logger, raw_input: Union[str, IO[str]], chunk_size: int = 1 << 16, prof: PhaseProfiler = NULL_PROFILER):
+        self.lg, self.raw_input, self.prof = lg, raw_input, prof
+        self._chunk_size = chunk_size
+        self._str_literals: List[str] = []
+        # tokens are immutable, so the one of a key word, a symbol or an identifier can be shared by all its occurrences
+        self._word_tokens = {w: Token(tt, w) for w, tt in STR_TO_TOKEN_TYPE.items()}
+    
+    @property
+    def str_literals(self) -> List[str]:
+        # the string literals scanned so far (it grows while `iter_tokens` is being consumed)
+        return self._str_literals
     
     def parse_tokens(self) -> Tuple[List[Token], List[str]]:
-        words, str_literals, dbl_literals = self._pre_process(self.raw_input)
-        tokens = []
-        for w in words:
-            token_type = STR_TO_TOKEN_TYPE.get(w, None)
-            if token_type is not None:              # parse any key word or symbol
-                tokens.append(Token(token_type=token_type, val=w))
-            elif is_identifier(w):                  # parse an identifier
-                tokens.append(Token(token_type=TokenType.IDENTIFIER, val=w))
-            elif is_decimal(w):                     # parse a literal of `unsigned integer'
-                tokens.append(Token(token_type=TokenType.UINT_LITERAL, val=int(w)))
-            elif w[0] == STR_LITERAL_REFERENCE:     # parse a literal of `string'
-                tokens.append(Token(token_type=TokenType.STR_LITERAL, val=int(w[1:])))
-            elif w[0] == DBL_LITERAL_REFERENCE:     # parse a literal of `double'
-                tokens.append(Token(token_type=TokenType.DBL_LITERAL, val=dbl_literals[int(w[1:])]))
-            else:                                   # parsing failed
-                raise UnknownTokenErr(f'"{w}"')
-        tokens.append(Token(token_type=TokenType.EOF_TOKEN, val='EOF sentry'))
-        tokens.append(Token(token_type=TokenType.EOF_TOKEN, val='EOF sentry for meta peek'))
+        with self.prof.phase('lex'):
+            tokens = list(self.iter_tokens())
+        str_literals = self._str_literals
         self.lg.info(
-            f'\nstring literals:\n {pformat({f"{STR_LITERAL_REFERENCE}{i}": s for i, s in enumerate(str_literals)})}'
-            f'\nparsed tokens:\n {pformat(tokens)}\n'
+            '\nstring literals:\n %s\nparsed tokens:\n %s\n',
+            LazyFmt(lambda: pformat(dict(enumerate(str_literals)))), LazyFmt(pformat, tokens)
         )
         return tokens, str_literals
     
-    def _pre_process(self, raw_input):
-        lines = map(remove_inline_comment, filter(len, raw_input.splitlines()))
-        codes, str_literals, dbl_literals = extract_str_dbl_chr_literals('\n'.join(lines))
+    def iter_tokens(self) -> Iterator[Token]:
+        for codes, _ in self._iter_chunks():
+            yield from self._scan(codes)
+        yield Token(token_type=TokenType.EOF_TOKEN, val='EOF sentry')
+        yield Token(token_type=TokenType.EOF_TOKEN, val='EOF sentry for meta peek')
+    
+    def parse_compact_tokens(self) -> CompactTokenBuffer:
+        with self.prof.phase('lex'):
+            buf = CompactTokenBuffer(self._str_literals)
+            end = 0
+            for codes, base in self._iter_chunks():
+                self._scan_into(buf, codes, base)
+                end = base + len(codes)
+            buf.push_eof_sentries(end)
+        return buf
+    
+    def _iter_chunks(self) -> Iterator[Tuple[str, int]]:
+        if isinstance(self.raw_input, str):
+            yield self.raw_input, 0
+            return
+        tail, base = '', 0
+        while True:
+            chunk = self.raw_input.read(self._chunk_size)
+            if not chunk:
+                break
+            # no token spans lines, so the chunk is only scanned up to its last line break
+            codes, lf, tail = (tail + chunk).rpartition('\n')
+            codes += lf
+            yield codes, base
+            base += len(codes)
+        yield tail, base
+    
+    def _scan(self, codes: str) -> Iterator[Token]:
+        word_tokens, ident_tt = self._word_tokens, TokenType.IDENTIFIER
+        uint_tt, dbl_tt, str_tt = TokenType.UINT_LITERAL, TokenType.DBL_LITERAL, TokenType.STR_LITERAL
         
-        for k, v in [*SPREADING_OPERANDS.items(), *SHRINKING_OPERANDS.items()]:
-            codes = codes.replace(k, v)
+        def word(w: str, _) -> Token:       # the token of a key word, a symbol or an identifier is shared
+            tok = word_tokens.get(w, None)
+            if tok is None:
+                tok = word_tokens[w] = Token(ident_tt, w)
+            return tok
         
-        self.lg.info(f'\ncodes after pre-processing:\n{codes}@EOF\n')
-        return codes.split(), str_literals, dbl_literals
+        return self._lex(
+            codes, word, lambda v, _: Token(uint_tt, v), lambda v, _: Token(dbl_tt, v), lambda v, _: Token(str_tt, v),
+        )
+    
+    def _scan_into(self, buf: CompactTokenBuffer, codes: str, base: int):
+        deque(self._lex(codes, buf.push_word, buf.push_uint, buf.push_dbl, buf.push_str, base), maxlen=0)
+    
+    def _lex(
+            self, codes: str, word: _OnLexeme, uint: _OnLexeme, dbl: _OnLexeme, string: _OnLexeme, base: int = 0,
+    ) -> Iterator:
+        # yields what `word`, `uint`, `dbl` or `string` gives for each token, called with its value and its offset
+        str_literals = self._str_literals
+        for m in token_reg.finditer(codes):
+            kind = m.lastgroup
+            w = m.group(kind)
+            if kind == 'word' or kind == 'op':  # parse any key word, symbol or identifier
+                yield word(w, base + m.start(kind))
+            elif kind == 'uint':                # parse a literal of `unsigned integer'
+                yield uint(int(w), base + m.start(kind))
+            elif kind == 'dbl':                 # parse a literal of `double'
+                yield dbl(float(w), base + m.start(kind))
+            elif kind == 'str':                 # parse a literal of `string'
+                yield string(len(str_literals), base + m.start(kind))
+                str_literals.append(escaping(w[1:-1]))
+            elif kind == 'chr':                 # parse a literal of `char' (as an `unsigned integer')
+                yield uint(ord(escaping(w[1:-1])), base + m.start(kind))
+            elif kind == 'eof':
+                return
+            elif kind == 'quote':
+                raise QuoteMismatchErr('quote missing')
+            else:                               # parsing failed
+                raise UnknownTokenErr(f'"{unknown_word_reg.match(codes, m.start(kind)).group()}"')
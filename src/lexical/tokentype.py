@@ -6,8 +6,6 @@ from collections import OrderedDict
 from enum import Enum, unique, auto
 from typing import NamedTuple, Union
 
-from lexical.str_utils import is_alpha
-
 
 @unique
 class TokenType(Enum):
@@ -125,8 +123,3 @@ __s_to_tk = [
 ]
 
 STR_TO_TOKEN_TYPE = OrderedDict(sorted(__s_to_tk, key=lambda pair: len(pair[0])))
-
-SHRINKING_OPERANDS = {(' ' * sum(c in STR_TO_TOKEN_TYPE for c in k)).join(k): k for k in STR_TO_TOKEN_TYPE if not is_alpha(k) and len(k) > 1}
-
-__spreads = [*filter(lambda k: len(k) == 1, STR_TO_TOKEN_TYPE), *SHRINKING_OPERANDS]
-SPREADING_OPERANDS = OrderedDict((k, f' {k} ') for k in __spreads)
@@ -3,66 +3,91 @@
 # All rights reserved.
 
 import logging
-from typing import List, Union
+import struct
+from typing import Dict, List, Optional, Tuple, Union
 
 from obj.byte_casting import *
-from syntactic.symbol.table import VarAttrs, FuncAttrs
-from vm.instruction import Instruction
+from syntactic.symbol.table import VarAttrs, FuncAttrs, StrConstAttrs
+from utils.profiler import PhaseProfiler, NULL_PROFILER
+from vm.instruction import Instruction, InstrType, OPERAND_SIZES
 
 
-class _VerboseBArr(bytearray):
-    def __init__(self, hints: List[str]):
-        super(_VerboseBArr, self).__init__()
-        self.hints = hints
+O0_MAGIC_NUM, O0_VERSION = 0x72303b3e, 0x1
 
-    def append(self, obj, hint: str) -> None:
-        super(_VerboseBArr, self).append(obj)
-        self.hints.append(f'{hint:17s}: {obj:02x}')
 
-    def extend(self, byts, hint: str) -> None:
-        super(_VerboseBArr, self).extend(byts)
-        if hint.endswith('str'):
-            s = ' '.join(f' {chr(x)}' for x in byts)
-        else:
-            s = ' '.join(f'{x:02x}' for x in byts)
-        self.hints.append(f'{hint:17s}: {s}')
-    
-    # def join(self, __iterable_of_bytes, hint: str):
-    #     _new = _VerboseBArr(self.hints)
-    #     _new.extend(bytes(bytearray().join(__iterable_of_bytes)), hint)
-    #     return _new
-    
+def _instr_layout(it: InstrType, operand_cls: type) -> Tuple[int, Optional[struct.Struct]]:
+    if operand_cls is type(None):
+        return it.value, None
+    if operand_cls is float:
+        return it.value, INSTR_F64_OPERAND
+    if OPERAND_SIZES[it] == 8:
+        return it.value, INSTR_U64_OPERAND
+    signed = Instruction(it).operand_signed
+    return it.value, INSTR_I32_OPERAND if signed else INSTR_U32_OPERAND
+
 
 class Assembler(object):
+    r"""
+    Encodes the global symbols and the functions into the bytes of an o0 file.
+    
+    The size of the whole file is computed first and the buffer is allocated once; every header and instruction is
+    then written in place with the precompiled `struct.Struct` layouts of `obj.byte_casting`. The layout of an
+    instruction (no operand, u32, i32, u64 or f64) only depends on its type and the python type of its operand, so it
+    is looked up in a cache instead of being decided by branches for each instruction.
+    
+    """
+    
+    # (instruction type, type of the operand) -> (opcode, layout of the opcode and the operand or None)
+    _layouts: Dict[Tuple[InstrType, type], Tuple[int, Optional[struct.Struct]]] = {}
+    
     def __init__(
             self, lg: logging.Logger,
-            str_literals: List[str],
-            global_symbols: List[Union[VarAttrs, FuncAttrs]],
+            global_symbols: List[Union[VarAttrs, StrConstAttrs]],
             global_funcs: List[FuncAttrs],
+            prof: PhaseProfiler = NULL_PROFILER,
     ):
         super(Assembler, self).__init__()
-        self.lg = lg
-        self._hints: List[str] = []
-        self._magic_num, self._version = 0x72303b3e, 0x1
-        self._str_literals = str_literals
+        self.lg, self.prof = lg, prof
         self._global_symbols, self._global_funcs = global_symbols, global_funcs
-        self._barr = _VerboseBArr(self._hints)
-        self._barr.extend(u32_to_bytes(self._magic_num), 'magic num')
-        self._barr.extend(u32_to_bytes(self._version), 'version')
+        # plain bytes only; a human-readable listing can be decoded from them afterwards (see `obj.listing`)
+        self._barr = bytearray()
+        self._pos = 0
         self._dumped = False
     
     def dump(self):
         if not self._dumped:
-            self._dumped = True
-            self._dump_global_symbols()
-            self._dump_functions()
+            with self.prof.phase('assemble'):
+                self._dumped = True
+                bodies = [self._layouts_of(f.instructions) for f in self._global_funcs]
+                self._barr = bytearray(self._file_size(bodies))
+                self._pos = 0
+                self._put_u32(O0_MAGIC_NUM)
+                self._put_u32(O0_VERSION)
+                self._dump_global_symbols()
+                self._dump_functions(bodies)
         return self._barr
     
-    def _dump_str_literals(self):
-        for s in self._str_literals:
-            self._barr.append(1, ' const')
-            self._barr.extend(u32_to_bytes(len(s)), ' len(str ltr)')
-            self._barr.extend(str_to_bytes(s), ' str')
+    def _layouts_of(self, instrs: List[Instruction]) -> Tuple[List[Tuple[int, Optional[struct.Struct]]], int]:
+        layouts, get = self._layouts, self._layouts.get
+        res = []
+        for instr in instrs:
+            key = (instr.instr_type, instr.operand.__class__)
+            layout = get(key, None)
+            if layout is None:
+                layout = layouts[key] = _instr_layout(*key)
+            res.append(layout)
+        size = sum(1 if st is None else st.size for _, st in res)
+        return res, size
+    
+    def _file_size(self, bodies) -> int:
+        size = 4 + 4 + 4 + 4  # magic, version, the count of global symbols, the count of functions
+        for s in self._global_symbols:
+            size += GLOBAL_HEADER.size + (len(s.val) if isinstance(s, StrConstAttrs) else 8)
+        return size + sum(FUNC_HEADER.size + body_size for _, body_size in bodies)
+    
+    def _put_u32(self, u32: int):
+        U32.pack_into(self._barr, self._pos, u32)
+        self._pos += 4
     
     def _dump_global_symbols(self):
         """
@@ -70,11 +95,10 @@ class Assembler(object):
             count: u32,
             items: global_symbol[],
         """
-        self._barr.extend(u32_to_bytes(len(self._str_literals) + len(self._global_symbols)), 'num globals')
-        self._dump_str_literals()
+        self._put_u32(len(self._global_symbols))
         [self._dump_a_global_symbol(s) for s in self._global_symbols]
     
-    def _dump_a_global_symbol(self, symbol: Union[VarAttrs, FuncAttrs]):
+    def _dump_a_global_symbol(self, symbol: Union[VarAttrs, StrConstAttrs]):
         """
         .. note::
             is_const: u8,
@@ -82,25 +106,29 @@ class Assembler(object):
                 count: u32
                 items: u8[],
         """
-        if symbol.is_func():
-            self._barr.append(1, ' const')
-            self._barr.extend(u32_to_bytes(len(symbol.name)), ' len(func name)')
-            self._barr.extend(str_to_bytes(symbol.name), ' func name str')
+        pos = self._pos + GLOBAL_HEADER.size
+        if isinstance(symbol, StrConstAttrs):
+            val = str_to_bytes(symbol.val)
+            GLOBAL_HEADER.pack_into(self._barr, self._pos, 1, len(val))
+            self._barr[pos:pos + len(val)] = val
+            self._pos = pos + len(val)
         else:
-            self._barr.append(int(symbol.const), ' const')
-            self._barr.extend(u32_to_bytes(8), ' num gvar btyes')
-            self._barr.extend(u64_to_bytes(0), ' gvar values')
-            
-    def _dump_functions(self):
+            GLOBAL_HEADER.pack_into(self._barr, self._pos, int(symbol.const), 8)
+            v = symbol.static_val
+            if v is not None:       # else zero-initialized, and the buffer is already zero-filled
+                (GLOBAL_F64_VALUE if v.__class__ is float else GLOBAL_I64_VALUE).pack_into(self._barr, pos, v)
+            self._pos = pos + 8
+    
+    def _dump_functions(self, bodies):
         """
         .. note::
             count: u32,
             items: function[],
         """
-        self._barr.extend(u32_to_bytes(len(self._global_funcs)), 'num funcs')
-        [self._dump_a_function(f) for f in self._global_funcs]
+        self._put_u32(len(self._global_funcs))
+        [self._dump_a_function(f, layouts) for f, (layouts, _) in zip(self._global_funcs, bodies)]
     
-    def _dump_a_function(self, func: FuncAttrs):
+    def _dump_a_function(self, func: FuncAttrs, layouts: List[Tuple[int, Optional[struct.Struct]]]):
         """
         .. note::
             name: u32,
@@ -111,29 +139,26 @@ class Assembler(object):
                 count: u32,
                 items: Instruction[]
         """
-        metas = [func.offset, func.num_ret_vals, len(func.arg_types), func.num_local_vars]
-        [self._barr.extend(u32_to_bytes(m), hint) for m, hint in zip(
-            metas,
-            [' func idx', ' num rets', ' num args', ' num loc vars']
-        )]
-        
-        self._barr.extend(u32_to_bytes(len(func.instructions)), ' num instrs')
-        [self._dump_an_instruction(i) for i in func.instructions]
-        
-    def _dump_an_instruction(self, instr: Instruction):
+        FUNC_HEADER.pack_into(
+            self._barr, self._pos,
+            func.offset, func.num_ret_vals, len(func.arg_types), func.num_local_vars, len(func.instructions)
+        )
+        self._pos += FUNC_HEADER.size
+        self._dump_instructions(func.instructions, layouts)
+    
+    def _dump_instructions(self, instrs: List[Instruction], layouts: List[Tuple[int, Optional[struct.Struct]]]):
         """
         .. note::
             code: u8
             or code: u8, operand: u32,
             or code: u8, operand: u64,
         """
-        self._barr.append(instr.instr_type.value, f'  instr {instr.instr_type.name.lower()}')
-        if instr.operand is not None:
-            if instr.op_is_int:
-                if instr.operand_signed:
-                    cvt = i32_to_bytes
-                else:
-                    cvt = u32_to_bytes if instr.operand_32bits else u64_to_bytes
+        barr, pos = self._barr, self._pos
+        for instr, (code, st) in zip(instrs, layouts):
+            if st is None:
+                barr[pos] = code
+                pos += 1
             else:
-                cvt = f64_to_bytes
-            self._barr.extend(cvt(instr.operand), '  instr op')
+                st.pack_into(barr, pos, code, instr.operand)
+                pos += st.size
+        self._pos = pos
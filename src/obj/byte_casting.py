@@ -16,9 +16,22 @@ u64arr_to_bytes = lambda u64arr: u32_to_bytes(len(u64arr)) + bytearray().join(ma
 str_to_bytes = lambda s: bytes(s, encoding='ascii')
 
 
+# precompiled layouts of an encoded instruction (opcode + operand), used by the batched encoder of `Assembler`
+INSTR_NO_OPERAND = struct.Struct('>B')
+INSTR_U32_OPERAND = struct.Struct('>BL')
+INSTR_I32_OPERAND = struct.Struct('>Bl')
+INSTR_U64_OPERAND = struct.Struct('>BQ')
+INSTR_F64_OPERAND = struct.Struct('>Bd')
+U32 = struct.Struct('>L')
+GLOBAL_HEADER = struct.Struct('>BL')                    # is_const: u8, count: u32
+FUNC_HEADER = struct.Struct('>LLLLL')                   # name, num_ret_vals, num_args, num_loc_vars, count: u32
+# the value of a global is copied into the memory of the machine as it is, so it is little-endian (as navm loads it)
+GLOBAL_I64_VALUE = struct.Struct('<q')
+GLOBAL_F64_VALUE = struct.Struct('<d')
+
+
 if __name__ == '__main__':
     print(f64_to_bytes(-2 ** -1))
     print(str_to_bytes('1122'))
     print(u8arr_to_bytes([49, 49, 50, 50]))
     print(u32arr_to_bytes([49, 49, 50, 50]))
-
@@ -0,0 +1,72 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import struct
+from typing import Iterator
+
+from vm.instruction import InstrType, OPERAND_SIZES
+
+_U32 = struct.Struct('>L')
+_OP_NAMES = {it.value: it.name.lower() for it in InstrType}
+_OP_SIZES = {it.value: size for it, size in OPERAND_SIZES.items()}
+
+
+def _fmt(hint: str, byts) -> str:
+    return f'{hint:17s}: {" ".join(f"{x:02x}" for x in byts)}'
+
+
+def _fmt_str(hint: str, byts) -> str:
+    return f'{hint:17s}: {" ".join(f" {chr(x)}" for x in byts)}'
+
+
+def iter_listing(data: bytes) -> Iterator[str]:
+    r"""
+    Decodes an o0 file produced by `Assembler` into a human-readable listing, one line per field:
+        
+        magic num        : 72 30 3b 3e
+        ...
+          instr push     : 01
+          instr op       : 00 00 00 00 00 00 00 0a
+    
+    The listing is generated lazily from the finished bytes, so nothing is paid for it unless it is asked for.
+    
+    """
+    mv = memoryview(data)
+    p = 0
+    
+    def take(n: int):
+        nonlocal p
+        p += n
+        return mv[p - n:p]
+    
+    def take_u32(hint: str):
+        byts = take(4)
+        return _U32.unpack(byts)[0], _fmt(hint, byts)
+    
+    yield _fmt('magic num', take(4))
+    yield _fmt('version', take(4))
+    
+    num_globals, line = take_u32('num globals')
+    yield line
+    for _ in range(num_globals):
+        yield _fmt(' const', take(1))
+        n, line = take_u32(' len(value)')
+        yield line
+        value = take(n)
+        printable = n != 8 and all(0x20 <= x < 0x7f for x in value)
+        yield _fmt_str(' str', value) if printable else _fmt(' value', value)
+    
+    num_funcs, line = take_u32('num funcs')
+    yield line
+    for _ in range(num_funcs):
+        for hint in (' func idx', ' num rets', ' num args', ' num loc vars'):
+            yield take_u32(hint)[1]
+        num_instrs, line = take_u32(' num instrs')
+        yield line
+        for _ in range(num_instrs):
+            code = take(1)
+            yield _fmt(f'  instr {_OP_NAMES[code[0]]}', code)
+            size = _OP_SIZES.get(code[0], 0)
+            if size:
+                yield _fmt('  instr op', take(size))
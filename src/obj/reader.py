@@ -0,0 +1,191 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import mmap
+import struct
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from obj.assembler import O0_MAGIC_NUM, O0_VERSION
+from vm.instruction import InstrType, OPERAND_SIZES
+
+_U32, _I32, _I64 = struct.Struct('>L'), struct.Struct('>l'), struct.Struct('>q')
+_FUNC_HEADER = struct.Struct('>LLLLL')
+_INSTR_TYPES = {it.value: it for it in InstrType}
+_OP_SIZES = bytes(OPERAND_SIZES.get(_INSTR_TYPES.get(code, InstrType.NOP), 0) for code in range(256))
+_OPERAND_READERS = {
+    it.value: (_I64 if size == 8 else _I32 if it in {InstrType.BR, InstrType.BR_FALSE, InstrType.BR_TRUE} else _U32)
+    for it, size in OPERAND_SIZES.items()
+}
+
+
+class O0FormatError(Exception):
+    pass
+
+
+class O0GlobalView(NamedTuple):
+    idx: int
+    is_const: bool
+    value: memoryview           # a view into the file, not a copy
+
+
+class O0FuncView(NamedTuple):
+    idx: int
+    name_idx: int               # the index of the global holding the name
+    num_ret_vals: int
+    num_args: int
+    num_loc_vars: int
+    num_instrs: int
+    body_start: int             # the byte offsets of the instructions in the file
+    body_end: int
+
+
+class O0Reader(object):
+    r"""
+    Reads an o0 file (see `Assembler`) in place: the file is `mmap`ed and every field is read from a `memoryview`
+    with `struct.unpack_from`, so nothing is copied and nothing is decoded before it is asked for.
+    
+    Opening only walks the global section (one read per global). Functions are found by walking the instruction
+    stream with the operand sizes of the opcodes, without decoding the operands, and their offsets are remembered;
+    the instructions of a function are decoded lazily by `iter_instructions`.
+    
+    .. note::
+        magic: u32, version: u32,
+        globals: (count: u32, items: (is_const: u8, count: u32, items: u8[])[]),
+        functions: (count: u32, items: (name: u32, num_ret_vals: u32, num_args: u32, num_loc_vars: u32,
+                                        body: (count: u32, items: instr[]))[])
+    
+    Examples:
+        
+        >>> with O0Reader.open('a.o0') as r:
+        >>>     for f in r.iter_functions():
+        >>>         print(r.global_str(f.name_idx), list(r.iter_instructions(f)))
+    
+    """
+    
+    def __init__(self, data: Union[bytes, bytearray, memoryview, mmap.mmap]):
+        self._mm = data if isinstance(data, mmap.mmap) else None
+        self._mv = memoryview(data)
+        self._globals: List[Tuple[int, int]] = []   # (offset of is_const, length of the value) of each global
+        self._funcs: List[O0FuncView] = []          # the functions walked so far
+        self._next_func_pos = 0
+        self._read_header()
+    
+    @classmethod
+    def open(cls, path: str):
+        with open(path, 'rb') as fp:
+            try:
+                mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:      # an empty file cannot be mapped
+                return cls(b'')
+        return cls(mm)
+    
+    def close(self):
+        self._mv.release()
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:     # views from `global_at` are still alive; the mapping goes away with them
+                pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def _unpack(self, st: struct.Struct, pos: int):
+        try:
+            return st.unpack_from(self._mv, pos)
+        except struct.error:
+            raise O0FormatError(f'truncated o0 file (reading {st.size} bytes at {pos})')
+    
+    def _read_header(self):
+        magic, = self._unpack(_U32, 0)
+        version, = self._unpack(_U32, 4)
+        if magic != O0_MAGIC_NUM or version != O0_VERSION:
+            raise O0FormatError(f'not an o0 file (magic={magic:#x}, version={version})')
+        num_globals, = self._unpack(_U32, 8)
+        p = 12
+        for _ in range(num_globals):
+            n, = self._unpack(_U32, p + 1)
+            self._globals.append((p, n))
+            p += 5 + n
+        if p > len(self._mv):
+            raise O0FormatError('truncated o0 file (in the globals)')
+        self.num_funcs, = self._unpack(_U32, p)
+        self._next_func_pos = p + 4
+    
+    @property
+    def size(self) -> int:
+        return len(self._mv)
+    
+    @property
+    def num_globals(self) -> int:
+        return len(self._globals)
+    
+    def global_at(self, idx: int) -> O0GlobalView:
+        p, n = self._globals[idx]
+        return O0GlobalView(idx=idx, is_const=bool(self._mv[p]), value=self._mv[p + 5:p + 5 + n])
+    
+    def iter_globals(self) -> Iterator[O0GlobalView]:
+        return map(self.global_at, range(len(self._globals)))
+    
+    def global_str(self, idx: int) -> str:
+        return bytes(self.global_at(idx).value).decode('ascii', errors='replace')
+    
+    def func_at(self, idx: int) -> O0FuncView:
+        if not 0 <= idx < self.num_funcs:
+            raise IndexError(f'function #{idx} does not exist')
+        while len(self._funcs) <= idx:
+            self._walk_next_func()
+        return self._funcs[idx]
+    
+    def iter_functions(self) -> Iterator[O0FuncView]:
+        return map(self.func_at, range(self.num_funcs))
+    
+    def func_name(self, func: O0FuncView) -> str:
+        return self.global_str(func.name_idx) if func.name_idx < len(self._globals) else f'<global #{func.name_idx}>'
+    
+    def _walk_next_func(self):
+        p = self._next_func_pos
+        name_idx, num_ret, num_args, num_loc, num_instrs = self._unpack(_FUNC_HEADER, p)
+        p = start = p + _FUNC_HEADER.size
+        mv, sizes = self._mv, _OP_SIZES
+        try:
+            for _ in range(num_instrs):
+                p += 1 + sizes[mv[p]]
+        except IndexError:
+            raise O0FormatError(f'truncated o0 file (in the body of function #{len(self._funcs)})')
+        if p > len(mv):
+            raise O0FormatError(f'truncated o0 file (in the body of function #{len(self._funcs)})')
+        self._funcs.append(O0FuncView(
+            idx=len(self._funcs), name_idx=name_idx, num_ret_vals=num_ret, num_args=num_args, num_loc_vars=num_loc,
+            num_instrs=num_instrs, body_start=start, body_end=p,
+        ))
+        self._next_func_pos = p
+    
+    def iter_instructions(self, func: O0FuncView) -> Iterator[Tuple[InstrType, Optional[int]]]:
+        r"""
+        Decodes the body of a function into (`InstrType`, operand) pairs. The operand of `PUSH` is the i64 of its bits
+        (the format does not tell a double from an int), branch offsets are i32 and the other operands are u32.
+        """
+        mv, its, readers = self._mv, _INSTR_TYPES, _OPERAND_READERS
+        p = func.body_start
+        for _ in range(func.num_instrs):
+            code = mv[p]
+            it = its.get(code, None)
+            if it is None:
+                raise O0FormatError(f'unknown opcode {code:#04x} at byte {p}')
+            reader = readers.get(code, None)
+            if reader is None:
+                p += 1
+                yield it, None
+            else:
+                yield it, reader.unpack_from(mv, p + 1)[0]
+                p += 1 + reader.size
+    
+    def trailing_bytes(self) -> int:
+        if self.num_funcs:
+            self.func_at(self.num_funcs - 1)
+        return len(self._mv) - self._next_func_pos
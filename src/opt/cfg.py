@@ -0,0 +1,219 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from typing import Callable, Iterator, List, Optional, Set
+
+from syntactic.symbol.table import FuncAttrs
+from vm.instruction import Instruction, InstrType
+
+_BRANCHES = (InstrType.BR, InstrType.BR_FALSE, InstrType.BR_TRUE)
+_TERMINATORS = (InstrType.BR, InstrType.BR_FALSE, InstrType.BR_TRUE, InstrType.RET, InstrType.PANIC)
+
+
+class BasicBlock(object):
+    r"""
+    A run of instructions entered only at its first one: `body`, then an optional `term` (BR, BR_FALSE, BR_TRUE, RET
+    or PANIC). The control goes on to `target` when the branch of `term` is taken, and to `fall` when the block does
+    not end with BR/RET/PANIC (None if it falls off the end of the function, as `_start` does).
+    
+    `succs` and `preds` are derived from `target` and `fall` by `ControlFlowGraph.link`.
+    """
+    
+    def __init__(self, idx: int, body: List[Instruction], term: Optional[Instruction] = None):
+        self.idx, self.body, self.term = idx, body, term
+        self.target: Optional[BasicBlock] = None
+        self.fall: Optional[BasicBlock] = None
+        self.succs: List[BasicBlock] = []
+        self.preds: List[BasicBlock] = []
+    
+    @property
+    def instrs(self) -> List[Instruction]:
+        return self.body if self.term is None else self.body + [self.term]
+    
+    def __repr__(self):
+        edges = ', '.join(f'{k}=B{b.idx}' for k, b in (('target', self.target), ('fall', self.fall)) if b is not None)
+        return f'B{self.idx} ({len(self.body)} + {self.term and self.term.instr_type.name}{"; " + edges if edges else ""})'
+
+
+class ControlFlowGraph(object):
+    r"""
+    The basic blocks of a function, in their order in the code (`blocks[0]` is the entry).
+    
+    The blocks are cut at the targets of the branches and after BR/BR_FALSE/BR_TRUE/RET/PANIC; the branch
+    instructions keep their objects but their operands are ignored until `lower`, which lays the blocks out in order,
+    adds a BR after a block whose `fall` is not the next one (e.g. once blocks were removed or moved), and computes
+    `Instruction.ip` and the relative operands again. A branch to the end of the function (`_start` only) goes to an
+    empty last block.
+    
+    The blocks can be rewritten: their `body` freely, and the control flow by setting `term`, `target` and `fall`
+    (then `link` again).
+    
+    Examples:
+        
+        >>> cfg = ControlFlowGraph.from_func(func)
+        >>> cfg.remove_unreachable()
+        >>> cfg.to_func(func)
+    
+    """
+    
+    def __init__(self, name: str, blocks: List[BasicBlock]):
+        self.name, self.blocks = name, blocks
+        self.link()
+    
+    @staticmethod
+    def from_instrs(name: str, instrs: List[Instruction]) -> 'ControlFlowGraph':
+        n = len(instrs)
+        starts = {0} if n else set()
+        for ip, instr in enumerate(instrs):
+            if instr.instr_type in _TERMINATORS and ip + 1 < n:
+                starts.add(ip + 1)
+            if instr.instr_type in _BRANCHES:
+                t = ip + 1 + instr.operand
+                if not 0 <= t <= n:
+                    raise ValueError(f'{instr.instr_type.name} at #{ip} of "{name}" jumps out of the function (to #{t})')
+                starts.add(t)
+        starts = sorted(starts)
+        
+        blocks: List[BasicBlock] = []
+        block_at = {}
+        for k, st in enumerate(starts):
+            ed = starts[k + 1] if k + 1 < len(starts) else n
+            last = instrs[ed - 1] if ed > st else None
+            if last is not None and last.instr_type in _TERMINATORS:
+                b = BasicBlock(k, instrs[st:ed - 1], last)
+            else:
+                b = BasicBlock(k, instrs[st:ed])
+            block_at[st] = b
+            blocks.append(b)
+        
+        for k, b in enumerate(blocks):
+            nxt = blocks[k + 1] if k + 1 < len(blocks) else None
+            it = None if b.term is None else b.term.instr_type
+            if it in _BRANCHES:
+                b.target = block_at[starts[k] + len(b.body) + 1 + b.term.operand]
+            if it not in (InstrType.BR, InstrType.RET, InstrType.PANIC):
+                b.fall = nxt
+        return ControlFlowGraph(name, blocks)
+    
+    @staticmethod
+    def from_func(func: FuncAttrs) -> 'ControlFlowGraph':
+        return ControlFlowGraph.from_instrs(func.name, func.instructions)
+    
+    def link(self):
+        for b in self.blocks:
+            b.succs, b.preds = [], []
+        for b in self.blocks:
+            for s in (b.target, b.fall):
+                if s is not None and s not in b.succs:
+                    b.succs.append(s)
+                    s.preds.append(b)
+    
+    def reachable(self) -> Set[BasicBlock]:
+        seen, work = set(), self.blocks[:1]
+        while work:
+            b = work.pop()
+            if b not in seen:
+                seen.add(b)
+                work.extend(b.succs)
+        return seen
+    
+    def remove_unreachable(self) -> int:
+        r"""
+        Removes the blocks that cannot be reached from the entry, and returns the number of their instructions.
+        """
+        live = self.reachable()
+        removed = sum(len(b.instrs) for b in self.blocks if b not in live)
+        self.blocks = [b for b in self.blocks if b in live]
+        for k, b in enumerate(self.blocks):
+            b.idx = k
+        self.link()
+        return removed
+    
+    def rewrite(self, fn: Callable[[BasicBlock], Optional[List[Instruction]]]) -> int:
+        r"""
+        Replaces the body of each block with `fn(block)` unless it is None, and returns the change of the number of
+        instructions (negative if some were removed).
+        """
+        delta = 0
+        for b in self.blocks:
+            body = fn(b)
+            if body is not None:
+                delta += len(body) - len(b.body)
+                b.body = body
+        return delta
+    
+    def iter_instrs(self) -> Iterator[Instruction]:
+        for b in self.blocks:
+            yield from b.instrs
+    
+    def lower(self) -> List[Instruction]:
+        res: List[Instruction] = []
+        start_of = {}
+        fixups = []     # (branch, target block)
+        for k, b in enumerate(self.blocks):
+            start_of[b] = len(res)
+            res.extend(b.body)
+            if b.term is not None:
+                res.append(b.term)
+                if b.term.instr_type in _BRANCHES:
+                    fixups.append((b.term, b.target))
+            nxt = self.blocks[k + 1] if k + 1 < len(self.blocks) else None
+            if b.fall is not None and b.fall is not nxt:
+                br = Instruction(InstrType.BR)
+                res.append(br)
+                fixups.append((br, b.fall))
+        for ip, instr in enumerate(res):
+            instr.ip = ip
+        for br, t in fixups:
+            br.operand = start_of[t] - br.ip - 1
+        return res
+    
+    def to_func(self, func: FuncAttrs):
+        func.instructions[:] = self.lower()
+
+
+def remove_unreachable_blocks(global_funcs: List[FuncAttrs]) -> int:
+    r"""
+    Removes the blocks of the functions that cannot be reached from their entries (e.g. after a return in both arms of
+    an if), and returns the number of removed instructions.
+    """
+    removed = 0
+    for f in global_funcs:
+        cfg = ControlFlowGraph.from_func(f)
+        n = cfg.remove_unreachable()
+        if n:
+            cfg.to_func(f)
+            removed += n
+    return removed
+
+
+def check_round_trip(func: FuncAttrs):
+    r"""
+    Raises `AssertionError` unless lowering the graph of `func` gives back its instructions.
+    """
+    before = [(i.instr_type, i.operand) for i in func.instructions]
+    cfg = ControlFlowGraph.from_func(func)
+    for b in cfg.blocks:
+        assert all(s in cfg.blocks for s in b.succs) and all(b in s.preds for s in b.succs), f'bad edges at {b!r}'
+    after = [(i.instr_type, i.operand) for i in cfg.lower()]
+    assert before == after, f'the round trip of "{func.name}" changed its code'
+
+
+if __name__ == '__main__':      # python -m opt.cfg: the round trip over generated programs
+    import io
+    from bench.generator import C0ProgramGenerator, GenAxes
+    from lexical.tokenizer import LexicalTokenizer
+    from syntactic.analyzer import SyntacticAnalyzer
+    from utils.log import C0Logger
+    
+    lg = C0Logger(None)
+    num_funcs = 0
+    for seed in range(50):
+        axes = GenAxes(num_funcs=1 + seed % 6, if_chain_len=seed % 4, loop_nesting=1 + seed % 3, expr_depth=1 + seed % 3)
+        lex = LexicalTokenizer(lg=lg, raw_input=io.StringIO(C0ProgramGenerator(seed=seed, axes=axes).generate()))
+        _, global_funcs = SyntacticAnalyzer(lg=lg, tokens=lex.iter_tokens(), str_literals=lex.str_literals).analyze_tokens()
+        for f in global_funcs:
+            check_round_trip(f)
+        num_funcs += len(global_funcs)
+    print(f'round trip ok: {num_funcs} functions of 50 programs')
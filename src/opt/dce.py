@@ -0,0 +1,104 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from typing import Dict, List, NamedTuple, Set, Tuple, Union
+
+from obj.byte_casting import FUNC_HEADER, GLOBAL_HEADER
+from syntactic.symbol.table import FuncAttrs, StrConstAttrs, VarAttrs
+from vm.instruction import InstrType, OPERAND_SIZES
+
+GlobalSymbol = Union[VarAttrs, StrConstAttrs]
+
+
+class DeadCodeReport(NamedTuple):
+    removed_funcs: List[str]
+    removed_vars: int               # global variables and consts
+    removed_strs: List[str]         # string literals and names of functions (the builtins among them)
+    bytes_before: int               # of the globals and the functions in the o0 file
+    bytes_after: int
+    
+    def lines(self) -> List[str]:
+        return [
+            f'dead functions ({len(self.removed_funcs)}): {", ".join(self.removed_funcs) or "-"}',
+            f'dead global variables: {self.removed_vars}',
+            f'dead strings ({len(self.removed_strs)}): {", ".join(map(repr, self.removed_strs)) or "-"}',
+            f'object size: {self.bytes_before} -> {self.bytes_after} bytes (-{self.bytes_before - self.bytes_after})',
+        ]
+
+
+def _global_size(s: GlobalSymbol) -> int:
+    return GLOBAL_HEADER.size + (len(s.val) if isinstance(s, StrConstAttrs) else 8)
+
+
+def _func_size(f: FuncAttrs) -> int:
+    return FUNC_HEADER.size + sum(1 + OPERAND_SIZES.get(i.instr_type, 0) for i in f.instructions)
+
+
+def eliminate_dead_code(
+        global_symbols: List[GlobalSymbol], global_funcs: List[FuncAttrs], entry: str = '_start',
+) -> Tuple[List[GlobalSymbol], List[FuncAttrs], DeadCodeReport]:
+    r"""
+    Keeps the functions reachable from `entry` (which calls `main`) and the globals they refer to, and renumbers them.
+    
+    A function refers to the functions it calls (CALLNAME by the global holding the name of the callee, CALL by its
+    index), to the globals of its GLOBAs and to the string literals it pushes (`Instruction.global_ref`); every kept
+    function also keeps the string of its name. The kept globals and functions stay in their order, and their new
+    indices are written back into `VarAttrs.offset`, `StrConstAttrs.offset`, `FuncAttrs.offset` and the operands.
+    
+    Examples:
+        
+        >>> global_symbols, global_funcs, report = eliminate_dead_code(global_symbols, global_funcs)
+        >>> print('\n'.join(report.lines()))
+    
+    """
+    by_name_idx: Dict[int, int] = {f.offset: fi for fi, f in enumerate(global_funcs)}
+    by_name = {f.name: fi for fi, f in enumerate(global_funcs)}
+    used_globals: Set[int] = set()
+    live_funcs: Set[int] = set()
+    work = [by_name[entry]] if entry in by_name else []
+    while work:
+        fi = work.pop()
+        if fi in live_funcs:
+            continue
+        live_funcs.add(fi)
+        used_globals.add(global_funcs[fi].offset)
+        for instr in global_funcs[fi].instructions:
+            it, x = instr.instr_type, instr.operand
+            if it == InstrType.CALLNAME:
+                used_globals.add(x)
+                if x in by_name_idx:
+                    work.append(by_name_idx[x])
+            elif it == InstrType.CALL:
+                work.append(x)
+            elif it == InstrType.GLOBA or instr.global_ref:
+                used_globals.add(x)
+    
+    new_global_idx: Dict[int, int] = {}
+    kept_symbols = []
+    for s in global_symbols:
+        if s.offset in used_globals:
+            new_global_idx[s.offset] = len(kept_symbols)
+            kept_symbols.append(s)
+    new_func_idx = {fi: k for k, fi in enumerate(sorted(live_funcs))}
+    kept_funcs = [global_funcs[fi] for fi in sorted(live_funcs)]
+    
+    report = DeadCodeReport(
+        removed_funcs=[f.name for fi, f in enumerate(global_funcs) if fi not in live_funcs],
+        removed_vars=sum(isinstance(s, VarAttrs) and s.offset not in used_globals for s in global_symbols),
+        removed_strs=[s.val for s in global_symbols if isinstance(s, StrConstAttrs) and s.offset not in used_globals],
+        bytes_before=sum(map(_global_size, global_symbols)) + sum(map(_func_size, global_funcs)),
+        bytes_after=sum(map(_global_size, kept_symbols)) + sum(map(_func_size, kept_funcs)),
+    )
+    
+    for f in kept_funcs:
+        for instr in f.instructions:
+            it = instr.instr_type
+            if it == InstrType.CALLNAME or it == InstrType.GLOBA or instr.global_ref:
+                instr.operand = new_global_idx[instr.operand]
+            elif it == InstrType.CALL:
+                instr.operand = new_func_idx[instr.operand]
+        f.offset = new_global_idx[f.offset]
+    for s in kept_symbols:
+        s.offset = new_global_idx[s.offset]
+    return kept_symbols, kept_funcs, report
@@ -0,0 +1,69 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import operator
+from typing import Callable, Dict, Optional, Union
+
+from utils.ints import I64_MAX, I64_MIN, U64_MASK, wrap_i64
+from vm.instruction import InstrType
+
+Number = Union[int, float]
+
+
+def _div_i(a: int, b: int) -> Optional[int]:
+    if b == 0:
+        return None     # left to the machine, which raises
+    q = abs(a) // abs(b)
+    return wrap_i64(-q if (a < 0) != (b < 0) else q)
+
+
+def _div_f(a: float, b: float) -> Optional[float]:
+    return None if b == 0 else a / b
+
+
+def _ftoi(f: float) -> int:
+    return 0 if f != f else I64_MAX if f >= 2.0 ** 63 else I64_MIN if f < -2.0 ** 63 else int(f)
+
+
+# the instructions that can be computed at compile time, as `VirtualMachine` runs them (ints are i64, wrapped around)
+_BINARY: Dict[InstrType, Callable[[Number, Number], Optional[Number]]] = {
+    InstrType.ADD_I: lambda a, b: wrap_i64(a + b), InstrType.SUB_I: lambda a, b: wrap_i64(a - b),
+    InstrType.MUL_I: lambda a, b: wrap_i64(a * b), InstrType.DIV_I: _div_i,
+    InstrType.ADD_F: operator.add, InstrType.SUB_F: operator.sub, InstrType.MUL_F: operator.mul, InstrType.DIV_F: _div_f,
+    InstrType.CMP_I: lambda a, b: (a > b) - (a < b), InstrType.CMP_F: lambda a, b: (a > b) - (a < b),
+}
+_UNARY: Dict[InstrType, Callable[[Number], Optional[Number]]] = {
+    InstrType.NEG_I: lambda a: wrap_i64(-a), InstrType.NEG_F: operator.neg,
+    InstrType.ITOF: float, InstrType.FTOI: _ftoi,
+    InstrType.NOT: lambda a: 0 if a else 1,
+    InstrType.SET_LT: lambda a: 1 if a < 0 else 0, InstrType.SET_GT: lambda a: 1 if a > 0 else 0,
+}
+
+
+def fold_instr(it: InstrType, *operands: Number) -> Optional[Number]:
+    r"""
+    The result of the instruction `it` on constant operands (i64 ints or doubles), or None if it is not computed at
+    compile time: an unknown instruction, or a division by zero (whose error must happen at run time).
+    
+    Examples:
+        
+        >>> fold_instr(InstrType.MUL_I, 60 * 60, 24)
+        86400
+        >>> fold_instr(InstrType.ADD_I, I64_MAX, 1) == I64_MIN
+        True
+        >>> fold_instr(InstrType.DIV_I, 1, 0) is None
+        True
+    
+    """
+    fn = (_BINARY if len(operands) == 2 else _UNARY).get(it, None)
+    return None if fn is None else fn(*operands)
+
+
+def push_operand(v: Number) -> Number:
+    # the operand of the PUSH of a constant: a double as it is, an i64 as the u64 of its bits (as `Assembler` encodes it)
+    return v if v.__class__ is float else v & U64_MASK
+
+
+def value_of_push(operand: Number) -> Number:
+    return operand if operand.__class__ is float else wrap_i64(operand)
@@ -0,0 +1,234 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from syntactic.symbol.table import FuncAttrs
+from utils.ints import U64_MASK
+from vm.instruction import Instruction, InstrType
+
+_BRANCHES = (InstrType.BR, InstrType.BR_FALSE, InstrType.BR_TRUE)
+_NO_FALLTHROUGH = (InstrType.BR, InstrType.RET, InstrType.PANIC)
+_END = Instruction(InstrType.NOP)   # stands for the end of a function as a branch target
+
+
+class _Window(object):
+    r"""
+    What a rule can see: the instructions, the branch targets, and the position it is tried at.
+    """
+    
+    def __init__(self, instrs: List[Instruction], targets: Dict[int, Instruction], leaders: Set[int]):
+        self.instrs, self.targets, self.leaders = instrs, targets, leaders
+        self.i = 0
+    
+    def at(self, k: int) -> Optional[Instruction]:
+        # the k-th instruction from the position, if it can be part of a window starting there (not a branch target)
+        j = self.i + k
+        if j >= len(self.instrs) or (k and id(self.instrs[j]) in self.leaders):
+            return None
+        return self.instrs[j]
+    
+    def following(self, k: int) -> Instruction:
+        # the instruction after a window of k instructions (maybe `_END`)
+        j = self.i + k
+        return self.instrs[j] if j < len(self.instrs) else _END
+    
+    def target_of(self, br: Instruction) -> Instruction:
+        return self.targets[id(br)]
+    
+    def branch(self, it: InstrType, target: Instruction) -> Instruction:
+        br = Instruction(it, 0)
+        self.targets[id(br)] = target
+        self.leaders.add(id(target))
+        return br
+
+
+# a rule looks at the window at its position -> None, or (the number of instructions it replaces, the replacement)
+Rule = Callable[[_Window], Optional[Tuple[int, List[Instruction]]]]
+
+
+def _is(instr: Optional[Instruction], *its: InstrType) -> bool:
+    return instr is not None and instr.instr_type in its
+
+
+def _branch_to_next(w: _Window):
+    # BR 0, left at the end of the last block of an if/else chain
+    br = w.at(0)
+    if _is(br, InstrType.BR) and w.target_of(br) is w.following(1):
+        return 1, []
+
+
+def _thread_branch(w: _Window):
+    # BR to BR -> BR to the final target
+    br = w.at(0)
+    if not _is(br, InstrType.BR, InstrType.BR_FALSE, InstrType.BR_TRUE):
+        return None
+    t = w.target_of(br)
+    if _is(t, InstrType.BR) and w.target_of(t) is not t:
+        return 1, [w.branch(br.instr_type, w.target_of(t))]
+
+
+def _unreachable(w: _Window):
+    # BR/RET/PANIC; X -> BR/RET/PANIC when X is not a branch target (e.g. the BR of an if-block ending with a return)
+    a, b = w.at(0), w.at(1)
+    if _is(a, *_NO_FALLTHROUGH) and b is not None:
+        return 2, [a]
+
+
+def _not_branch(w: _Window):
+    # NOT; BR_FALSE t -> BR_TRUE t, NOT; BR_TRUE t -> BR_FALSE t (the tests of ==, >= and <=)
+    a, b = w.at(0), w.at(1)
+    if _is(a, InstrType.NOT) and _is(b, InstrType.BR_FALSE, InstrType.BR_TRUE):
+        it = InstrType.BR_TRUE if b.instr_type == InstrType.BR_FALSE else InstrType.BR_FALSE
+        return 2, [w.branch(it, w.target_of(b))]
+
+
+def _invert_branch(w: _Window):
+    # BR_TRUE l; BR t; l: -> BR_FALSE t, BR_FALSE l; BR t; l: -> BR_TRUE t (e.g. an if-block of just a break)
+    a, b = w.at(0), w.at(1)
+    if _is(a, InstrType.BR_FALSE, InstrType.BR_TRUE) and _is(b, InstrType.BR) and w.target_of(a) is w.following(2):
+        it = InstrType.BR_TRUE if a.instr_type == InstrType.BR_FALSE else InstrType.BR_FALSE
+        return 2, [w.branch(it, w.target_of(b))]
+
+
+def _double_not(w: _Window):
+    # NOT; NOT; NOT -> NOT (a double NOT only normalizes to 0/1, which a third NOT does not need)
+    a, b, c = w.at(0), w.at(1), w.at(2)
+    if _is(a, InstrType.NOT) and _is(b, InstrType.NOT) and _is(c, InstrType.NOT, InstrType.BR_FALSE, InstrType.BR_TRUE):
+        return 2, []
+
+
+def _neg_literal(w: _Window):
+    # PUSH c; NEG_I -> PUSH -c (as the bits of an i64), PUSH c; NEG_F -> PUSH -c
+    a, b = w.at(0), w.at(1)
+    if _is(a, InstrType.PUSH) and _is(b, InstrType.NEG_I) and isinstance(a.operand, int):
+        return 2, [Instruction(InstrType.PUSH, -a.operand & U64_MASK)]
+    if _is(a, InstrType.PUSH) and _is(b, InstrType.NEG_F) and isinstance(a.operand, float):
+        return 2, [Instruction(InstrType.PUSH, -a.operand)]
+
+
+def _store_reload(w: _Window):
+    # LOCA/ARGA/GLOBA n; PUSH c; STORE_64; LOCA/ARGA/GLOBA n; LOAD_64 -> LOCA/ARGA/GLOBA n; PUSH c; STORE_64; PUSH c
+    if not _is(w.at(2), InstrType.STORE_64):
+        return None
+    addr, val, store, addr2, load = (w.at(k) for k in range(5))
+    if (_is(val, InstrType.PUSH) and not val.global_ref and _is(load, InstrType.LOAD_64)
+            and _is(addr2, addr.instr_type) and addr2.operand == addr.operand):
+        return 5, [addr, val, store, Instruction(InstrType.PUSH, val.operand)]
+
+
+def _push_pop(w: _Window):
+    # PUSH c; POP, DUP; POP, LOCA/ARGA/GLOBA n; POP -> nothing
+    if _is(w.at(1), InstrType.POP):
+        return 2, []
+
+
+_ADDRS = (InstrType.LOCA, InstrType.ARGA, InstrType.GLOBA)
+_CONDS = (InstrType.BR_FALSE, InstrType.BR_TRUE)
+# name -> (the types of the first instruction of its windows, rule)
+RULES: Dict[str, Tuple[Tuple[InstrType, ...], Rule]] = {
+    'branch-to-next': ((InstrType.BR,), _branch_to_next),
+    'thread-branch': ((InstrType.BR,) + _CONDS, _thread_branch),
+    'unreachable': (_NO_FALLTHROUGH, _unreachable),
+    'not-branch': ((InstrType.NOT,), _not_branch),
+    'invert-branch': (_CONDS, _invert_branch),
+    'double-not': ((InstrType.NOT,), _double_not),
+    'neg-literal': ((InstrType.PUSH,), _neg_literal),
+    'store-reload': (_ADDRS, _store_reload),
+    'push-pop': ((InstrType.PUSH, InstrType.DUP) + _ADDRS, _push_pop),
+}
+
+
+class PeepholeOptimizer(object):
+    r"""
+    Rewrites short sequences of `FuncAttrs.instructions`, as emitted by `SyntacticAnalyzer`, before `Assembler`.
+    
+    The rules of `RULES` are tried at each position (the ones for the type of its instruction), and the whole function
+    is passed over again until no rule applies. A window never spans a branch target, except at its first instruction;
+    when that one is replaced, the branches to it are redirected to the first instruction of the replacement (or to
+    the one after the window). While the pass runs, each branch refers to its target instruction instead of an offset;
+    the offsets and `Instruction.ip` are recomputed at the end.
+    
+    `removed` counts the instructions removed by each rule.
+    
+    Examples:
+        
+        >>> opt = PeepholeOptimizer()
+        >>> opt.optimize_funcs(global_funcs)
+        >>> print(opt.removed)
+    
+    """
+    
+    def __init__(self, rules: Optional[Dict[str, Tuple[Tuple[InstrType, ...], Rule]]] = None, max_passes: int = 16):
+        self._rules: Dict[InstrType, List[Tuple[str, Rule]]] = {}     # the type of the first instruction -> rules
+        for name, (its, rule) in (RULES if rules is None else rules).items():
+            for it in its:
+                self._rules.setdefault(it, []).append((name, rule))
+        self._max_passes = max_passes
+        self.removed: Counter = Counter()
+    
+    def optimize_funcs(self, global_funcs: List[FuncAttrs]):
+        for f in global_funcs:
+            self.optimize(f)
+    
+    def optimize(self, func: FuncAttrs):
+        instrs = func.instructions
+        targets: Dict[int, Instruction] = {}    # id of a branch -> its target
+        for ip, instr in enumerate(instrs):
+            if instr.instr_type in _BRANCHES:
+                t = ip + 1 + instr.operand
+                targets[id(instr)] = instrs[t] if t < len(instrs) else _END
+        
+        for _ in range(self._max_passes):
+            instrs, changed = self._pass(instrs, targets)
+            if not changed:
+                break
+        
+        for ip, instr in enumerate(instrs):
+            instr.ip = ip
+        for instr in instrs:
+            if instr.instr_type in _BRANCHES:
+                t = targets[id(instr)]
+                instr.operand = (len(instrs) if t is _END else t.ip) - instr.ip - 1
+        func.instructions[:] = instrs
+    
+    def _pass(self, instrs: List[Instruction], targets: Dict[int, Instruction]) -> Tuple[List[Instruction], bool]:
+        leaders = {id(t) for t in targets.values()}
+        w = _Window(instrs, targets, leaders)
+        redirect: Dict[int, Instruction] = {}   # id of a replaced branch target -> the new target
+        res, changed = [], False
+        rules_of = self._rules.get
+        i = 0
+        while i < len(instrs):
+            m = None
+            for name, rule in rules_of(instrs[i].instr_type, ()):
+                w.i = i
+                m = rule(w)
+                if m is not None:
+                    break
+            if m is None:
+                res.append(instrs[i])
+                i += 1
+                continue
+            k, repl = m
+            first = instrs[i]
+            if id(first) in leaders and not (repl and repl[0] is first):
+                new = redirect[id(first)] = repl[0] if repl else w.following(k)
+                leaders.add(id(new))    # so that it is not removed without a redirect either
+            res.extend(repl)
+            self.removed[name] += k - len(repl)
+            changed = True
+            i += k
+        
+        live = {}       # the targets of the branches left
+        for instr in res:
+            if instr.instr_type in _BRANCHES:
+                t = targets[id(instr)]
+                while id(t) in redirect:
+                    t = redirect[id(t)]
+                live[id(instr)] = t
+        targets.clear()
+        targets.update(live)
+        return res, changed
@@ -4,15 +4,20 @@
 
 import logging
 from functools import partial
-from typing import List, Optional, NamedTuple, Iterable, Dict
+from typing import List, Optional, NamedTuple, Iterable, Dict, Tuple, Union
 
+from lexical.token_buffer import CompactTokenBuffer
 from lexical.tokentype import Token, TokenType
+from opt.fold import fold_instr, push_operand, value_of_push
 from syntactic.symbol.maintainer import SymbolMaintainer
 from syntactic.symbol.ty import TypeDeduction
 from syntactic.syn_err import *
+from syntactic.token_source import TokenSource, CompactTokenSource
+from utils.profiler import PhaseProfiler, NULL_PROFILER
 from vm.instruction import Instruction, InstrType
 
 VM_OP_CLZ = []
+_FOLDABLE_TYPES = {TypeDeduction.INT, TypeDeduction.DOUBLE}
 
 
 class _BreakContinueInstr(NamedTuple):
@@ -25,17 +30,23 @@ class SyntacticAnalyzer(object):
     
     """
     
-    def __init__(self, lg: logging.Logger, tokens: List[Token], str_literals: List[str]):
-        self.lg = lg
-        self._tokens, self._str_literals = tokens, str_literals
-        self._tk_top = 0
-        self._symbols = SymbolMaintainer(len(self._str_literals))
+    def __init__(
+            self, lg: logging.Logger, tokens: Union[Iterable[Token], CompactTokenBuffer], str_literals: List[str],
+            prof: PhaseProfiler = NULL_PROFILER, reuse_local_slots: bool = False,
+    ):
+        self.lg, self.prof = lg, prof
+        self._tokens = CompactTokenSource(tokens) if isinstance(tokens, CompactTokenBuffer) else TokenSource(tokens)
+        self._str_literals = str_literals
+        self._symbols = SymbolMaintainer(reuse_local_slots=reuse_local_slots)
+        # function name -> (the number of its locals, the slots of its frame): less slots when sibling scopes share them
+        self.frame_sizes: Dict[str, Tuple[int, int]] = {}
         self._parsed = False
         
         self._global_instr: List[Instruction] = []
         self._local_instr: List[Instruction] = []
 
         self._return_val_ty = False
+        self._loop_depth = 0
 
     def _declare_builtin_funcs(self):
         self._symbols.declare_func('getint', [], 0, TypeDeduction.INT, [])
@@ -59,23 +70,25 @@ class SyntacticAnalyzer(object):
         
     def analyze_tokens(self):
         if not self._parsed:
-            self._symbols.declare_func('_start', [], 0, TypeDeduction.VOID, self._global_instr)
-            self._declare_builtin_funcs()
-            self._parsed = True
-            self.parse_program()
-            self._finish_start_func()
-        return self._str_literals, self._symbols.global_symbols, self._symbols.global_funcs
+            with self.prof.phase('parse'):
+                self._symbols.declare_func('_start', [], 0, TypeDeduction.VOID, self._global_instr)
+                self._declare_builtin_funcs()
+                self._parsed = True
+                self.parse_program()
+                self._finish_start_func()
+        return self._symbols.global_symbols, self._symbols.global_funcs
 
     def get(self) -> Token:
-        tok = self._tokens[self._tk_top]
-        self._tk_top += 1
-        return tok
+        return self._tokens.get()
 
     def peek(self):
-        return self._tokens[self._tk_top]
+        return self._tokens.peek()
 
     def meta_peek(self):
-        return self._tokens[self._tk_top + 1]
+        return self._tokens.meta_peek()
+    
+    def token_context(self):
+        return self._tokens.context()
 
     def asserted_get(self, expected: Iterable[TokenType]) -> Token:
         tok = self.get()
@@ -100,10 +113,32 @@ class SyntacticAnalyzer(object):
             else:
                 raise SynProgramErr(f'unexpected token; FN, LET or CONST expected (got "{tok.token_type}")')
         
+    def _cur_instrs(self) -> List[Instruction]:
+        return self._global_instr if self._symbols.within_global_scope else self._local_instr
+    
     def _append_instr(self, instr: Instruction):
-        ls = self._global_instr if self._symbols.within_global_scope else self._local_instr
+        ls = self._cur_instrs()
         instr.ip = len(ls)
         ls.append(instr)
+    
+    def _const_since(self, start: int, ty: TypeDeduction) -> Optional[Union[int, float]]:
+        # the value of the expression emitted from `start` if it is known at compile time (it is then a single PUSH)
+        ls = self._cur_instrs()
+        if ty in _FOLDABLE_TYPES and len(ls) == start + 1 and ls[start].instr_type == InstrType.PUSH:
+            return value_of_push(ls[start].operand)
+        return None
+    
+    def _fold_since(self, start: int, its: Iterable[InstrType], *operands: Union[int, float]) -> bool:
+        # replaces the PUSHes of the operands, emitted from `start`, with the PUSH of the result of `its` on them
+        v = operands
+        for it in its:
+            v = fold_instr(it, *v)
+            if v is None:
+                return False
+            v = (v,)
+        del self._cur_instrs()[start:]
+        self._append_instr(Instruction(InstrType.PUSH, push_operand(v[0])))
+        return True
 
     def parse_func_decl(self):
         """
@@ -149,6 +184,7 @@ class SyntacticAnalyzer(object):
         
         num_local_vars = self._symbols.exit_func()
         func.num_local_vars = num_local_vars
+        self.frame_sizes[name] = (self._symbols.num_declared_local_vars, num_local_vars)
         
     def parse_func_args(self, decl_kws: List[Dict]) -> List[TypeDeduction]:
         """
@@ -260,26 +296,61 @@ class SyntacticAnalyzer(object):
             if const:
                 raise SynDeclarationErr(f'uninitialized const "{name}"')
         # perform
-        offset = self._symbols.declare_var(name=name, is_int=decl_ty == TypeDeduction.INT, inited=inited, const=const)
+        num_slots_used = self._symbols.num_local_vars
+        pinned = not inited and self._loop_depth > 0
+        offset = self._symbols.declare_var(name=name, is_int=decl_ty == TypeDeduction.INT, inited=inited, const=const, pinned=pinned)
+        if not inited and not self._symbols.within_global_scope and offset < num_slots_used:
+            # the slot was left by a sibling scope: zeroed, as the frame is when the function is called
+            self._append_instr(Instruction(InstrType.LOCA, offset))
+            self._append_instr(Instruction(InstrType.PUSH, 0))
+            self._append_instr(Instruction(InstrType.STORE_64))
         if inited:
             self._append_instr(Instruction(InstrType.GLOBA if self._symbols.within_global_scope else InstrType.LOCA, offset))
+            start = len(self._cur_instrs())
             val_ty = self.parse_summation()
             if val_ty != decl_ty:
                 raise SynTypeErr(f'invalid assignment from "{val_ty}" to "{decl_ty}"')
-                
-            self._append_instr(Instruction(InstrType.STORE_64))
+            if not self._symbols.within_global_scope:
+                self._fix_self_reading_init(name, offset, num_slots_used, start)
+            var, val = self._symbols.asserted_get_var_or_arg(name), self._const_since(start, val_ty)
+            if const:
+                var.const_val = val
+            if val is not None and var.is_global:
+                var.static_val = val    # written in the o0 file instead of being stored by `_start`
+                del self._global_instr[start - 1:]
+            else:
+                self._append_instr(Instruction(InstrType.STORE_64))
             tok = self.get()
         # parse ';'
         if tok.token_type != TokenType.SEMICOLON:
             raise SynDeclarationErr(f'";" missing in the declaration of var "{name}"')
     
+    def _fix_self_reading_init(self, name: str, offset: int, num_slots_used: int, start: int):
+        # an initializer reading the local it initializes (e.g. `let y: int = y + 1;`) reads its slot before it is set,
+        # so the slot is treated like the one of an uninitialized local: pinned in a loop, zeroed if it is shared
+        ls = self._local_instr
+        self_refs = [instr for instr in ls[start:] if instr.instr_type == InstrType.LOCA and instr.operand == offset]
+        if not self_refs:
+            return
+        if self._loop_depth > 0:
+            offset = self._symbols.pin_var(name, fresh=offset >= num_slots_used)
+            ls[start - 1].operand = offset
+            for instr in self_refs:
+                instr.operand = offset
+        if offset < num_slots_used:
+            init = ls[start - 1:]
+            del ls[start - 1:]
+            self._append_instr(Instruction(InstrType.LOCA, offset))
+            self._append_instr(Instruction(InstrType.PUSH, 0))
+            self._append_instr(Instruction(InstrType.STORE_64))
+            for instr in init:
+                self._append_instr(instr)
+    
     def _parse_cond_and_block_within_if_else(self, has_cond: bool, last_instr_in_each_block: List, brk_ctn_instr: Optional[_BreakContinueInstr]):
         if has_cond:
-            cond_ty = self.parse_condition()
+            cond_ty, br_false = self.parse_condition_and_branch()
             if not cond_ty.evaluable():
                 raise SynTypeErr(f'could not convert "{cond_ty}" to "bool"')
-            br_false = Instruction(InstrType.BR_FALSE)
-            self._append_instr(br_false)
         else:
             br_false = None
         
@@ -328,15 +399,15 @@ class SyntacticAnalyzer(object):
         self.asserted_get({TokenType.WHILE_KW})
 
         first_instr_in_the_cond_ip = len(self._local_instr)
-        cond_ty = self.parse_condition()
+        cond_ty, br_false = self.parse_condition_and_branch()
         first_instr_in_the_cond = self._local_instr[first_instr_in_the_cond_ip]
         if not cond_ty.evaluable():
             raise SynTypeErr(f'could not convert "{cond_ty}" to "bool"')
-        br_false = Instruction(InstrType.BR_FALSE)
-        self._append_instr(br_false)
         
         brk_ctn = _BreakContinueInstr([], [])
+        self._loop_depth += 1
         all_returned = self.parse_block_stmt(brk_ctn_instr=brk_ctn)     # parse the block statement
+        self._loop_depth -= 1
         
         br_back = Instruction(InstrType.BR)
         self._append_instr(br_back)
@@ -434,33 +505,60 @@ class SyntacticAnalyzer(object):
         .. note::
             expression -> summation ('>' | '<' | '>=' | '<=' | '==' | '!=' summation)?
         """
+        expr_type, negated = self._parse_condition()
+        if negated:
+            self._append_instr(Instruction(InstrType.NOT))
+        return expr_type
+    
+    def parse_condition_and_branch(self) -> Tuple[TypeDeduction, Instruction]:
+        """
+        .. note::
+            the condition of an if or a while, followed by a branch taken when it is false (whose operand is to be set)
+        """
+        expr_type, negated = self._parse_condition()
+        br = Instruction(InstrType.BR_TRUE if negated else InstrType.BR_FALSE)
+        self._append_instr(br)
+        return expr_type, br
+    
+    # the comparisons ==, >= and <= are left negated (without their final NOT): returns whether it is the case
+    def _parse_condition(self) -> Tuple[TypeDeduction, bool]:
+        start = len(self._cur_instrs())
         expr_type = lhs_type = self.parse_summation()
         cmp = InstrType.CMP_I if lhs_type == TypeDeduction.INT else InstrType.CMP_F
         op_tt_to_instrs = {
             TokenType.GT: (cmp, InstrType.SET_GT),
             TokenType.LT: (cmp, InstrType.SET_LT),
-            TokenType.GE: (cmp, InstrType.SET_LT, InstrType.NOT),
-            TokenType.LE: (cmp, InstrType.SET_GT, InstrType.NOT),
-            TokenType.EQ: (cmp, InstrType.NOT),
+            TokenType.GE: (cmp, InstrType.SET_LT),     # then NOT
+            TokenType.LE: (cmp, InstrType.SET_GT),     # then NOT
+            TokenType.EQ: (cmp,),                       # then NOT
             TokenType.NEQ: (cmp,),
         }
+        negated = False
         if self.peek().token_type in op_tt_to_instrs.keys():
             op = self.get()
             if lhs_type not in {TypeDeduction.INT, TypeDeduction.DOUBLE}:
                 raise SynTypeErr(f'{lhs_type} cannot be calculated')
+            lhs, rhs_start = self._const_since(start, lhs_type), len(self._cur_instrs())
             rhs_type = self.parse_summation()
             if lhs_type != rhs_type:
                 raise SynTypeErr(f'cannot compare "{lhs_type}" with "{rhs_type}"')
-            [self._append_instr(Instruction(t)) for t in op_tt_to_instrs[op.token_type]]
+            its = op_tt_to_instrs[op.token_type]
+            negated = op.token_type in {TokenType.GE, TokenType.LE, TokenType.EQ}
+            rhs = self._const_since(rhs_start, rhs_type)
+            if lhs is not None and rhs is not None and self._fold_since(start, its + (InstrType.NOT,) * negated, lhs, rhs):
+                negated = False
+            else:
+                [self._append_instr(Instruction(t)) for t in its]
             expr_type = TypeDeduction.BOOL
-        return expr_type
-        
+        return expr_type, negated
+    
     # NOTE: the result will be stored at the top of vm.stack
     def parse_summation(self) -> TypeDeduction:
         """
         .. note::
             summation -> product ('+'|'-' product)*
         """
+        start = len(self._cur_instrs())
         lhs_type = self.parse_product()
         while self.peek().token_type in {TokenType.PLUS, TokenType.MINUS}:
             pm = self.get()
@@ -468,10 +566,13 @@ class SyntacticAnalyzer(object):
                 it = InstrType.ADD_I if lhs_type == TypeDeduction.INT else InstrType.ADD_F
             else:
                 it = InstrType.SUB_I if lhs_type == TypeDeduction.INT else InstrType.SUB_F
+            lhs, rhs_start = self._const_since(start, lhs_type), len(self._cur_instrs())
             rhs_type = self.parse_product()
             if lhs_type != rhs_type:
                 raise SynTypeErr(f'cannot add "{lhs_type}" with "{rhs_type}"')
-            self._append_instr(Instruction(it))
+            rhs = self._const_since(rhs_start, rhs_type)
+            if lhs is None or rhs is None or not self._fold_since(start, (it,), lhs, rhs):
+                self._append_instr(Instruction(it))
         return lhs_type
 
     # NOTE: the result will be stored at the top of vm.stack
@@ -480,6 +581,7 @@ class SyntacticAnalyzer(object):
         .. note::
             product -> factor ('*'|'/' factor)*
         """
+        start = len(self._cur_instrs())
         lhs_type = self.parse_factor()
         while self.peek().token_type in {TokenType.MUL, TokenType.DIV}:
             md = self.get()
@@ -487,10 +589,13 @@ class SyntacticAnalyzer(object):
                 it = InstrType.MUL_I if lhs_type == TypeDeduction.INT else InstrType.MUL_F
             else:
                 it = InstrType.DIV_I if lhs_type == TypeDeduction.INT else InstrType.DIV_F
+            lhs, rhs_start = self._const_since(start, lhs_type), len(self._cur_instrs())
             rhs_type = self.parse_factor()
             if lhs_type != rhs_type:
                 raise SynTypeErr(f'cannot multiply "{lhs_type}" with "{rhs_type}"')
-            self._append_instr(Instruction(it))
+            rhs = self._const_since(rhs_start, rhs_type)
+            if lhs is None or rhs is None or not self._fold_since(start, (it,), lhs, rhs):
+                self._append_instr(Instruction(it))
         return lhs_type
 
     # NOTE: the result will be stored at the top of vm.stack
@@ -499,15 +604,18 @@ class SyntacticAnalyzer(object):
         .. note::
             factor -> element ('as' TYPE)*
         """
+        start = len(self._cur_instrs())
         elem_ty = self.parse_element()
         while self.peek().token_type == TokenType.AS_KW:
             _ = self.get()
-            as_ty = self.asserted_get({TokenType.INT_TYPE_SPECIFIER, TokenType.DBL_TYPE_SPECIFIER})
+            as_ty = TypeDeduction.from_token_type(self.asserted_get({TokenType.INT_TYPE_SPECIFIER, TokenType.DBL_TYPE_SPECIFIER}).token_type)
             if elem_ty == as_ty:
                 continue
             cast = InstrType.ITOF if elem_ty == TypeDeduction.INT else InstrType.FTOI
-            self._append_instr(Instruction(cast))
-            elem_ty = TypeDeduction.from_token_type(as_ty.token_type)
+            val = self._const_since(start, elem_ty)
+            if val is None or not self._fold_since(start, (cast,), val):
+                self._append_instr(Instruction(cast))
+            elem_ty = as_ty
         return elem_ty
 
     # NOTE: the result will be stored at the top of vm.stack
@@ -520,30 +628,45 @@ class SyntacticAnalyzer(object):
         while self.peek().token_type == TokenType.MINUS:
             self.get()
             sign *= -1
+        start = len(self._cur_instrs())
         
         # if self.peek().token_type == TokenType.STR_LITERAL:
             # raise SynExpressionErr('string literal cannot be calculated')        # todo:
         
-        if self.peek().token_type in {TokenType.UINT_LITERAL, TokenType.DBL_LITERAL, TokenType.STR_LITERAL}:
+        if self.peek().token_type in {TokenType.UINT_LITERAL, TokenType.DBL_LITERAL}:
             lit = self.get()
             self._append_instr(Instruction(InstrType.PUSH, lit.val))
             ty = TypeDeduction.from_token_type(lit.token_type)
         
+        elif self.peek().token_type == TokenType.STR_LITERAL:
+            lit = self.get()
+            s = self._symbols.declare_str_const(self._str_literals[lit.val])
+            push = Instruction(InstrType.PUSH, s.offset)
+            push.global_ref = True
+            self._append_instr(push)
+            ty = TypeDeduction.STRING_OFFSET
+        
         elif self.peek().token_type == TokenType.IDENTIFIER:
             if self.meta_peek().token_type == TokenType.L_PAREN:
                 ty = self.parse_func_calling()
             else:
                 ident = self.get()
                 var = self._symbols.asserted_get_var_or_arg(ident.val)
-                self._append_instr(Instruction.from_var_loading(var))
-                self._append_instr(Instruction(InstrType.LOAD_64))
+                if var.const_val is not None:
+                    self._append_instr(Instruction(InstrType.PUSH, push_operand(var.const_val)))
+                else:
+                    self._append_instr(Instruction.from_var_loading(var))
+                    self._append_instr(Instruction(InstrType.LOAD_64))
                 ty = TypeDeduction.from_is_int(var.is_int)
         else: # must be condition
             self.asserted_get({TokenType.L_PAREN})
             ty = self.parse_condition()
             self.asserted_get({TokenType.R_PAREN})
         if sign < 0:
-            self._append_instr(Instruction(InstrType.NEG_I if ty == TypeDeduction.INT else InstrType.NEG_F))
+            neg = InstrType.NEG_I if ty == TypeDeduction.INT else InstrType.NEG_F
+            val = self._const_since(start, ty)
+            if val is None or not self._fold_since(start, (neg,), val):
+                self._append_instr(Instruction(neg))
         return ty
 
     def parse_func_calling(self) -> TypeDeduction:
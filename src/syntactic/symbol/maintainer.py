@@ -2,9 +2,9 @@
 # This file is a part of my compiler assignment for Compilation Principles.
 # All rights reserved.
 
-from typing import List
+from typing import Dict, List
 
-from syntactic.symbol.table import _ScopeWiseSymbolTable, VarAttrs, FuncAttrs
+from syntactic.symbol.table import _ScopeWiseSymbolTable, VarAttrs, FuncAttrs, StrConstAttrs
 from syntactic.symbol.ty import TypeDeduction
 from syntactic.syn_err import SynReferenceErr
 from vm.instruction import Instruction
@@ -12,10 +12,17 @@ from vm.instruction import Instruction
 
 class SymbolMaintainer(object):
     
-    def __init__(self, num_str_literals):
+    def __init__(self, reuse_local_slots: bool = False):
         super(SymbolMaintainer, self).__init__()
-        self._global_symbol_cnt = num_str_literals
+        self._global_symbol_cnt = 0
+        self._str_pool: Dict[str, StrConstAttrs] = {}
         self._num_func_args = self._num_local_vars = 0
+        # a local takes the lowest slot not used by the locals of the enclosing scopes, so sibling scopes share slots;
+        # `_num_local_vars` is then the most slots in use at once, and `_num_declared_local_vars` counts every local
+        self._reuse_local_slots = reuse_local_slots
+        self._local_slot_top = self._num_declared_local_vars = 0
+        self._local_slot_floor = 0          # the slots below it are never given back (see `declare_var`)
+        self._scope_slot_tops: List[int] = []
         self._num_ret_vals = False
         self._global_table = _ScopeWiseSymbolTable('global')
         self._local_tables: List[_ScopeWiseSymbolTable] = []
@@ -23,7 +30,10 @@ class SymbolMaintainer(object):
 
     @property
     def global_symbols(self):
-        return list(self._global_table.values())
+        # pooled strings take their global slots when they are first met, so they are interleaved with global vars;
+        # a function has no slot of its own but refers to the pooled string of its name
+        gvars = filter(lambda x: not x.is_func(), self._global_table.values())
+        return sorted([*gvars, *self._str_pool.values()], key=lambda x: x.offset)
 
     @property
     def global_funcs(self):
@@ -31,26 +41,45 @@ class SymbolMaintainer(object):
     
     def enter_func(self, name: str, has_return_value: bool):
         self._num_func_args = self._num_local_vars = 0
+        self._local_slot_top = self._num_declared_local_vars = self._local_slot_floor = 0
         self._cur_func_name = name
         self._num_ret_vals = int(has_return_value)
         self.enter_scope(f'@func {name}')
     
     def enter_scope(self, name):
         self._local_tables.append(_ScopeWiseSymbolTable(name))
+        self._scope_slot_tops.append(self._local_slot_top)
     
     def exit_scope(self):
+        top = self._scope_slot_tops.pop()
+        if self._reuse_local_slots:
+            self._local_slot_top = max(top, self._local_slot_floor)     # the slots of the scope are free again
         return self._local_tables.pop()
     
+    @property
+    def num_local_vars(self):
+        return self._num_local_vars
+    
+    @property
+    def num_declared_local_vars(self):
+        return self._num_declared_local_vars
+    
     def exit_func(self):
         self.exit_scope()
         return self._num_local_vars
     
     def declare_func(self, name: str, arg_types: List[TypeDeduction], num_local_vars: int, return_val_ty: TypeDeduction, instructions: List[Instruction]):
-        func = FuncAttrs(self._global_symbol_cnt, name, arg_types, num_local_vars, return_val_ty, instructions)
+        func = FuncAttrs(self.declare_str_const(name).offset, name, arg_types, num_local_vars, return_val_ty, instructions)
         self._global_table[name] = func
-        self._global_symbol_cnt += 1   # indexing from 0
         return func
 
+    def declare_str_const(self, val: str) -> StrConstAttrs:
+        s = self._str_pool.get(val, None)
+        if s is None:
+            s = self._str_pool[val] = StrConstAttrs(self._global_symbol_cnt, val)
+            self._global_symbol_cnt += 1   # indexing from 0
+        return s
+
     def declare_func_arg(self, name: str, is_int: bool, const: bool):
         self._local_tables[-1][name] = VarAttrs(self._num_ret_vals + self._num_func_args, is_global=False, is_arg=True, is_int=is_int, inited=True, const=const)
         self._num_func_args += 1
@@ -59,16 +88,36 @@ class SymbolMaintainer(object):
     def within_global_scope(self):
         return len(self._local_tables) == 0
 
-    def declare_var(self, name: str, is_int: bool, inited: bool, const: bool):
+    def declare_var(self, name: str, is_int: bool, inited: bool, const: bool, pinned: bool = False):
+        # a `pinned` local gets a slot never used before, which is never shared either (e.g. an uninitialized local in a
+        # loop, which must keep its value from one iteration to the next)
         kw = dict(is_arg=False, is_int=is_int, inited=inited, const=const)
         if self.within_global_scope:
             kw['is_global'] = True
             tbl, offset_attr_name = self._global_table, '_global_symbol_cnt'
         else:
             kw['is_global'] = False
-            tbl, offset_attr_name = self._local_tables[-1], '_num_local_vars'
-        return self._declare_var(tbl, name, offset_attr_name, kw)   # returns the offset for generating LOAD instruction
+            tbl, offset_attr_name = self._local_tables[-1], '_local_slot_top'
+            self._num_declared_local_vars += 1
+            if pinned:
+                self._local_slot_top = self._num_local_vars
+        offset = self._declare_var(tbl, name, offset_attr_name, kw)   # returns the offset for generating LOAD instruction
+        if not kw['is_global']:
+            self._num_local_vars = max(self._num_local_vars, self._local_slot_top)
+            if pinned:
+                self._local_slot_floor = self._local_slot_top
+        return offset
 
+    def pin_var(self, name: str, fresh: bool) -> int:
+        # pins the local just declared (see `declare_var`), moving it to a slot never used before unless its slot is
+        # `fresh` already; returns its offset
+        var = self._local_tables[-1][name]
+        if not fresh:
+            var.offset = self._num_local_vars
+            self._local_slot_top = self._num_local_vars = var.offset + 1
+        self._local_slot_floor = self._local_slot_top
+        return var.offset
+    
     def _declare_var(self, tbl, name, offset_attr_name, kw):
         offset = getattr(self, offset_attr_name)
         tbl[name] = VarAttrs(offset=offset, **kw)
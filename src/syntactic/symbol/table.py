@@ -4,7 +4,7 @@
 
 from abc import ABCMeta, abstractmethod
 from pprint import pformat
-from typing import List, Union, OrderedDict
+from typing import List, Optional, Union, OrderedDict
 
 from syntactic.symbol.ty import TypeDeduction
 from syntactic.syn_err import SynDeclarationErr
@@ -31,11 +31,27 @@ class VarAttrs(Attrs):
         self.is_global, self.is_arg, self.is_int, self.inited, self.const = (
             is_global, is_arg, is_int, inited, const
         )
+        self.const_val: Optional[Union[int, float]] = None     # the value of a const whose initializer is constant
+        self.static_val: Optional[Union[int, float]] = None    # the initial value of a global, written in the o0 file
     
     def is_func(self):
         return False
 
 
+class StrConstAttrs(Attrs):
+    # a string in the global constant pool, shared by all the identical string literals and function names
+    
+    def __init__(self, offset: int, val: str):
+        super(StrConstAttrs, self).__init__(offset)
+        self.val = val
+    
+    def is_func(self):
+        return False
+    
+    def __repr__(self):
+        return f'str [{self.offset}] {self.val!r}'
+
+
 class FuncAttrs(Attrs):
     
     def __init__(
@@ -0,0 +1,97 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from typing import Iterable, List, Tuple
+
+from lexical.token_buffer import CompactTokenBuffer
+from lexical.tokentype import Token, TokenType
+
+
+class TokenSource(object):
+    r"""
+    Feeds tokens to the analyzer from any iterable of tokens (a list or the generator `LexicalTokenizer.iter_tokens`).
+    
+    Only a ring buffer of `lookahead` upcoming tokens and `history` consumed tokens is kept, so the memory cost is
+    bounded by the lookahead of the grammar instead of growing with the size of the source.
+    
+    Methods:
+        
+        get:
+            Consumes the current token
+        
+        peek, meta_peek:
+            Returns the current token or the one after it (the analyzer never looks further)
+        
+        context:
+            Returns the window of recently consumed tokens and the upcoming tokens, used for error reports
+    
+    """
+    
+    _EOF = Token(token_type=TokenType.EOF_TOKEN, val='EOF sentry')
+    
+    def __init__(self, tokens: Iterable[Token], lookahead: int = 2, history: int = 20):
+        self._it = iter(tokens)
+        self._lookahead, self._cap = lookahead, lookahead + history
+        self._buf: List[Token] = [self._EOF] * self._cap
+        self._top = 0   # the number of consumed tokens
+        for i in range(lookahead):
+            self._buf[i] = next(self._it, self._EOF)
+    
+    def get(self) -> Token:
+        top, cap = self._top, self._cap
+        tok = self._buf[top % cap]
+        self._buf[(top + self._lookahead) % cap] = next(self._it, self._EOF)
+        self._top = top + 1
+        return tok
+    
+    def peek(self) -> Token:
+        return self._buf[self._top % self._cap]
+    
+    def meta_peek(self) -> Token:
+        return self._buf[(self._top + 1) % self._cap]
+    
+    def context(self) -> Tuple[List[Token], List[Token]]:
+        top, cap = self._top, self._cap
+        first = max(0, top + self._lookahead - cap)
+        consumed = [self._buf[i % cap] for i in range(first, top)]
+        upcoming = [self._buf[i % cap] for i in range(top, top + self._lookahead)]
+        return consumed, upcoming
+    
+    @property
+    def num_consumed(self) -> int:
+        return self._top
+
+
+class CompactTokenSource(object):
+    r"""
+    Feeds tokens to the analyzer from a `CompactTokenBuffer`, with the same interface as `TokenSource`.
+    
+    """
+    
+    def __init__(self, buf: CompactTokenBuffer, history: int = 20):
+        self._buf, self._history = buf, history
+        self._token_at = buf.token_at
+        self._last = len(buf) - 1   # the buffer always ends with EOF sentries
+        self._top = 0
+    
+    def get(self) -> Token:
+        top = self._top
+        self._top = top + 1
+        return self._token_at(min(top, self._last))
+    
+    def peek(self) -> Token:
+        return self._token_at(min(self._top, self._last))
+    
+    def meta_peek(self) -> Token:
+        return self._token_at(min(self._top + 1, self._last))
+    
+    def context(self) -> Tuple[List[Token], List[Token]]:
+        top = min(self._top, self._last)
+        consumed = [self._token_at(i) for i in range(max(0, top - self._history), top)]
+        upcoming = [self._token_at(i) for i in range(top, min(top + 2, self._last + 1))]
+        return consumed, upcoming
+    
+    @property
+    def num_consumed(self) -> int:
+        return self._top
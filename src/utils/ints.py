@@ -0,0 +1,10 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+# the integers of the machine (i64, with u64 bit patterns), shared by the compiler passes and the virtual machines
+I64_MIN, I64_MAX, U64_MASK = -(1 << 63), (1 << 63) - 1, (1 << 64) - 1
+
+
+def wrap_i64(v: int) -> int:
+    return ((v - I64_MIN) & U64_MASK) + I64_MIN
@@ -4,11 +4,30 @@
 
 import logging
 import os
-from typing import Optional
+from typing import Any, Callable, Optional
 
 from meta import FS_ENCODING
 
 
+class LazyFmt(object):
+    r"""
+    Defers an expensive formatting call (e.g. `pformat` of all tokens) until the log record is really emitted.
+    
+    Pass it as a %-style argument, which `logging` only formats when the record is handled, and which `C0Logger`
+    never touches when it is not verbose:
+    
+        >>> lg.info('parsed tokens:\n %s', LazyFmt(pformat, tokens))
+    
+    """
+    __slots__ = ('fn', 'args')
+    
+    def __init__(self, fn: Callable[..., Any], *args):
+        self.fn, self.args = fn, args
+    
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+
 class C0Logger(object):
     def __init__(self, lg: Optional[logging.Logger]):
         self.__lg = lg
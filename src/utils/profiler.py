@@ -0,0 +1,72 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import IO, Optional
+
+
+class PhaseProfiler(object):
+    r"""
+    Measures the compiling phases (lexing, parsing, assembling, writing) and reports each of them as a JSON line:
+        
+        {"phase": "lex", "wall_ms": 12.3, "cpu_ms": 12.1, "mem_peak_bytes": 1024, "mem_alloc_bytes": 512, ...}
+    
+    where `mem_peak_bytes` is the peak of traced memory during the phase and `mem_alloc_bytes` is the traced memory
+    still held when the phase ends, both relative to the start of the phase. Note that `tracemalloc` is running
+    while profiling, so times are inflated by its overhead.
+    
+    A disabled profiler (`NULL_PROFILER`) returns a shared do-nothing context, so the hooks cost nothing by default.
+    Phases are not supposed to be nested. With `own_fp`, the profiler owns `fp` (e.g. a file it was opened for) and
+    `close` closes it as well.
+    
+    Examples:
+        
+        >>> prof = PhaseProfiler(sys.stderr, tag='test.c0')
+        >>> try:
+        >>>     with prof.phase('lex'):
+        >>>         tokens = lex.parse_tokens()
+        >>> finally:
+        >>>     prof.close()
+    
+    """
+    
+    def __init__(self, fp: Optional[IO[str]], tag: str = '', own_fp: bool = False):
+        self._fp, self._tag, self._own_fp = fp, tag, own_fp
+        self.enabled = fp is not None
+        self._own_tracing = self.enabled and not tracemalloc.is_tracing()
+        if self._own_tracing:
+            tracemalloc.start()
+    
+    def phase(self, name: str):
+        return self._phase(name) if self.enabled else _NULL_CTX
+    
+    @contextmanager
+    def _phase(self, name: str):
+        mem_0 = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        wall_0, cpu_0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_0, time.process_time() - cpu_0
+            mem, peak = tracemalloc.get_traced_memory()
+            print(json.dumps({
+                'tag': self._tag, 'phase': name,
+                'wall_ms': round(wall * 1000, 3), 'cpu_ms': round(cpu * 1000, 3),
+                'mem_peak_bytes': peak - mem_0, 'mem_alloc_bytes': mem - mem_0,
+            }), file=self._fp, flush=True)
+    
+    def close(self):
+        if self._own_tracing:
+            tracemalloc.stop()
+        if self._own_fp:
+            self._fp.close()
+        self.enabled = self._own_tracing = self._own_fp = False
+
+
+_NULL_CTX = nullcontext()
+NULL_PROFILER = PhaseProfiler(None)
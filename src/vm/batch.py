@@ -0,0 +1,132 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, NamedTuple, Optional
+
+from vm.loader import load_o0
+from vm.machine import VirtualMachine
+from vm.threaded import ThreadedVirtualMachine
+from vm.vm_err import VirtualMachineError
+
+_EXPECTED_SUFFIXES = (('.input.txt', '.output.txt'), ('.in', '.out'), ('.in', '.ans'))
+
+
+class BatchCase(NamedTuple):
+    name: str
+    input_path: str
+    expected_path: Optional[str]    # None: the output is not checked
+
+
+class CaseResult(NamedTuple):
+    name: str
+    status: str                     # 'passed', 'failed', 'unchecked' or 'error'
+    run_s: float
+    instrs: int                     # 0 on the threaded engine, which does not count them
+    error: Optional[str] = None
+
+
+def expected_path_of(input_path: str, expected_dir: Optional[str] = None) -> Optional[str]:
+    r"""
+    Finds the expected output of an input file: `a.input.txt` -> `a.output.txt`, `a.in` -> `a.out` or `a.ans`,
+    in the same directory or in `expected_dir`.
+    """
+    d, base = os.path.split(input_path)
+    for in_suffix, out_suffix in _EXPECTED_SUFFIXES:
+        if base.endswith(in_suffix):
+            path = os.path.join(expected_dir or d, base[:-len(in_suffix)] + out_suffix)
+            if os.path.isfile(path):
+                return path
+    if expected_dir is not None and os.path.isfile(os.path.join(expected_dir, base)):
+        return os.path.join(expected_dir, base)
+    return None
+
+
+def find_cases(paths: Iterable[str], expected_dir: Optional[str] = None) -> List[BatchCase]:
+    r"""
+    Collects the input files (a directory stands for the inputs in it, i.e. the files that are not expected outputs).
+    """
+    inputs = []
+    for p in paths:
+        if os.path.isdir(p):
+            names = sorted(os.listdir(p))
+            outputs = {n for n in names for _, out_suffix in _EXPECTED_SUFFIXES if n.endswith(out_suffix)}
+            inputs.extend(os.path.join(p, n) for n in names if n not in outputs and os.path.isfile(os.path.join(p, n)))
+        else:
+            inputs.append(p)
+    return [BatchCase(name=os.path.basename(p), input_path=p, expected_path=expected_path_of(p, expected_dir)) for p in inputs]
+
+
+def same_output(out: str, expected: str) -> bool:
+    # as judges usually do: line endings and trailing blanks do not matter
+    def norm(s):
+        return [l.rstrip() for l in s.rstrip().splitlines()]
+    
+    return norm(out) == norm(expected)
+
+
+# the virtual machine of a worker process, decoded once by `_init_worker` and reset before each case
+_worker_vm: Optional[VirtualMachine] = None
+
+
+def _init_worker(data: bytes, engine: str, fusing: bool):
+    global _worker_vm
+    program = load_o0(data)
+    if engine == 'threaded':
+        _worker_vm = ThreadedVirtualMachine(program, fin=io.StringIO(), fout=io.StringIO(), eager=True)
+    else:
+        _worker_vm = VirtualMachine(program, fin=io.StringIO(), fout=io.StringIO(), fusing=fusing)
+
+
+def _run_case(case: BatchCase) -> CaseResult:
+    vm = _worker_vm
+    with open(case.input_path, 'r') as fp:
+        fin = io.StringIO(fp.read())
+    out = io.StringIO()
+    vm.reset(fin, out)
+    t0 = time.perf_counter()
+    try:
+        vm.run()
+    except VirtualMachineError as e:
+        return CaseResult(name=case.name, status='error', run_s=time.perf_counter() - t0, instrs=vm.num_executed, error=f'{type(e).__name__}: {e}')
+    dt = time.perf_counter() - t0
+    if case.expected_path is None:
+        status = 'unchecked'
+    else:
+        with open(case.expected_path, 'r') as fp:
+            status = 'passed' if same_output(out.getvalue(), fp.read()) else 'failed'
+    return CaseResult(name=case.name, status=status, run_s=dt, instrs=vm.num_executed)
+
+
+class BatchRunner(object):
+    r"""
+    Runs one o0 program over many inputs. The program is loaded and decoded once per worker process (by the
+    initializer of the pool) instead of once per case, and each case only resets the memory of the machine.
+    With `workers=1`, the cases are run in this process, one after the other.
+    
+    Examples:
+        
+        >>> runner = BatchRunner(o0_bytes, engine='dispatch', workers=4)
+        >>> results = runner.run(find_cases(['tests/']))
+    
+    """
+    
+    def __init__(self, data: bytes, engine: str = 'dispatch', fusing: bool = False, workers: Optional[int] = None):
+        self._data, self._engine, self._fusing = data, engine, fusing
+        self._workers = workers or os.cpu_count() or 1
+        self.wall_s = 0.
+    
+    def run(self, cases: List[BatchCase]) -> List[CaseResult]:
+        t0 = time.perf_counter()
+        if self._workers == 1 or len(cases) <= 1:
+            _init_worker(self._data, self._engine, self._fusing)
+            results = [_run_case(c) for c in cases]
+        else:
+            with ProcessPoolExecutor(max_workers=min(self._workers, len(cases)), initializer=_init_worker, initargs=(self._data, self._engine, self._fusing)) as pool:
+                results = list(pool.map(_run_case, cases, chunksize=max(1, len(cases) // (4 * self._workers))))
+        self.wall_s = time.perf_counter() - t0
+        return results
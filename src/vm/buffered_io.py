@@ -0,0 +1,153 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import re
+from typing import IO, Callable, Union
+
+from vm.vm_err import VmIOErr
+
+_TOKEN_REG = re.compile(rb'\S+')
+DEFAULT_BLOCK_SIZE = 1 << 16
+DEFAULT_FLUSH_THRESHOLD = 1 << 16
+
+
+def _byte_reader(fin: IO) -> Callable[[int], bytes]:
+    # reads what is available (at most n bytes, b'' at the end): from the binary layer of a text stream if it has one
+    fin = getattr(fin, 'buffer', fin)
+    read = getattr(fin, 'read1', None) or fin.read
+    if hasattr(fin, 'encoding'):    # a text stream without a binary layer (`io.StringIO`)
+        return lambda n: read(n).encode('utf-8')
+    return read
+
+
+class BlockScanner(object):
+    r"""
+    Reads the input of SCAN_I/SCAN_F/SCAN_C (and getint/getdouble/getchar) in large binary blocks.
+    
+    The tokens are found by a bytes regex directly in the block, and `int`/`float` parse the bytes of the match, so
+    no string is created, neither per line nor per token. A token cut by the end of a block is completed by the next
+    block before it is parsed. SCAN_C gives the next byte of the input (whitespaces included), as navm does.
+    
+    A text stream is read through its binary layer (`sys.stdin.buffer`); nothing must have been read from its text
+    layer before.
+    
+    """
+    
+    def __init__(self, fin: IO, block_size: int = DEFAULT_BLOCK_SIZE):
+        self._read = _byte_reader(fin)
+        self._block_size = block_size
+        self._buf = bytearray()
+        self._pos = 0
+        self._eof = False
+    
+    def _fill(self) -> bool:
+        # appends the next block (the consumed bytes are dropped first); False at the end of the input
+        if self._eof:
+            return False
+        if self._pos:
+            del self._buf[:self._pos]
+            self._pos = 0
+        block = self._read(self._block_size)
+        if not block:
+            self._eof = True
+            return False
+        self._buf += block
+        return True
+    
+    def _token(self) -> bytes:
+        while True:
+            m = _TOKEN_REG.search(self._buf, self._pos)
+            if m is None:
+                self._pos = len(self._buf)
+                if not self._fill():
+                    raise VmIOErr('unexpected end of input')
+            elif m.end() == len(self._buf) and not self._eof:
+                # the token may go on in the next block: searched again once it is read (`m` is stale after `_fill`)
+                self._pos = m.start()
+                self._fill()
+            else:
+                self._pos = m.end()
+                return m.group()
+    
+    def scan_i(self) -> int:
+        tok = self._token()
+        try:
+            v = int(tok)
+        except ValueError:
+            raise VmIOErr(f'invalid integer "{tok.decode("utf-8", errors="replace")}"')
+        return (v + (1 << 63)) % (1 << 64) - (1 << 63)     # wrapped to i64
+    
+    def scan_f(self) -> float:
+        tok = self._token()
+        try:
+            return float(tok)
+        except ValueError:
+            raise VmIOErr(f'invalid double "{tok.decode("utf-8", errors="replace")}"')
+    
+    def scan_c(self) -> int:
+        if self._pos >= len(self._buf) and not self._fill():
+            raise VmIOErr('unexpected end of input')
+        self._pos += 1
+        return self._buf[self._pos - 1]
+
+
+class OutputBuffer(object):
+    r"""
+    Collects the output of PRINT_* in a `bytearray` that is written out whenever it grows past `threshold` bytes and
+    by `flush` (which the machines call when a run ends, normally or not); the array is reused after each write.
+    
+    The bytes are the ones the text stream would have written for the same calls (`'%.6f'` for doubles, utf-8 for
+    characters). A text stream is written through its binary layer (`sys.stdout.buffer`), after flushing its text
+    layer, or as text if it has none (`io.StringIO`).
+    
+    """
+    
+    def __init__(self, fout: IO, threshold: int = DEFAULT_FLUSH_THRESHOLD):
+        self._fout = fout
+        binary = getattr(fout, 'buffer', None if hasattr(fout, 'encoding') else fout)
+        self._sink = binary.write if binary is not None else (lambda b: fout.write(b.decode('utf-8')))
+        self._threshold = threshold
+        self._buf = bytearray()
+    
+    def write(self, b: Union[bytes, bytearray]):
+        buf = self._buf
+        buf += b
+        if len(buf) >= self._threshold:
+            self.flush()
+    
+    def write_c(self, v: int):
+        try:
+            self.write(chr(v).encode('utf-8'))
+        except (ValueError, OverflowError, TypeError):
+            raise VmIOErr(f'invalid character {v!r}')
+    
+    def write_s(self, s: bytes):
+        self.write(s if s.isascii() else s.decode('ascii', errors='replace').encode('utf-8'))
+    
+    def flush(self):
+        if self._buf:
+            if self._fout is not getattr(self._fout, 'buffer', self._fout):
+                self._fout.flush()      # whatever was written to the text layer goes first
+            self._sink(self._buf)
+            self._buf.clear()
+
+
+if __name__ == '__main__':      # python -m vm.buffered_io: tokens cut by blocks and the last token of the input
+    import io
+    for block_size in (1, 3, DEFAULT_BLOCK_SIZE):
+        for tail in ('', '\n', ' \n'):
+            sc = BlockScanner(io.BytesIO(f'  12 -345\n6.5e1 x7{tail}'.encode()), block_size=block_size)
+            got = sc.scan_i(), sc.scan_i(), sc.scan_f(), sc.scan_c(), sc.scan_c()
+            assert got == (12, -345, 65.0, ord(' '), ord('x')), block_size
+            assert sc.scan_i() == 7, block_size
+            assert [sc.scan_c() for _ in tail] == list(tail.encode())
+            for scan in (sc.scan_i, sc.scan_f, sc.scan_c):
+                try:
+                    scan()
+                    raise AssertionError(f'{scan.__name__} read past the end of the input')
+                except VmIOErr:
+                    pass
+        sc = BlockScanner(io.BytesIO(b'1 2'), block_size=block_size)
+        assert sc.scan_i() + sc.scan_i() == 3
+    print('block scanner ok')
@@ -0,0 +1,112 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from vm.instruction import InstrType, STACK_EFFECTS
+from vm.opcodes import *
+
+_Op = type('_Op', (), {it.name: it.value for it in InstrType})
+
+_BRANCHES = {_Op.BR, _Op.BR_FALSE, _Op.BR_TRUE}
+_ADDRESSING = {_Op.LOCA: (OP_LOAD_LOC, OP_STORE_LOC), _Op.ARGA: (OP_LOAD_ARG, OP_STORE_ARG), _Op.GLOBA: (OP_LOAD_GLOB, OP_STORE_GLOB)}
+_NEGATED = {'lt': 'ge', 'gt': 'le', 'ne': 'eq', 'eq': 'ne', 'ge': 'lt', 'le': 'gt'}
+_MAX_STORE_DISTANCE = 64    # how far to look for the STORE_64 consuming an address
+
+# opcode -> (number of popped slots, number of pushed slots); CALL depends on the callee
+_STACK_EFFECTS: Dict[int, Tuple[int, int]] = {
+    **{it.value: eff for it, eff in STACK_EFFECTS.items() if it not in {InstrType.RET, InstrType.PANIC}},
+    OP_GETINT: (1, 1), OP_GETDOUBLE: (1, 1), OP_GETCHAR: (1, 1),
+}
+
+
+def _match_cmp(codes: List[int], ip: int, leaders: Set[int]) -> Optional[Tuple[int, str, bool]]:
+    # CMP_I/CMP_F at `ip`, then [SET_LT | SET_GT], then [NOT], then [BR_TRUE | BR_FALSE]
+    # -> (the number of fused instructions, the predicate on the result of CMP, whether it ends with a branch)
+    n, pred = 1, 'ne'   # the result of CMP alone is true iff it is not 0
+    
+    def at(k):
+        return codes[ip + k] if ip + k < len(codes) and ip + k not in leaders else None
+    
+    if at(n) in {_Op.SET_LT, _Op.SET_GT}:
+        pred = 'lt' if at(n) == _Op.SET_LT else 'gt'
+        n += 1
+    if at(n) == _Op.NOT:
+        pred = _NEGATED[pred]
+        n += 1
+    if at(n) in {_Op.BR_TRUE, _Op.BR_FALSE}:
+        return n + 1, pred if at(n) == _Op.BR_TRUE else _NEGATED[pred], True
+    return (n, pred, False) if n > 1 else None
+
+
+def _find_stores(codes: List[int], operands: List, leaders: Set[int], call_effect: Callable[[int], Tuple[int, int]]) -> Dict[int, int]:
+    # the address pushed by LOCA/ARGA/GLOBA at i and consumed as the address of STORE_64 at j -> {i: j}
+    stores = {}
+    for i, c in enumerate(codes):
+        if c not in _ADDRESSING or codes[i + 1] == _Op.LOAD_64:
+            continue
+        h = 0   # the number of slots above the address
+        for j in range(i + 1, min(len(codes), i + 1 + _MAX_STORE_DISTANCE)):
+            c_j = codes[j]
+            if j in leaders or c_j in _BRANCHES:
+                break
+            pops, pushes = call_effect(operands[j]) if c_j == _Op.CALL else _STACK_EFFECTS.get(c_j, (None, None))
+            if pops is None:    # RET, PANIC, the end of the function, POPN, STACKALLOC ...
+                break
+            if pops > h:
+                if c_j == _Op.STORE_64 and h == 1:
+                    stores[i] = j
+                break
+            h += pushes - pops
+    return stores
+
+
+def fuse(codes: List[int], operands: List, call_effect: Callable[[int], Tuple[int, int]]) -> Tuple[List[int], List]:
+    r"""
+    Rewrites the decoded code of a function (see `VirtualMachine._decode`) with superinstructions:
+        
+        * LOCA/ARGA/GLOBA n; LOAD_64                        -> OP_LOAD_LOC/OP_LOAD_ARG/OP_LOAD_GLOB n
+        * LOCA/ARGA/GLOBA n; <expr>; STORE_64               -> <expr>; OP_STORE_LOC/OP_STORE_ARG/OP_STORE_GLOB n
+        * CMP_I/CMP_F; [SET_LT/SET_GT]; [NOT]; BR_x t       -> OP_CMP_I_BR/OP_CMP_F_BR[predicate] t
+        * CMP_I/CMP_F; SET_LT/SET_GT/NOT; [NOT]             -> OP_CMP_I_SET/OP_CMP_F_SET[predicate]
+    
+    A sequence is only fused when no branch lands inside it. For the stores, the stack height is followed from
+    LOCA to the STORE_64 that consumes its address within the same basic block; dropping the address does not change
+    anything in between, since every instruction (CALL included) only addresses the stack relatively to its top or
+    to the frame. `call_effect(func_idx)` gives the (popped, pushed) slots of a CALL. Branch targets are remapped.
+    """
+    leaders = {x for c, x in zip(codes, operands) if c in _BRANCHES}
+    stores = _find_stores(codes, operands, leaders, call_effect)
+    store_ops = {j: (_ADDRESSING[codes[i]][1], operands[i]) for i, j in stores.items()}
+    
+    new_codes, new_operands = [], []
+    new_ip = [0] * (len(codes) + 1)     # old ip -> new ip of the instruction containing it (or following it)
+    ip = 0
+    while ip < len(codes):
+        c, x = codes[ip], operands[ip]
+        new_ip[ip] = len(new_codes)
+        n = 1
+        if ip in stores:
+            ip += 1
+            continue
+        elif ip in store_ops:
+            c, x = store_ops[ip]
+        elif c in _ADDRESSING and codes[ip + 1] == _Op.LOAD_64 and ip + 1 not in leaders:
+            c, n = _ADDRESSING[c][0], 2
+        elif c == _Op.CMP_I or c == _Op.CMP_F:
+            m = _match_cmp(codes, ip, leaders)
+            if m is not None:
+                n, pred, branching = m
+                table = (OP_CMP_I_BR if branching else OP_CMP_I_SET) if c == _Op.CMP_I else (OP_CMP_F_BR if branching else OP_CMP_F_SET)
+                c, x = table[pred], operands[ip + n - 1] if branching else None
+        for k in range(1, n):
+            new_ip[ip + k] = len(new_codes)
+        new_codes.append(c)
+        new_operands.append(x)
+        ip += n
+    new_ip[len(codes)] = len(new_codes)
+    
+    branches = _BRANCHES | set(OP_CMP_I_BR.values()) | set(OP_CMP_F_BR.values())
+    new_operands = [new_ip[x] if c in branches else x for c, x in zip(new_codes, new_operands)]
+    return new_codes, new_operands
@@ -0,0 +1,127 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from vm.vm_err import VmMemoryErr
+
+HEAP_ALIGN = 8
+_NUM_CLASSES = 128      # the exact-size free lists, for blocks of 8, 16, ..., 1016 bytes; the larger ones are "large"
+
+
+class HeapStats(NamedTuple):
+    live_bytes: int             # the requested bytes of the live blocks
+    live_blocks: int
+    peak_live_bytes: int
+    heap_bytes: int             # from the start of the heap to its top
+    free_bytes: int             # in the free blocks below the top
+    largest_free_block: int
+    fragmentation: float        # 1 - largest free block / free bytes: 0 when the free memory is in one piece
+    num_allocs: int
+    num_frees: int
+
+
+class HeapAllocator(object):
+    r"""
+    Manages the addresses of the heap, from `start` upwards (the bytes themselves are kept by `vm.memory.Memory`).
+    
+    Blocks are rounded up to 8 bytes. A freed block is merged with the free blocks right before and after it, and
+    given back to the unused memory above `top` if it ends there; the others are kept in free lists:
+        
+        * small blocks (up to 1016 bytes) in one list per size, so that a block of the right size is found at once
+        * large blocks in one map, searched for the best fit
+    
+    An allocation takes a block of the exact size if there is one, else splits the smallest larger free block, else
+    raises `top`. Entries of the size lists are not removed when their block is merged with a neighbour; they are
+    just checked against `_free_at` when popped.
+    
+    """
+    
+    def __init__(self, start: int):
+        self.start = self.top = start
+        self._classes: List[List[int]] = [[] for _ in range(_NUM_CLASSES)]
+        self._large: Dict[int, int] = {}            # address -> size of each large free block
+        self._free_at: Dict[int, int] = {}          # address -> size of each free block
+        self._free_end: Dict[int, int] = {}         # end address -> address of each free block
+        self._live: Dict[int, Tuple[int, int]] = {} # address -> (block size, requested size) of each live block
+        self._free_bytes = self._live_bytes = self._peak_live_bytes = 0
+        self._num_allocs = self._num_frees = 0
+    
+    def alloc(self, size: int) -> int:
+        n = max(HEAP_ALIGN, size + -size % HEAP_ALIGN)
+        a = self._take_free(n) if self._free_at else None
+        if a is None:
+            a = self.top
+            self.top += n
+        self._live[a] = (n, size)
+        self._num_allocs += 1
+        self._live_bytes += size
+        if self._live_bytes > self._peak_live_bytes:
+            self._peak_live_bytes = self._live_bytes
+        return a
+    
+    def free(self, addr: int):
+        block = self._live.pop(addr, None)
+        if block is None:
+            raise VmMemoryErr(f'free of {addr:#x} which is not a live heap block')
+        n, size = block
+        self._num_frees += 1
+        self._live_bytes -= size
+        nxt = self._free_at.get(addr + n)
+        if nxt is not None:
+            self._unlink(addr + n, nxt)
+            n += nxt
+        prev = self._free_end.get(addr)
+        if prev is not None:
+            self._unlink(prev, addr - prev)
+            addr, n = prev, n + addr - prev
+        self._link(addr, n)
+    
+    def _take_free(self, n: int) -> Optional[int]:
+        c = n // HEAP_ALIGN
+        for k in range(c, _NUM_CLASSES):
+            lst, m = self._classes[k], k * HEAP_ALIGN
+            while lst:
+                a = lst.pop()
+                if self._free_at.get(a) == m:
+                    return self._split(a, m, n)
+        fits = [(m, a) for a, m in self._large.items() if m >= n]
+        if fits:
+            m, a = min(fits)
+            return self._split(a, m, n)
+        return None
+    
+    def _split(self, a: int, m: int, n: int) -> int:
+        # takes the first n bytes of the free block (a, m)
+        self._unlink(a, m)
+        if m > n:
+            self._link(a + n, m - n)
+        return a
+    
+    def _link(self, a: int, n: int):
+        if a + n == self.top:
+            self.top = a
+            return
+        self._free_at[a] = n
+        self._free_end[a + n] = a
+        self._free_bytes += n
+        if n // HEAP_ALIGN < _NUM_CLASSES:
+            self._classes[n // HEAP_ALIGN].append(a)
+        else:
+            self._large[a] = n
+    
+    def _unlink(self, a: int, n: int):
+        del self._free_at[a]
+        del self._free_end[a + n]
+        self._free_bytes -= n
+        self._large.pop(a, None)
+    
+    def stats(self) -> HeapStats:
+        largest = max(self._free_at.values(), default=0)
+        return HeapStats(
+            live_bytes=self._live_bytes, live_blocks=len(self._live), peak_live_bytes=self._peak_live_bytes,
+            heap_bytes=self.top - self.start, free_bytes=self._free_bytes, largest_free_block=largest,
+            fragmentation=1 - largest / self._free_bytes if self._free_bytes else 0.,
+            num_allocs=self._num_allocs, num_frees=self._num_frees,
+        )
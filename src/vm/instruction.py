@@ -3,7 +3,7 @@
 # All rights reserved.
 
 from enum import Enum, unique
-from typing import Union
+from typing import Dict, Tuple, Union
 
 from utils.crawler import parse_html
 
@@ -71,6 +71,44 @@ class InstrType(Enum):
     XOR = 0x2d  # 计算 res = sta[-2] ^ sta[-1]；res 入栈
 
 
+# the byte size of the operand of each instruction in an o0 file (the ones not listed have no operand)
+OPERAND_SIZES = {
+    InstrType.PUSH: 8,
+    InstrType.POPN: 4, InstrType.LOCA: 4, InstrType.ARGA: 4, InstrType.GLOBA: 4, InstrType.STACKALLOC: 4,
+    InstrType.BR: 4, InstrType.BR_FALSE: 4, InstrType.BR_TRUE: 4,
+    InstrType.CALL: 4, InstrType.CALLNAME: 4,
+}
+
+# the (popped, pushed) slots of each instruction whose stack effect is fixed; the ones of POPN and STACKALLOC are given
+# by their operand, the ones of CALL and CALLNAME by the callee (its return slots and arguments are popped, and its
+# return slots pushed back), and BR/RET/PANIC do not touch the operand stack
+STACK_EFFECTS: Dict[InstrType, Tuple[int, int]] = {
+    InstrType.NOP: (0, 0), InstrType.PUSH: (0, 1), InstrType.POP: (1, 0), InstrType.DUP: (1, 2),
+    InstrType.LOCA: (0, 1), InstrType.ARGA: (0, 1), InstrType.GLOBA: (0, 1),
+    InstrType.LOAD_8: (1, 1), InstrType.LOAD_16: (1, 1), InstrType.LOAD_32: (1, 1), InstrType.LOAD_64: (1, 1),
+    InstrType.STORE_8: (2, 0), InstrType.STORE_16: (2, 0), InstrType.STORE_32: (2, 0), InstrType.STORE_64: (2, 0),
+    InstrType.ALLOC: (1, 1), InstrType.FREE: (1, 0),
+    **{it: (2, 1) for it in (
+        InstrType.ADD_I, InstrType.SUB_I, InstrType.MUL_I, InstrType.DIV_I,
+        InstrType.ADD_F, InstrType.SUB_F, InstrType.MUL_F, InstrType.DIV_F, InstrType.DIV_U,
+        InstrType.SHL, InstrType.SHR, InstrType.SHRL, InstrType.AND, InstrType.OR, InstrType.XOR,
+        InstrType.CMP_I, InstrType.CMP_U, InstrType.CMP_F,
+    )},
+    **{it: (1, 1) for it in (
+        InstrType.NOT, InstrType.NEG_I, InstrType.NEG_F, InstrType.ITOF, InstrType.FTOI, InstrType.SET_LT, InstrType.SET_GT,
+    )},
+    InstrType.BR: (0, 0), InstrType.BR_FALSE: (1, 0), InstrType.BR_TRUE: (1, 0),
+    InstrType.RET: (0, 0), InstrType.PANIC: (0, 0),
+    InstrType.SCAN_I: (0, 1), InstrType.SCAN_C: (0, 1), InstrType.SCAN_F: (0, 1),
+    InstrType.PRINT_I: (1, 0), InstrType.PRINT_C: (1, 0), InstrType.PRINT_F: (1, 0), InstrType.PRINT_S: (1, 0),
+    InstrType.PRINTLN: (0, 0),
+}
+# the (popped, pushed) slots of the builtin functions called by CALLNAME (the return slot is allocated by the caller)
+BUILTIN_STACK_EFFECTS: Dict[str, Tuple[int, int]] = {
+    'getint': (1, 1), 'getdouble': (1, 1), 'getchar': (1, 1),
+    'putint': (1, 0), 'putdouble': (1, 0), 'putchar': (1, 0), 'putstr': (1, 0), 'putln': (0, 0),
+}
+
 _operand_64bits_instr_types = {
     InstrType.PUSH,
 }
@@ -86,6 +124,7 @@ class Instruction(object):
         self.operand_signed = self.instr_type in _operand_signed_instr_types
         self.operand_32bits = self.instr_type not in _operand_64bits_instr_types
         self.ip = 0
+        self.global_ref = False     # a PUSH of the index of a global (a string literal), not of a number
     
     @property
     def op_is_int(self):
@@ -98,10 +137,10 @@ class Instruction(object):
         if self.operand_signed:
             op_str = op_str[:-1] + ', ' + f'next={self.ip + self.operand + 1})'
         return self.instr_type.name + op_str
-
+    
     def set_operand_to_skip_this_instr(self, instr):
         self.operand = instr.ip - self.ip
-
+    
     def set_operand_to_reach_this_instr(self, instr):
         self.operand = instr.ip - self.ip - 1
     
@@ -114,7 +153,7 @@ class Instruction(object):
         else:
             it = InstrType.LOCA
         return Instruction(it, var.offset)
-    
+
 if __name__ == '__main__':
     table = parse_html(url=r'https://c0.karenia.cc/navm/instruction.html', target_name='table')
     tuples = sorted(
@@ -0,0 +1,55 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from typing import List, NamedTuple, Tuple, Union
+
+from obj.reader import O0Reader, O0FormatError
+from vm.instruction import InstrType
+from vm.vm_err import VmLoadErr
+
+
+class O0Global(NamedTuple):
+    is_const: bool
+    value: bytes
+
+
+class O0Function(NamedTuple):
+    name: str
+    num_ret_vals: int
+    num_args: int
+    num_loc_vars: int
+    # the operand of `PUSH` is the i64 of its bits (a double stays encoded), and the others are u32 or i32
+    instructions: List[Tuple[InstrType, Union[int, None]]]
+    
+    @property
+    def num_params(self):
+        return self.num_ret_vals + self.num_args
+
+
+class O0Program(NamedTuple):
+    globals: List[O0Global]
+    functions: List[O0Function]
+
+
+def load_o0(data: bytes) -> O0Program:
+    r"""
+    Decodes the bytes of an o0 file (see `Assembler`) into globals and functions, through `obj.reader.O0Reader`.
+    """
+    try:
+        with O0Reader(data) as r:
+            gs = [O0Global(is_const=g.is_const, value=bytes(g.value)) for g in r.iter_globals()]
+            funcs = [
+                O0Function(
+                    name=r.func_name(f), num_ret_vals=f.num_ret_vals, num_args=f.num_args,
+                    num_loc_vars=f.num_loc_vars, instructions=list(r.iter_instructions(f)),
+                )
+                for f in r.iter_functions()
+            ]
+            trailing = r.trailing_bytes()
+    except O0FormatError as e:
+        raise VmLoadErr(str(e))
+    
+    if trailing:
+        raise VmLoadErr(f'{trailing} trailing bytes after the functions')
+    return O0Program(globals=gs, functions=funcs)
@@ -0,0 +1,591 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import math
+import operator
+import struct
+import sys
+from typing import IO, Callable, Dict, List, Optional, Set
+
+from utils.ints import I64_MAX, I64_MIN, U64_MASK, wrap_i64
+from vm.buffered_io import BlockScanner, OutputBuffer
+from vm.fusion import fuse
+from vm.instruction import InstrType
+from vm.loader import O0Program, O0Function
+from vm.memory import Memory
+from vm.opcodes import *
+from vm.verifier import StackVerificationError, frame_bound, verify_code
+from vm.vm_err import *
+
+STACK_BASE = 1 << 48            # addresses at and above it refer to stack slots (8 bytes each), the others to `Memory`
+DEFAULT_STACK_SLOTS = 1 << 20
+
+_I64, _F64 = struct.Struct('<q'), struct.Struct('<d')
+
+_BRANCHES = {InstrType.BR, InstrType.BR_FALSE, InstrType.BR_TRUE}
+_CALL = InstrType.CALL.value
+_BUILTINS = {
+    'getint': OP_GETINT, 'getdouble': OP_GETDOUBLE, 'getchar': OP_GETCHAR,
+    'putint': InstrType.PRINT_I.value, 'putdouble': InstrType.PRINT_F.value, 'putchar': InstrType.PRINT_C.value,
+    'putstr': InstrType.PRINT_S.value, 'putln': InstrType.PRINTLN.value,
+}
+# the predicates of `vm.opcodes.PREDICATES` on the operands of CMP_I and CMP_F (whose result is 0 when either is NaN)
+_INT_PREDS = {'lt': operator.lt, 'gt': operator.gt, 'ne': operator.ne, 'eq': operator.eq, 'ge': operator.ge, 'le': operator.le}
+_F64_PREDS = {
+    'lt': operator.lt, 'gt': operator.gt,
+    'ne': lambda a, b: a < b or a > b, 'eq': lambda a, b: not (a < b or a > b),
+    'ge': lambda a, b: not a < b, 'le': lambda a, b: not a > b,
+}
+
+
+def f64_of(v) -> float:
+    # a slot holds an int or a float; the ints used as doubles are bit patterns (e.g. a `PUSH` of a double literal)
+    return v if v.__class__ is float else _F64.unpack(_I64.pack(wrap_i64(v)))[0]
+
+
+def i64_of(v) -> int:
+    return _I64.unpack(_F64.pack(v))[0] if v.__class__ is float else v
+
+
+class _Halt(Exception):
+    pass
+
+
+class DecodedFunc(object):
+    __slots__ = ('idx', 'name', 'num_ret_vals', 'num_params', 'num_loc_vars', 'zeros', 'codes', 'operands', 'max_depth', 'callees')
+    
+    def __init__(self, idx: int, func: O0Function, codes: List[int], operands: List, max_depth: int, callees: Set[int]):
+        self.idx, self.name = idx, func.name
+        self.num_ret_vals, self.num_params, self.num_loc_vars = func.num_ret_vals, func.num_params, func.num_loc_vars
+        self.zeros = [0] * func.num_loc_vars
+        self.codes, self.operands = codes, operands
+        self.max_depth, self.callees = max_depth, callees     # see `vm.verifier`
+
+
+class VirtualMachine(object):
+    r"""
+    A stack virtual machine that executes o0 programs (see `vm.loader.load_o0`), following the semantics of navm.
+    
+    The instructions of each function are decoded ahead of time into two parallel lists, the opcodes and the operands,
+    with everything that can be resolved statically already resolved:
+        
+        * BR/BR_FALSE/BR_TRUE: the absolute index of the target
+        * GLOBA: the address of the global
+        * CALLNAME: turned into CALL of the function index, or into the opcode of the builtin
+    
+    The interpreter loop then dispatches on a table of handlers indexed by the opcode. With `fusing`, the common
+    sequences emitted by the analyzer are also replaced by superinstructions (see `vm.fusion`), so that fewer
+    instructions are dispatched; `num_executed` then counts the dispatched ones.
+    
+    The operand stack is a preallocated list of slots, each holding an int (i64, wrapped on overflow) or a float;
+    the stack effects are verified when decoding, and give the exact size of the list when nothing is recursive.
+    A frame is laid out as in navm: the return slots and the arguments pushed by the caller (`ARGA 0` is the first
+    return slot), then the local variables (`LOCA 0`). The return addresses are kept on a separate list.
+    Stack slots are addressed from `STACK_BASE` upwards, globals and the heap live in `Memory`.
+    The input is scanned in binary blocks and the output is collected in a buffer (see `vm.buffered_io`).
+    
+    Examples:
+        
+        >>> vm = VirtualMachine(load_o0(data), fin=sys.stdin, fout=sys.stdout)
+        >>> num_executed_instrs = vm.run()
+    
+    """
+    
+    def __init__(self, program: O0Program, fin: IO[str] = sys.stdin, fout: IO[str] = sys.stdout, stack_slots: int = DEFAULT_STACK_SLOTS, fusing: bool = False):
+        super(VirtualMachine, self).__init__()
+        self._program = program
+        self._fusing = fusing
+        self._fin, self._fout = fin, fout
+        self._stack_slots = stack_slots
+        self.mem = Memory([g.value for g in program.globals])
+        self._func_indices: Dict[str, int] = {f.name: i for i, f in enumerate(program.functions)}
+        self.funcs: List[DecodedFunc] = [self._decode(i, f) for i, f in enumerate(program.functions)]
+        self.num_executed = 0
+    
+    def reset(self, fin: IO[str], fout: IO[str]):
+        r"""
+        Prepares another run of the same program on other streams: the memory gets its initial values back, while the
+        decoded (or translated) functions are kept.
+        """
+        self._fin, self._fout = fin, fout
+        self.mem.reset()
+        self.num_executed = 0
+    
+    def _decode(self, idx: int, func: O0Function) -> DecodedFunc:
+        num_instrs = len(func.instructions)
+        codes, operands = [], []
+        for ip, (it, x) in enumerate(func.instructions):
+            code = it.value
+            if it in _BRANCHES:
+                x += ip + 1
+                if not 0 <= x <= num_instrs:
+                    raise VmLoadErr(f'branch out of function "{func.name}" at #{ip}')
+            elif it == InstrType.GLOBA:
+                if x >= len(self.mem.global_addrs):
+                    raise VmLoadErr(f'global #{x} does not exist (in "{func.name}" at #{ip})')
+                x = self.mem.global_addrs[x]
+            elif it == InstrType.CALL:
+                if x >= len(self._program.functions):
+                    raise VmLoadErr(f'function #{x} does not exist (in "{func.name}" at #{ip})')
+            elif it == InstrType.CALLNAME:
+                name = self.mem.global_bytes(x).decode('ascii', errors='replace')
+                if name in self._func_indices:
+                    code, x = InstrType.CALL.value, self._func_indices[name]
+                elif name in _BUILTINS:
+                    code, x = _BUILTINS[name], None
+                else:
+                    raise VmLoadErr(f'function "{name}" does not exist (in "{func.name}" at #{ip})')
+            codes.append(code)
+            operands.append(x)
+        funcs = self._program.functions
+        try:
+            info = verify_code(
+                func.name, codes, operands, lambda c, f: (funcs[f].num_params, funcs[f].num_ret_vals),
+                may_fall_off=func.name == '_start', absolute_branches=True,
+            )
+        except StackVerificationError as e:
+            raise VmLoadErr(str(e))
+        callees = {x for c, x in zip(codes, operands) if c == _CALL}
+        codes.append(OP_END)
+        operands.append(None)
+        if self._fusing:
+            codes, operands = fuse(codes, operands, lambda f: (funcs[f].num_params, funcs[f].num_ret_vals))
+        return DecodedFunc(idx, func, codes, operands, info.max_depth, callees)
+    
+    def stack_slots_for(self, entry: str) -> int:
+        r"""
+        The slots of the stack of a run from `entry`: exactly the verified bound when no function can call itself,
+        else `stack_slots`, which stays the limit in any case.
+        """
+        funcs = self.funcs
+        bound = frame_bound([f.num_loc_vars for f in funcs], [f.max_depth for f in funcs], [f.callees for f in funcs], self._func_indices[entry])
+        return self._stack_slots if bound is None else min(bound, self._stack_slots)
+    
+    def run(self, entry: str = '_start', tracer: Optional[Callable[[DecodedFunc, int, int, List], None]] = None, sample_every: int = 0) -> int:
+        r"""
+        Runs the program from `entry` and returns the number of executed (dispatched) instructions.
+        
+        If a `tracer` is given, `tracer(func, ip, code, frames)` is called before each instruction, or only before
+        every `sample_every`-th one if it is positive; `frames` holds the (func, return ip, bp, lb) of the callers.
+        Without a tracer the loop pays nothing for it.
+        """
+        if entry not in self._func_indices:
+            raise VmLoadErr(f'entry function "{entry}" not found')
+        funcs, mem = self.funcs, self.mem
+        scanner, out = BlockScanner(self._fin), OutputBuffer(self._fout)
+        write = out.write
+        st = [0] * self.stack_slots_for(entry)
+        cap = len(st)
+        frames = []     # (func, return ip, bp, lb) of the callers
+        
+        func = funcs[self._func_indices[entry]]
+        if func.num_params:
+            raise VmCallErr(f'entry function "{entry}" cannot take parameters')
+        codes, operands = func.codes, func.operands
+        ip, bp, lb, sp = 0, 0, 0, func.num_loc_vars    # bp: the first param slot, lb: the first local slot
+        
+        def illegal(x):
+            raise VmIllegalInstrErr(f'illegal opcode {codes[ip - 1]:#x} in "{func.name}" at #{ip - 1}')
+        
+        def nop(x):
+            pass
+        
+        def push(x):
+            nonlocal sp
+            st[sp] = x
+            sp += 1
+        
+        def pop(x):
+            nonlocal sp
+            sp -= 1
+        
+        def popn(x):
+            nonlocal sp
+            sp -= x
+        
+        def dup(x):
+            nonlocal sp
+            st[sp] = st[sp - 1]
+            sp += 1
+        
+        def loca(x):
+            nonlocal sp
+            st[sp] = STACK_BASE + ((lb + x) << 3)
+            sp += 1
+        
+        def arga(x):
+            nonlocal sp
+            st[sp] = STACK_BASE + ((bp + x) << 3)
+            sp += 1
+        
+        def load_64(x):
+            a = st[sp - 1]
+            if a >= STACK_BASE:
+                a -= STACK_BASE
+                if a & 7:
+                    raise VmMemoryErr(f'unaligned stack address {a + STACK_BASE:#x}')
+                st[sp - 1] = st[a >> 3]
+            else:
+                st[sp - 1] = mem.load(a, 8)
+        
+        def store_64(x):
+            nonlocal sp
+            sp -= 2
+            a, v = st[sp], st[sp + 1]
+            if a >= STACK_BASE:
+                a -= STACK_BASE
+                if a & 7:
+                    raise VmMemoryErr(f'unaligned stack address {a + STACK_BASE:#x}')
+                st[a >> 3] = v
+            else:
+                mem.store(a, 8, v)
+        
+        def make_load(width):
+            def load(x):
+                a = st[sp - 1]
+                if a >= STACK_BASE:
+                    raise VmMemoryErr(f'{width}-byte access to a stack slot')
+                st[sp - 1] = mem.load(a, width)
+            return load
+        
+        def make_store(width):
+            def store(x):
+                nonlocal sp
+                sp -= 2
+                a = st[sp]
+                if a >= STACK_BASE:
+                    raise VmMemoryErr(f'{width}-byte access to a stack slot')
+                mem.store(a, width, st[sp + 1])
+            return store
+        
+        def alloc(x):
+            st[sp - 1] = mem.alloc(st[sp - 1])
+        
+        def free(x):
+            nonlocal sp
+            sp -= 1
+            mem.free(st[sp])
+        
+        def stackalloc(x):
+            nonlocal sp
+            if sp + x > cap:
+                raise VmStackErr('stack overflow')
+            st[sp:sp + x] = [0] * x
+            sp += x
+        
+        def add_i(x):
+            nonlocal sp
+            sp -= 1
+            r = st[sp - 1] + st[sp]
+            st[sp - 1] = r if I64_MIN <= r <= I64_MAX else wrap_i64(r)
+        
+        def sub_i(x):
+            nonlocal sp
+            sp -= 1
+            r = st[sp - 1] - st[sp]
+            st[sp - 1] = r if I64_MIN <= r <= I64_MAX else wrap_i64(r)
+        
+        def mul_i(x):
+            nonlocal sp
+            sp -= 1
+            r = st[sp - 1] * st[sp]
+            st[sp - 1] = r if I64_MIN <= r <= I64_MAX else wrap_i64(r)
+        
+        def div_i(x):
+            nonlocal sp
+            sp -= 1
+            a, b = st[sp - 1], st[sp]
+            if b == 0:
+                raise VmArithmeticErr('division by zero')
+            q = abs(a) // abs(b)
+            st[sp - 1] = wrap_i64(-q if (a < 0) != (b < 0) else q)
+        
+        def div_u(x):
+            nonlocal sp
+            sp -= 1
+            a, b = st[sp - 1] & U64_MASK, st[sp] & U64_MASK
+            if b == 0:
+                raise VmArithmeticErr('division by zero')
+            st[sp - 1] = wrap_i64(a // b)
+        
+        def make_bitwise(op):
+            def bitwise(x):
+                nonlocal sp
+                sp -= 1
+                st[sp - 1] = op(st[sp - 1], st[sp])
+            return bitwise
+        
+        def shl(x):
+            nonlocal sp
+            sp -= 1
+            st[sp - 1] = wrap_i64(st[sp - 1] << (st[sp] & 63))
+        
+        def shr(x):
+            nonlocal sp
+            sp -= 1
+            st[sp - 1] = st[sp - 1] >> (st[sp] & 63)
+        
+        def shrl(x):
+            nonlocal sp
+            sp -= 1
+            st[sp - 1] = wrap_i64((st[sp - 1] & U64_MASK) >> (st[sp] & 63))
+        
+        def make_arith_f(op):
+            def arith_f(x):
+                nonlocal sp
+                sp -= 1
+                st[sp - 1] = op(f64_of(st[sp - 1]), f64_of(st[sp]))
+            return arith_f
+        
+        def div_f(a, b):
+            if b == 0:
+                return math.copysign(math.inf, a) * math.copysign(1, b) if a == a and a != 0 else math.nan
+            return a / b
+        
+        def cmp_i(x):
+            nonlocal sp
+            sp -= 1
+            a, b = st[sp - 1], st[sp]
+            st[sp - 1] = (a > b) - (a < b)
+        
+        def cmp_u(x):
+            nonlocal sp
+            sp -= 1
+            a, b = st[sp - 1] & U64_MASK, st[sp] & U64_MASK
+            st[sp - 1] = (a > b) - (a < b)
+        
+        def cmp_f(x):
+            nonlocal sp
+            sp -= 1
+            a, b = f64_of(st[sp - 1]), f64_of(st[sp])
+            st[sp - 1] = (a > b) - (a < b)     # 0 when either is NaN
+        
+        def neg_i(x):
+            st[sp - 1] = wrap_i64(-st[sp - 1])
+        
+        def neg_f(x):
+            st[sp - 1] = -f64_of(st[sp - 1])
+        
+        def itof(x):
+            st[sp - 1] = float(st[sp - 1])
+        
+        def ftoi(x):
+            f = f64_of(st[sp - 1])
+            # saturating, as the `as` of rust
+            st[sp - 1] = 0 if f != f else I64_MAX if f >= 2.0 ** 63 else I64_MIN if f < -2.0 ** 63 else int(f)
+        
+        def not_(x):
+            st[sp - 1] = 0 if st[sp - 1] else 1
+        
+        def set_lt(x):
+            st[sp - 1] = 1 if st[sp - 1] < 0 else 0
+        
+        def set_gt(x):
+            st[sp - 1] = 1 if st[sp - 1] > 0 else 0
+        
+        def br(x):
+            nonlocal ip
+            ip = x
+        
+        def br_false(x):
+            nonlocal sp, ip
+            sp -= 1
+            if not st[sp]:
+                ip = x
+        
+        def br_true(x):
+            nonlocal sp, ip
+            sp -= 1
+            if st[sp]:
+                ip = x
+        
+        def call(x):
+            nonlocal func, codes, operands, ip, bp, lb, sp
+            frames.append((func, ip, bp, lb))
+            func = funcs[x]
+            bp, lb = sp - func.num_params, sp
+            if bp < 0:
+                raise VmStackErr(f'stack underflow when calling "{func.name}"')
+            if sp + func.num_loc_vars > cap:
+                raise VmStackErr('stack overflow')
+            st[sp:sp + func.num_loc_vars] = func.zeros
+            sp += func.num_loc_vars
+            codes, operands, ip = func.codes, func.operands, 0
+        
+        def ret(x):
+            nonlocal func, codes, operands, ip, bp, lb, sp
+            sp = bp + func.num_ret_vals
+            if not frames:
+                raise _Halt()
+            func, ip, bp, lb = frames.pop()
+            codes, operands = func.codes, func.operands
+        
+        def end(x):
+            if frames:
+                raise VmCallErr(f'control reaches the end of "{func.name}"')
+            raise _Halt()
+        
+        def panic(x):
+            raise VmPanicErr(f'panic in "{func.name}" at #{ip - 1}')
+        
+        def make_scan(scan):
+            def scan_push(x):
+                nonlocal sp
+                st[sp] = scan()
+                sp += 1
+            return scan_push
+        
+        def make_get(scan):
+            def get_into_ret_slot(x):
+                st[sp - 1] = scan()
+            return get_into_ret_slot
+        
+        def print_i(x):
+            nonlocal sp
+            sp -= 1
+            write(b'%d' % i64_of(st[sp]))
+        
+        def print_c(x):
+            nonlocal sp
+            sp -= 1
+            out.write_c(st[sp])
+        
+        def print_f(x):
+            nonlocal sp
+            sp -= 1
+            write(b'%.6f' % f64_of(st[sp]))
+        
+        def print_s(x):
+            nonlocal sp
+            sp -= 1
+            out.write_s(mem.global_bytes(st[sp]))
+        
+        def println(x):
+            write(b'\n')
+        
+        def load_loc(x):
+            nonlocal sp
+            st[sp] = st[lb + x]
+            sp += 1
+        
+        def load_arg(x):
+            nonlocal sp
+            st[sp] = st[bp + x]
+            sp += 1
+        
+        def load_glob(x):
+            nonlocal sp
+            st[sp] = mem.load(x, 8)
+            sp += 1
+        
+        def store_loc(x):
+            nonlocal sp
+            sp -= 1
+            st[lb + x] = st[sp]
+        
+        def store_arg(x):
+            nonlocal sp
+            sp -= 1
+            st[bp + x] = st[sp]
+        
+        def store_glob(x):
+            nonlocal sp
+            sp -= 1
+            mem.store(x, 8, st[sp])
+        
+        def make_cmp_br(pred, is_float):
+            def cmp_br(x):
+                nonlocal sp, ip
+                sp -= 2
+                if is_float:
+                    if pred(f64_of(st[sp]), f64_of(st[sp + 1])):
+                        ip = x
+                elif pred(st[sp], st[sp + 1]):
+                    ip = x
+            return cmp_br
+        
+        def make_cmp_set(pred, is_float):
+            def cmp_set(x):
+                nonlocal sp
+                sp -= 1
+                if is_float:
+                    st[sp - 1] = 1 if pred(f64_of(st[sp - 1]), f64_of(st[sp])) else 0
+                else:
+                    st[sp - 1] = 1 if pred(st[sp - 1], st[sp]) else 0
+            return cmp_set
+        
+        table = [illegal] * NUM_OPS
+        for it, h in {
+            InstrType.NOP: nop, InstrType.PUSH: push, InstrType.POP: pop, InstrType.POPN: popn, InstrType.DUP: dup,
+            InstrType.LOCA: loca, InstrType.ARGA: arga, InstrType.GLOBA: push,
+            InstrType.LOAD_8: make_load(1), InstrType.LOAD_16: make_load(2), InstrType.LOAD_32: make_load(4),
+            InstrType.LOAD_64: load_64,
+            InstrType.STORE_8: make_store(1), InstrType.STORE_16: make_store(2), InstrType.STORE_32: make_store(4),
+            InstrType.STORE_64: store_64,
+            InstrType.ALLOC: alloc, InstrType.FREE: free, InstrType.STACKALLOC: stackalloc,
+            InstrType.ADD_I: add_i, InstrType.SUB_I: sub_i, InstrType.MUL_I: mul_i,
+            InstrType.DIV_I: div_i, InstrType.DIV_U: div_u,
+            InstrType.ADD_F: make_arith_f(operator.add), InstrType.SUB_F: make_arith_f(operator.sub),
+            InstrType.MUL_F: make_arith_f(operator.mul), InstrType.DIV_F: make_arith_f(div_f),
+            InstrType.SHL: shl, InstrType.SHR: shr, InstrType.SHRL: shrl,
+            InstrType.AND: make_bitwise(operator.and_), InstrType.OR: make_bitwise(operator.or_),
+            InstrType.XOR: make_bitwise(operator.xor), InstrType.NOT: not_,
+            InstrType.CMP_I: cmp_i, InstrType.CMP_U: cmp_u, InstrType.CMP_F: cmp_f,
+            InstrType.NEG_I: neg_i, InstrType.NEG_F: neg_f, InstrType.ITOF: itof, InstrType.FTOI: ftoi,
+            InstrType.SET_LT: set_lt, InstrType.SET_GT: set_gt,
+            InstrType.BR: br, InstrType.BR_FALSE: br_false, InstrType.BR_TRUE: br_true,
+            InstrType.CALL: call, InstrType.RET: ret, InstrType.PANIC: panic,
+            InstrType.SCAN_I: make_scan(scanner.scan_i), InstrType.SCAN_F: make_scan(scanner.scan_f),
+            InstrType.SCAN_C: make_scan(scanner.scan_c),
+            InstrType.PRINT_I: print_i, InstrType.PRINT_C: print_c, InstrType.PRINT_F: print_f,
+            InstrType.PRINT_S: print_s, InstrType.PRINTLN: println,
+        }.items():
+            table[it.value] = h
+        table[OP_GETINT], table[OP_GETDOUBLE] = make_get(scanner.scan_i), make_get(scanner.scan_f)
+        table[OP_GETCHAR], table[OP_END] = make_get(scanner.scan_c), end
+        table[OP_LOAD_LOC], table[OP_LOAD_ARG], table[OP_LOAD_GLOB] = load_loc, load_arg, load_glob
+        table[OP_STORE_LOC], table[OP_STORE_ARG], table[OP_STORE_GLOB] = store_loc, store_arg, store_glob
+        for p in PREDICATES:
+            table[OP_CMP_I_BR[p]], table[OP_CMP_I_SET[p]] = make_cmp_br(_INT_PREDS[p], False), make_cmp_set(_INT_PREDS[p], False)
+            table[OP_CMP_F_BR[p]], table[OP_CMP_F_SET[p]] = make_cmp_br(_F64_PREDS[p], True), make_cmp_set(_F64_PREDS[p], True)
+        
+        n = 0
+        try:
+            if tracer is None:
+                while True:
+                    c = codes[ip]
+                    x = operands[ip]
+                    ip += 1
+                    n += 1
+                    table[c](x)
+            elif sample_every > 0:
+                countdown = sample_every
+                while True:
+                    c = codes[ip]
+                    x = operands[ip]
+                    countdown -= 1
+                    if not countdown:
+                        countdown = sample_every
+                        tracer(func, ip, c, frames)
+                    ip += 1
+                    n += 1
+                    table[c](x)
+            else:
+                while True:
+                    c = codes[ip]
+                    x = operands[ip]
+                    tracer(func, ip, c, frames)
+                    ip += 1
+                    n += 1
+                    table[c](x)
+        except _Halt:
+            pass
+        except IndexError:
+            if sp >= cap:
+                raise VmStackErr('stack overflow')
+            raise
+        finally:
+            self.num_executed = n
+            out.flush()
+        return n
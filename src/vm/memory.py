@@ -0,0 +1,134 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import struct
+import sys
+from typing import List, Union
+
+from vm.heap import HEAP_ALIGN, HeapAllocator, HeapStats
+from vm.vm_err import VmMemoryErr
+
+_LOADERS = {1: struct.Struct('<B'), 2: struct.Struct('<H'), 4: struct.Struct('<L'), 8: struct.Struct('<q')}
+_STORERS = {1: struct.Struct('<B'), 2: struct.Struct('<H'), 4: struct.Struct('<L'), 8: struct.Struct('<Q')}
+_F64 = struct.Struct('<d')
+_ALIGN = HEAP_ALIGN
+_VIEW_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'q'}
+_SHIFTS = [0, 0, 1, 0, 2, 0, 0, 0, 3]
+_MASKS = [0, 0xff, 0xffff, 0, 0xffffffff, 0, 0, 0, (1 << 64) - 1]
+# the typed views are native-endian: they are only used on little-endian hosts, and on aligned addresses
+_TYPED_VIEWS = sys.byteorder == 'little' and all(struct.calcsize(f) == w for w, f in _VIEW_FORMATS.items())
+
+
+class Memory(object):
+    r"""
+    The byte-addressable memory of the virtual machine: the globals followed by the heap, in one `bytearray` arena.
+    
+    Address 0 is kept as null. Each global starts at an 8-byte aligned address (`global_addrs`) and the heap grows
+    after them. Values are little-endian, as in navm; a 64-bit load gives the i64 of the bits, so a double stored
+    in memory is read back as its bit pattern (the float instructions of the machine reinterpret it).
+    
+    Aligned loads and stores index `memoryview.cast` views of the arena (one per width, and one of doubles) instead
+    of going through `struct`; the views are made again whenever the arena grows (by doubling). The heap blocks are
+    managed by `vm.heap.HeapAllocator`, which reuses and merges freed blocks; a block is zeroed when allocated.
+    `reset` brings the memory back to its initial state, so that the program can be run again.
+    
+    """
+    
+    def __init__(self, global_values: List[bytes]):
+        self._mem = bytearray(_ALIGN)
+        self.global_addrs: List[int] = []
+        for v in global_values:
+            self.global_addrs.append(len(self._mem))
+            self._mem.extend(v)
+            self._mem.extend(bytes(-len(self._mem) % _ALIGN))
+        self._global_values = global_values
+        self._image = bytes(self._mem)      # the initial globals
+        self._heap = HeapAllocator(len(self._image))
+        self._end = len(self._image)        # the top of the heap: the end of the valid addresses
+        self._views: List = []
+        self._make_views()
+    
+    def _make_views(self):
+        if not _TYPED_VIEWS:
+            self._views, self._f64_view = [None] * 9, None
+            return
+        mv = memoryview(self._mem)
+        self._views = [None] * 9
+        for w, f in _VIEW_FORMATS.items():
+            self._views[w] = mv.cast(f)
+        self._f64_view = mv.cast('d')
+    
+    def _release_views(self):
+        # a bytearray cannot be resized while a view of it exists
+        for v in self._views:
+            if v is not None:
+                v.release()
+        if self._f64_view is not None:
+            self._f64_view.release()
+        self._views, self._f64_view = [None] * 9, None
+    
+    def _grow(self, size: int):
+        self._release_views()
+        self._mem.extend(bytes(max(size, 2 * len(self._mem)) - len(self._mem)))
+        self._make_views()
+    
+    def reset(self):
+        self._release_views()
+        self._mem[:] = self._image
+        self._heap = HeapAllocator(len(self._image))
+        self._end = len(self._image)
+        self._make_views()
+    
+    def global_bytes(self, idx: int) -> bytes:
+        if not 0 <= idx < len(self.global_addrs):
+            raise VmMemoryErr(f'global #{idx} does not exist')
+        a = self.global_addrs[idx]
+        return bytes(self._mem[a:a + len(self._global_values[idx])])
+    
+    def alloc(self, size: int) -> int:
+        if size < 0:
+            raise VmMemoryErr(f'cannot allocate {size} bytes')
+        addr = self._heap.alloc(size)
+        self._end = self._heap.top
+        if self._end > len(self._mem):
+            self._grow(self._end)
+        self._mem[addr:addr + size] = bytes(size)
+        return addr
+    
+    def free(self, addr: int):
+        self._heap.free(addr)
+        self._end = self._heap.top
+    
+    def heap_stats(self) -> HeapStats:
+        return self._heap.stats()
+    
+    def load(self, addr: int, width: int) -> int:
+        if addr < _ALIGN or addr + width > self._end:
+            raise VmMemoryErr(f'invalid {width}-byte load at {addr:#x}')
+        view = self._views[width]
+        if view is None or addr & (width - 1):
+            return _LOADERS[width].unpack_from(self._mem, addr)[0]
+        return view[addr >> _SHIFTS[width]]
+    
+    def store(self, addr: int, width: int, val: Union[int, float]):
+        if addr < _ALIGN or addr + width > self._end:
+            raise VmMemoryErr(f'invalid {width}-byte store at {addr:#x}')
+        if val.__class__ is float:
+            if width != 8:
+                raise VmMemoryErr(f'cannot store a double in {width} bytes')
+            if self._f64_view is None or addr & 7:
+                _F64.pack_into(self._mem, addr, val)
+            else:
+                self._f64_view[addr >> 3] = val
+            return
+        view = self._views[width]
+        if view is None or addr & (width - 1):
+            _STORERS[width].pack_into(self._mem, addr, val & _MASKS[width])
+        elif width == 8:
+            try:
+                view[addr >> 3] = val
+            except (ValueError, OverflowError, TypeError):    # not an i64 (or not an int)
+                _STORERS[8].pack_into(self._mem, addr, val & _MASKS[8])
+        else:
+            view[addr >> _SHIFTS[width]] = val & _MASKS[width]
@@ -0,0 +1,27 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+# internal opcodes, only seen by the decoded code of the virtual machines (the opcodes in an o0 file are bytes)
+
+OP_GETINT = 0x100               # `CALLNAME getint`: scans an int into the return slot reserved by the caller
+OP_GETDOUBLE = 0x101
+OP_GETCHAR = 0x102
+OP_END = 0x103                  # appended after the last instruction of every function
+
+# superinstructions (see `vm.fusion`)
+OP_LOAD_LOC = 0x110             # LOCA n; LOAD_64
+OP_LOAD_ARG = 0x111             # ARGA n; LOAD_64
+OP_LOAD_GLOB = 0x112            # GLOBA n; LOAD_64 (the operand is the address of the global)
+OP_STORE_LOC = 0x113            # LOCA n; <expr>; STORE_64 (LOCA n is dropped and STORE_64 becomes this)
+OP_STORE_ARG = 0x114            # ARGA n; <expr>; STORE_64
+OP_STORE_GLOB = 0x115           # GLOBA n; <expr>; STORE_64
+
+# a comparison of the two values on the top, as a predicate on the result `c` of CMP_I/CMP_F
+PREDICATES = ('lt', 'gt', 'ne', 'eq', 'ge', 'le')      # c < 0, c > 0, c != 0, c == 0, c >= 0, c <= 0
+OP_CMP_I_BR = {p: 0x120 + i for i, p in enumerate(PREDICATES)}     # CMP_I; [SET_LT | SET_GT]; [NOT]; BR_TRUE/BR_FALSE
+OP_CMP_F_BR = {p: 0x130 + i for i, p in enumerate(PREDICATES)}
+OP_CMP_I_SET = {p: 0x140 + i for i, p in enumerate(PREDICATES)}    # CMP_I; SET_LT | SET_GT | NOT; [NOT]
+OP_CMP_F_SET = {p: 0x150 + i for i, p in enumerate(PREDICATES)}
+
+NUM_OPS = 0x160
@@ -0,0 +1,153 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import json
+from collections import Counter
+from typing import IO, Dict, List, Tuple
+
+from vm.instruction import InstrType
+from vm.machine import DecodedFunc, VirtualMachine
+from vm.opcodes import *
+
+_BACKWARD_BRANCHES = {InstrType.BR.value, InstrType.BR_FALSE.value, InstrType.BR_TRUE.value}
+OP_NAMES: Dict[int, str] = {
+    **{it.value: it.name.lower() for it in InstrType},
+    OP_GETINT: 'callname getint', OP_GETDOUBLE: 'callname getdouble', OP_GETCHAR: 'callname getchar', OP_END: 'end',
+}
+
+
+class ExecutionProfiler(object):
+    r"""
+    Profiles the execution of an o0 program on `VirtualMachine` (without fusion, so that the counts are the ones of
+    the instructions in the file).
+    
+    In the exact mode, every instruction is traced and the profile holds:
+        
+        * the count of each opcode
+        * the calls of each function, its exclusive instructions (executed in its own body) and its inclusive ones
+          (also in the functions it calls; recursive activations are only counted once)
+        * the hits of each instruction, and the hot loops: the targets of backward branches with their iterations
+        * the exclusive instructions of each call stack, for flame graphs
+    
+    In the sampling mode (`sample_every` = N > 0), only every N-th instruction is looked at, and the counts are
+    estimated by multiplying the samples by N; the calls of the functions are unknown then.
+    
+    Examples:
+        
+        >>> prof = ExecutionProfiler(VirtualMachine(program, fin, fout), sample_every=0)
+        >>> prof.run()
+        >>> prof.dump_json(fp)
+        >>> prof.dump_folded(fp)     # one "main;f1;f0 1234" per line, as `flamegraph.pl` expects
+    
+    """
+    
+    def __init__(self, vm: VirtualMachine, sample_every: int = 0):
+        self._vm, self._sample_every = vm, sample_every
+        funcs = vm.funcs
+        self._op_counts = [0] * NUM_OPS
+        self._calls = [0] * len(funcs)
+        self._exclusive = [0] * len(funcs)
+        self._inclusive = [0] * len(funcs)
+        self._hits: List[List[int]] = [[0] * len(f.codes) for f in funcs]
+        self._folded: Counter = Counter()
+        self.total = 0
+        
+        # the shadow call stack of the exact mode: (func idx, the instruction count at the entry, the folded path)
+        self._stack: List[Tuple[int, int, str]] = []
+        self._active = [0] * len(funcs)     # the number of activations of each function on the stack
+    
+    def run(self, entry: str = '_start'):
+        try:
+            if self._sample_every > 0:
+                self._vm.run(entry, tracer=self._sample, sample_every=self._sample_every)
+            else:
+                self._vm.run(entry, tracer=self._trace)
+        finally:
+            if self._sample_every > 0:
+                self.total = self._vm.num_executed
+            while self._stack:
+                self._leave()
+    
+    def _enter(self, fi: int, name: str):
+        path = f'{self._stack[-1][2]};{name}' if self._stack else name
+        self._stack.append((fi, self.total, path))
+        self._calls[fi] += 1
+        self._active[fi] += 1
+    
+    def _leave(self):
+        fi, entry_count, _ = self._stack.pop()
+        self._active[fi] -= 1
+        if not self._active[fi]:
+            self._inclusive[fi] += self.total - entry_count
+    
+    def _trace(self, func: DecodedFunc, ip: int, code: int, frames: List):
+        # the depth changes by one at most between two instructions (CALL enters, RET leaves)
+        depth = len(frames) + 1
+        if len(self._stack) > depth:
+            self._leave()
+        elif len(self._stack) < depth:
+            self._enter(func.idx, func.name)
+        self.total += 1
+        self._op_counts[code] += 1
+        self._exclusive[func.idx] += 1
+        self._hits[func.idx][ip] += 1
+        self._folded[self._stack[-1][2]] += 1
+    
+    def _sample(self, func: DecodedFunc, ip: int, code: int, frames: List):
+        n = self._sample_every
+        self._op_counts[code] += n
+        self._exclusive[func.idx] += n
+        self._hits[func.idx][ip] += n
+        stack = [f for f, _, _, _ in frames] + [func]
+        self._folded[';'.join(f.name for f in stack)] += n
+        for fi in {f.idx for f in stack}:
+            self._inclusive[fi] += n
+    
+    def hot_loops(self, top: int = 20) -> List[Dict]:
+        loops = []
+        for f, hits in zip(self._vm.funcs, self._hits):
+            for ip, (c, x) in enumerate(zip(f.codes, f.operands)):
+                if c in _BACKWARD_BRANCHES and x <= ip and hits[x]:
+                    loops.append({
+                        'func': f.name, 'header_ip': x, 'back_edge_ip': ip,
+                        'iterations': hits[ip] if c == InstrType.BR.value else hits[x],
+                        'instrs': sum(hits[x:ip + 1]),
+                    })
+        loops.sort(key=lambda l: -l['instrs'])
+        return loops[:top]
+    
+    def hot_instructions(self, top: int = 20) -> List[Dict]:
+        res = [
+            {'func': f.name, 'ip': ip, 'op': OP_NAMES.get(f.codes[ip], hex(f.codes[ip])), 'hits': h}
+            for f, hits in zip(self._vm.funcs, self._hits) for ip, h in enumerate(hits) if h
+        ]
+        res.sort(key=lambda r: -r['hits'])
+        return res[:top]
+    
+    def to_dict(self, top: int = 20) -> Dict:
+        exact = self._sample_every <= 0
+        funcs = [
+            {
+                'name': f.name, 'calls': self._calls[f.idx] if exact else None,
+                'exclusive_instrs': self._exclusive[f.idx], 'inclusive_instrs': self._inclusive[f.idx],
+            }
+            for f in self._vm.funcs if self._exclusive[f.idx] or self._inclusive[f.idx]
+        ]
+        funcs.sort(key=lambda d: -d['inclusive_instrs'])
+        return {
+            'mode': 'exact' if exact else 'sampling', 'sample_every': max(self._sample_every, 0),
+            'total_instrs': self.total,
+            'opcodes': {OP_NAMES.get(c, hex(c)): n for c, n in sorted(enumerate(self._op_counts), key=lambda t: -t[1]) if n},
+            'functions': funcs,
+            'hot_loops': self.hot_loops(top),
+            'hot_instructions': self.hot_instructions(top),
+            'heap': self._vm.mem.heap_stats()._asdict(),
+        }
+    
+    def dump_json(self, fp: IO[str], top: int = 20):
+        json.dump(self.to_dict(top), fp, indent=2)
+        fp.write('\n')
+    
+    def dump_folded(self, fp: IO[str]):
+        fp.writelines(f'{path} {n}\n' for path, n in sorted(self._folded.items()))
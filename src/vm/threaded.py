@@ -0,0 +1,477 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+import math
+import sys
+from types import FunctionType
+from typing import IO, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from utils.ints import I64_MAX, I64_MIN, U64_MASK, wrap_i64
+from vm.buffered_io import BlockScanner, OutputBuffer
+from vm.instruction import InstrType
+from vm.loader import O0Program
+from vm.machine import (
+    DecodedFunc, VirtualMachine, DEFAULT_STACK_SLOTS, OP_END, OP_GETCHAR, OP_GETDOUBLE, OP_GETINT, STACK_BASE,
+    f64_of, i64_of,
+)
+from vm.vm_err import *
+
+_BLOCK_ENDS = {
+    InstrType.BR.value, InstrType.BR_FALSE.value, InstrType.BR_TRUE.value,
+    InstrType.CALL.value, InstrType.RET.value, InstrType.PANIC.value, OP_END,
+}
+# the opcodes as plain ints, comparing them is much cheaper than getting `.value` of the enum members
+_Op = type('_Op', (), {it.name: it.value for it in InstrType})
+_I64_RANGE_CHECK = f'if not {I64_MIN} <= {{t}} <= {I64_MAX}: {{t}} = wrap_i64({{t}})'
+
+
+class _V(NamedTuple):
+    r"""
+    A value on the operand stack while a block is translated:
+        
+        * 'c': a constant (val: int, the bits of a double are kept as the i64 of them, as `PUSH` gives them)
+        * 't': a python expression without side effects, `ty` is 'i' (int), 'f' (float) or '?' (either)
+        * 'a': the address of a stack slot, val: ('lb' or 'bp', offset)
+        * 'b': a slot below the operand stack of the block entry, val: k for `st[sp - k]`, read when used
+        * 'cmp': the result of CMP_I/CMP_F, val: (lhs, rhs, is_f64), only computed if needed
+        * 'bool': a python boolean expression (from SET_LT/SET_GT/NOT), only converted to 0/1 if needed
+    """
+    kind: str
+    val: Union[int, str, tuple]
+    ty: str = '?'
+
+
+def _cmp_nonzero(a: str, b: str, is_f64: bool) -> str:
+    # CMP_F gives 0 when an operand is NaN, as `_F64_PREDS` of `vm.machine` tests it
+    return f'({a} < {b} or {a} > {b})' if is_f64 else f'{a} != {b}'
+
+
+def _f64_literal(bits: int) -> str:
+    f = f64_of(bits)
+    return repr(f) if math.isfinite(f) else f'float({repr(f)!r})'
+
+
+class _BlockTranslator(object):
+    
+    def __init__(self, lines: List[str], block_names: Dict[int, str], calls: List[Tuple[str, int, str]]):
+        self._lines, self._block_names, self._calls = lines, block_names, calls
+        self._stack: List[_V] = []
+        self._consumed = 0      # the number of slots popped below the operand stack of the block entry
+        self._num_temps = 0
+    
+    def _emit(self, line: str):
+        self._lines.append('    ' + line)
+    
+    def _temp(self, expr: str, ty: str) -> _V:
+        t = f't{self._num_temps}'
+        self._num_temps += 1
+        self._emit(f'{t} = {expr}')
+        return _V('t', t, ty)
+    
+    def push(self, v: _V):
+        self._stack.append(v)
+    
+    def pop(self) -> _V:
+        if self._stack:
+            return self._stack.pop()
+        self._consumed += 1
+        return _V('b', self._consumed)
+    
+    def expr(self, v: _V) -> str:
+        # an expression of the value that can be evaluated now or later in the block
+        k = v.kind
+        if k == 'c' or k == 't':
+            return str(v.val)
+        if k == 'b':
+            return self._temp(f'st[sp - {v.val}]', '?').val
+        if k == 'a':
+            return f'({STACK_BASE} + (({v.val[0]} + {v.val[1]}) << 3))'
+        if k == 'cmp':
+            a, b, _ = v.val
+            return self._temp(f'({a} > {b}) - ({a} < {b})', 'i').val
+        return self._temp(f'1 if {v.val} else 0', 'i').val
+    
+    def f_expr(self, v: _V) -> str:
+        if v.kind == 'c':
+            return _f64_literal(v.val)
+        e = self.expr(v)
+        return e if v.ty == 'f' else f'f64_of({e})'
+    
+    def cond(self, v: _V) -> str:
+        if v.kind == 'bool':
+            return v.val
+        if v.kind == 'cmp':
+            return _cmp_nonzero(*v.val)
+        return self.expr(v)
+    
+    def _read_below_refs(self):
+        self._stack = [self._temp(f'st[sp - {v.val}]', '?') if v.kind == 'b' else v for v in self._stack]
+    
+    def sp_after(self) -> str:
+        delta = len(self._stack) - self._consumed
+        return 'sp' if delta == 0 else f'sp + {delta}' if delta > 0 else f'sp - {-delta}'
+    
+    def flush(self):
+        # writes what is left on the operand stack of the block back to `st`
+        base = -self._consumed
+        # the slots below are read before any write; the ones still in their own slots are not touched at all
+        self._stack = [
+            self._temp(f'st[sp - {v.val}]', '?') if v.kind == 'b' and base + i != -v.val else v
+            for i, v in enumerate(self._stack)
+        ]
+        for i, v in enumerate(self._stack):
+            if v.kind != 'b':
+                idx = base + i
+                self._emit(f'st[sp{f" + {idx}" if idx > 0 else f" - {-idx}" if idx < 0 else ""}] = {self.expr(v)}')
+    
+    def binary_i(self, op: str, check_range: bool):
+        b, a = self.pop(), self.pop()
+        t = self._temp(f'{self.expr(a)} {op} {self.expr(b)}', 'i')
+        if check_range:
+            self._emit(_I64_RANGE_CHECK.format(t=t.val))
+        self.push(t)
+    
+    def binary_f(self, op: str):
+        b, a = self.pop(), self.pop()
+        self.push(self._temp(f'{self.f_expr(a)} {op} {self.f_expr(b)}', 'f'))
+    
+    def call_helper(self, helper: str, num_args: int, ty: Optional[str]):
+        args = [self.pop() for _ in range(num_args)][::-1]
+        call = f'{helper}({", ".join(self.expr(a) for a in args)})'
+        if ty is None:
+            self._emit(call)
+        else:
+            self.push(self._temp(call, ty))
+    
+    def translate(self, codes: List[int], operands: List, begin: int, end: int, next_name: Optional[str], func_idx: int) -> None:
+        ip = begin
+        while ip < end:
+            c, x = codes[ip], operands[ip]
+            ip += 1
+            if c == _Op.PUSH:
+                self.push(_V('c', x))
+            elif c == _Op.LOCA:
+                self.push(_V('a', ('lb', x)))
+            elif c == _Op.ARGA:
+                self.push(_V('a', ('bp', x)))
+            elif c == _Op.GLOBA:
+                self.push(_V('c', x))
+            elif c == _Op.LOAD_64:
+                a = self.pop()
+                if a.kind == 'a':
+                    self.push(self._temp(f'st[{a.val[0]} + {a.val[1]}]', '?'))
+                else:
+                    self.push(self._temp(f'load_64(st, {self.expr(a)})', '?'))
+            elif c == _Op.STORE_64:
+                v, a = self.pop(), self.pop()
+                self._read_below_refs()
+                if a.kind == 'a':
+                    self._emit(f'st[{a.val[0]} + {a.val[1]}] = {self.expr(v)}')
+                else:
+                    self._emit(f'store_64(st, {self.expr(a)}, {self.expr(v)})')
+            elif c == _Op.POP:
+                self.pop()
+            elif c == _Op.POPN:
+                [self.pop() for _ in range(x)]
+            elif c == _Op.DUP:
+                v = self.pop()
+                if v.kind not in {'c', 't', 'a'}:
+                    v = _V('t', self.expr(v), 'i' if v.kind in {'cmp', 'bool'} else '?')
+                self.push(v)
+                self.push(v)
+            elif c == _Op.STACKALLOC:
+                [self.push(_V('c', 0)) for _ in range(x)]
+            elif c == _Op.NOP:
+                pass
+            
+            elif c == _Op.ADD_I:
+                self.binary_i('+', True)
+            elif c == _Op.SUB_I:
+                self.binary_i('-', True)
+            elif c == _Op.MUL_I:
+                self.binary_i('*', True)
+            elif c == _Op.AND:
+                self.binary_i('&', False)
+            elif c == _Op.OR:
+                self.binary_i('|', False)
+            elif c == _Op.XOR:
+                self.binary_i('^', False)
+            elif c == _Op.SHR:
+                b, a = self.pop(), self.pop()
+                self.push(self._temp(f'{self.expr(a)} >> ({self.expr(b)} & 63)', 'i'))
+            elif c == _Op.NEG_I:
+                a = self.pop()
+                t = self._temp(f'-{self.expr(a)}', 'i')
+                self._emit(_I64_RANGE_CHECK.format(t=t.val))
+                self.push(t)
+            elif c == _Op.ADD_F:
+                self.binary_f('+')
+            elif c == _Op.SUB_F:
+                self.binary_f('-')
+            elif c == _Op.MUL_F:
+                self.binary_f('*')
+            elif c == _Op.NEG_F:
+                self.push(self._temp(f'-{self.f_expr(self.pop())}', 'f'))
+            elif c == _Op.ITOF:
+                self.push(self._temp(f'float({self.expr(self.pop())})', 'f'))
+            elif c == _Op.CMP_I:
+                b, a = self.pop(), self.pop()
+                self.push(_V('cmp', (self.expr(a), self.expr(b), False), 'i'))
+            elif c == _Op.CMP_F:
+                b, a = self.pop(), self.pop()
+                self.push(_V('cmp', (self.f_expr(a), self.f_expr(b), True), 'i'))
+            elif c == _Op.SET_LT or c == _Op.SET_GT:
+                v, rel = self.pop(), '<' if c == _Op.SET_LT else '>'
+                if v.kind == 'cmp':
+                    self.push(_V('bool', f'{v.val[0]} {rel} {v.val[1]}', 'i'))
+                else:
+                    self.push(_V('bool', f'{self.expr(v)} {rel} 0', 'i'))
+            elif c == _Op.NOT:
+                v = self.pop()
+                if v.kind == 'bool':
+                    self.push(_V('bool', f'not ({v.val})', 'i'))
+                elif v.kind == 'cmp':
+                    self.push(_V('bool', f'not ({_cmp_nonzero(*v.val)})', 'i'))
+                else:
+                    self.push(_V('bool', f'not {self.expr(v)}', 'i'))
+            
+            # the rare ones go through the helpers shared with the reference machine
+            elif c in _HELPERS:
+                helper, num_args, ty = _HELPERS[c]
+                if helper.startswith('store'):
+                    self._read_below_refs()
+                self.call_helper(helper, num_args, ty)
+            
+            elif c == _Op.PRINT_I:
+                v = self.pop()
+                self._emit(f'write(b"%d" % {self.expr(v) if v.ty == "i" or v.kind == "c" else f"i64_of({self.expr(v)})"})')
+            elif c == _Op.PRINT_F:
+                self._emit(f"write(b'%.6f' % {self.f_expr(self.pop())})")
+            elif c == _Op.PRINTLN:
+                self._emit("write(b'\\n')")
+            elif c == _Op.SCAN_I:
+                self.push(self._temp('scan_i()', 'i'))
+            elif c == _Op.SCAN_F:
+                self.push(self._temp('scan_f()', 'f'))
+            elif c == _Op.SCAN_C:
+                self.push(self._temp('scan_c()', 'i'))
+            elif c in {OP_GETINT, OP_GETDOUBLE, OP_GETCHAR}:
+                self.pop()
+                self.push(self._temp(f'scan_{"ifc"[c - OP_GETINT]}()', 'f' if c == OP_GETDOUBLE else 'i'))
+            
+            # the block ends
+            elif c == _Op.BR:
+                self.flush()
+                self._emit(f'return {self._block_names[x]}, {self.sp_after()}')
+                return
+            elif c == _Op.BR_FALSE or c == _Op.BR_TRUE:
+                cond = self.cond(self.pop())
+                self.flush()
+                neg = 'not ' if c == _Op.BR_FALSE else ''
+                self._emit(f'if {neg}({cond}): return {self._block_names[x]}, {self.sp_after()}')
+                self._emit(f'return {next_name}, {self.sp_after()}')
+                return
+            elif c == _Op.CALL:
+                self.flush()
+                call_name = f'call_{func_idx}_{ip}'
+                self._calls.append((call_name, x, next_name))
+                self._emit(f'return {call_name}, {self.sp_after()}')
+                return
+            elif c == _Op.RET:
+                self._emit('return None, bp + ret_slots')
+                return
+            elif c == OP_END:
+                self._emit('return False, sp')
+                return
+            elif c == _Op.PANIC:
+                self._emit(f'raise VmPanicErr("panic at #{ip - 1}")')
+                return
+            else:
+                raise VmIllegalInstrErr(f'illegal opcode {c:#x} at #{ip - 1}')
+        
+        self.flush()
+        self._emit(f'return {next_name}, {self.sp_after()}')
+
+
+# opcode -> (name of the helper in the namespace of the generated code, number of popped args, type of the result)
+_HELPERS = {
+    InstrType.DIV_I.value: ('div_i', 2, 'i'), InstrType.DIV_U.value: ('div_u', 2, 'i'),
+    InstrType.SHL.value: ('shl', 2, 'i'), InstrType.SHRL.value: ('shrl', 2, 'i'),
+    InstrType.CMP_U.value: ('cmp_u', 2, 'i'), InstrType.DIV_F.value: ('div_f', 2, 'f'),
+    InstrType.FTOI.value: ('ftoi', 1, 'i'),
+    InstrType.LOAD_8.value: ('load_8', 1, 'i'), InstrType.LOAD_16.value: ('load_16', 1, 'i'),
+    InstrType.LOAD_32.value: ('load_32', 1, 'i'),
+    InstrType.STORE_8.value: ('store_8', 2, None), InstrType.STORE_16.value: ('store_16', 2, None),
+    InstrType.STORE_32.value: ('store_32', 2, None),
+    InstrType.ALLOC.value: ('alloc', 1, 'i'), InstrType.FREE.value: ('free', 1, None),
+    InstrType.PRINT_C.value: ('print_c', 1, None), InstrType.PRINT_S.value: ('print_s', 1, None),
+}
+
+
+class ThreadedVirtualMachine(VirtualMachine):
+    r"""
+    Executes o0 programs by translating them into python code ahead of time instead of dispatching each instruction.
+    
+    The decoded instructions of a function (see `VirtualMachine`) are split into basic blocks, and each block becomes
+    a generated python function `(st, sp, bp, lb) -> (next, sp)`:
+        
+        * the operand stack inside a block is simulated at translation time, so the values live in python locals and
+          only what is left at the end of the block is written to `st`
+        * the offsets of LOCA/ARGA and the constants of PUSH are baked in (`LOCA 2; LOAD_64` becomes `st[lb + 2]`)
+        * CMP_I/SET_LT/NOT/BR_FALSE become one python `if` on a comparison
+        * `next` is the generated function of the block to run next, so a branch is a direct reference to its target
+    
+    A block ending in CALL returns `(callee, block to return to)`, RET returns `None`, and the driver loop keeps the
+    frames. A function is translated the first time it is called.
+    
+    The semantics, the layout of the frames and the memory are the same as the ones of `VirtualMachine`.
+    """
+    
+    def __init__(self, program: O0Program, fin: IO[str] = sys.stdin, fout: IO[str] = sys.stdout, stack_slots: int = DEFAULT_STACK_SLOTS, eager: bool = False):
+        super(ThreadedVirtualMachine, self).__init__(program, fin=fin, fout=fout, stack_slots=stack_slots)
+        self._ns = self._make_namespace()
+        self._entries: List[Optional[FunctionType]] = [None] * len(self.funcs)
+        self.sources: Dict[int, str] = {}   # the generated code of each translated function
+        if eager:
+            [self._translate(i) for i in range(len(self.funcs))]
+    
+    def _make_namespace(self) -> Dict:
+        mem = self.mem
+        
+        def load_64(st, a):
+            if a >= STACK_BASE:
+                if (a - STACK_BASE) & 7:
+                    raise VmMemoryErr(f'unaligned stack address {a:#x}')
+                return st[(a - STACK_BASE) >> 3]
+            return mem.load(a, 8)
+        
+        def store_64(st, a, v):
+            if a >= STACK_BASE:
+                if (a - STACK_BASE) & 7:
+                    raise VmMemoryErr(f'unaligned stack address {a:#x}')
+                st[(a - STACK_BASE) >> 3] = v
+            else:
+                mem.store(a, 8, v)
+        
+        def make_load(width):
+            def load(a):
+                if a >= STACK_BASE:
+                    raise VmMemoryErr(f'{width}-byte access to a stack slot')
+                return mem.load(a, width)
+            return load
+        
+        def make_store(width):
+            def store(a, v):
+                if a >= STACK_BASE:
+                    raise VmMemoryErr(f'{width}-byte access to a stack slot')
+                mem.store(a, width, v)
+            return store
+        
+        def div_i(a, b):
+            if b == 0:
+                raise VmArithmeticErr('division by zero')
+            q = abs(a) // abs(b)
+            return wrap_i64(-q if (a < 0) != (b < 0) else q)
+        
+        def div_u(a, b):
+            if b & U64_MASK == 0:
+                raise VmArithmeticErr('division by zero')
+            return wrap_i64((a & U64_MASK) // (b & U64_MASK))
+        
+        def div_f(a, b):
+            a, b = f64_of(a), f64_of(b)
+            if b == 0:
+                return math.copysign(math.inf, a) * math.copysign(1, b) if a == a and a != 0 else math.nan
+            return a / b
+        
+        def ftoi(v):
+            f = f64_of(v)
+            return 0 if f != f else I64_MAX if f >= 2.0 ** 63 else I64_MIN if f < -2.0 ** 63 else int(f)
+        
+        def cmp_u(a, b):
+            a, b = a & U64_MASK, b & U64_MASK
+            return (a > b) - (a < b)
+        
+        return {
+            'wrap_i64': wrap_i64, 'f64_of': f64_of, 'i64_of': i64_of, 'VmPanicErr': VmPanicErr,
+            'load_64': load_64, 'store_64': store_64,
+            'load_8': make_load(1), 'load_16': make_load(2), 'load_32': make_load(4),
+            'store_8': make_store(1), 'store_16': make_store(2), 'store_32': make_store(4),
+            'alloc': mem.alloc, 'free': mem.free,
+            'div_i': div_i, 'div_u': div_u, 'div_f': div_f, 'ftoi': ftoi, 'cmp_u': cmp_u,
+            'shl': lambda a, b: wrap_i64(a << (b & 63)), 'shrl': lambda a, b: wrap_i64((a & U64_MASK) >> (b & 63)),
+            'print_c': lambda v: self._ns['out'].write_c(v), 'print_s': lambda i: self._ns['out'].write_s(mem.global_bytes(i)),
+        }
+    
+    def _translate(self, fi: int) -> FunctionType:
+        func: DecodedFunc = self.funcs[fi]
+        codes, operands = func.codes, func.operands
+        
+        leaders = {0}
+        for ip, c in enumerate(codes):
+            if c in _BLOCK_ENDS:
+                leaders.add(ip + 1)
+                if c in {InstrType.BR.value, InstrType.BR_FALSE.value, InstrType.BR_TRUE.value}:
+                    leaders.add(operands[ip])
+        leaders = sorted(l for l in leaders if l < len(codes))
+        names = {l: f'f{fi}_b{l}' for l in leaders}
+        
+        lines, calls = [], []
+        for i, begin in enumerate(leaders):
+            end = leaders[i + 1] if i + 1 < len(leaders) else len(codes)
+            lines.append(f'def {names[begin]}(st, sp, bp, lb, ret_slots={func.num_ret_vals}):')
+            _BlockTranslator(lines, names, calls).translate(codes, operands, begin, end, names.get(end, None), fi)
+        
+        src = '\n'.join(lines) + '\n'
+        self.sources[fi] = src
+        exec(compile(src, f'<o0 function #{fi} {func.name}>', 'exec'), self._ns)
+        for call_name, callee, cont in calls:
+            self._ns[call_name] = (callee, self._ns[cont])     # (callee, the block to return to)
+        self._entries[fi] = entry = self._ns[names[0]]
+        return entry
+    
+    def run(self, entry: str = '_start') -> None:
+        # unlike `VirtualMachine.run`, the executed instructions are not counted
+        if entry not in self._func_indices:
+            raise VmLoadErr(f'entry function "{entry}" not found')
+        scanner, out = BlockScanner(self._fin), OutputBuffer(self._fout)
+        self._ns.update(out=out, write=out.write, scan_i=scanner.scan_i, scan_f=scanner.scan_f, scan_c=scanner.scan_c)
+        funcs, entries, translate = self.funcs, self._entries, self._translate
+        st = [0] * self.stack_slots_for(entry)
+        cap = len(st)
+        frames = []     # (block to return to, bp, lb) of the callers
+        
+        fi = self._func_indices[entry]
+        if funcs[fi].num_params:
+            raise VmCallErr(f'entry function "{entry}" cannot take parameters')
+        blk = entries[fi] or translate(fi)
+        bp, lb, sp = 0, 0, funcs[fi].num_loc_vars
+        try:
+            while True:
+                blk, sp = blk(st, sp, bp, lb)
+                if blk.__class__ is not FunctionType:
+                    if blk is None:         # RET
+                        if not frames:
+                            break
+                        blk, bp, lb = frames.pop()
+                    elif blk is False:      # the end of a function
+                        if frames:
+                            raise VmCallErr('control reaches the end of a function')
+                        break
+                    else:                   # CALL
+                        callee, cont = blk
+                        frames.append((cont, bp, lb))
+                        f = funcs[callee]
+                        bp, lb = sp - f.num_params, sp
+                        if bp < 0:
+                            raise VmStackErr(f'stack underflow when calling "{f.name}"')
+                        if sp + f.num_loc_vars > cap:
+                            raise VmStackErr('stack overflow')
+                        st[sp:sp + f.num_loc_vars] = f.zeros
+                        sp += f.num_loc_vars
+                        blk = entries[callee] or translate(callee)
+        except IndexError:     # the generated code writes beyond `st`
+            raise VmStackErr('stack overflow')
+        finally:
+            out.flush()
@@ -0,0 +1,180 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from vm.instruction import BUILTIN_STACK_EFFECTS, InstrType, STACK_EFFECTS
+from vm.opcodes import *
+
+_POPN, _STACKALLOC = InstrType.POPN.value, InstrType.STACKALLOC.value
+_CALLS = {InstrType.CALL.value, InstrType.CALLNAME.value}
+_BRANCHES = {InstrType.BR.value, InstrType.BR_FALSE.value, InstrType.BR_TRUE.value}
+_NO_FALLTHROUGH = {InstrType.BR.value, InstrType.RET.value, InstrType.PANIC.value}
+_NAMES = {it.value: it.name for it in InstrType}
+# opcode -> (popped, pushed) slots, including the builtins decoded by `VirtualMachine`
+_EFFECTS: List[Optional[Tuple[int, int]]] = [None] * NUM_OPS
+for _it, _eff in STACK_EFFECTS.items():
+    _EFFECTS[_it.value] = _eff
+_EFFECTS[OP_GETINT] = _EFFECTS[OP_GETDOUBLE] = _EFFECTS[OP_GETCHAR] = (1, 1)
+
+
+class StackVerificationError(Exception):
+    pass
+
+
+class FuncStackInfo(NamedTuple):
+    name: str
+    max_depth: int                      # the maximum number of slots on the operand stack (above the locals)
+    heights: List[Optional[int]]        # the height before each instruction, None if it cannot be reached
+
+
+def verify_code(
+        name: str, codes: Sequence[int], operands: Sequence, call_effect: Callable[[int, int], Tuple[int, int]],
+        may_fall_off: bool = False, absolute_branches: bool = False,
+) -> FuncStackInfo:
+    r"""
+    Follows the height of the operand stack through the opcodes of a function, from 0 at its entry, along both edges
+    of each branch. The operands of the branches are offsets from the next instruction as in o0 files, or indices of
+    the targets with `absolute_branches` (as decoded by `VirtualMachine`). `call_effect(opcode, operand)` gives the
+    (popped, pushed) slots of a CALL/CALLNAME.
+    
+    Raises `StackVerificationError` on a branch out of the function, on an instruction popping more slots than there
+    are, where two paths reach an instruction with different heights, and when the control reaches the end of the
+    function (unless `may_fall_off`, as for `_start`).
+    """
+    n = len(codes)
+    heights: List[Optional[int]] = [None] * n
+    max_depth = 0
+    work = [0] if n else []
+    if n:
+        heights[0] = 0
+    elif not may_fall_off:
+        raise StackVerificationError(f'function "{name}" is empty')
+    
+    def reach(ip: int, h: int, src: int):
+        if ip == n:
+            if not may_fall_off:
+                raise StackVerificationError(f'control reaches the end of function "{name}" (from #{src})')
+        elif heights[ip] is None:
+            heights[ip] = h
+            work.append(ip)
+        elif heights[ip] != h:
+            raise StackVerificationError(f'stack heights {heights[ip]} and {h} (from #{src}) meet at #{ip} of "{name}"')
+    
+    effects = _EFFECTS
+    while work:
+        ip = work.pop()
+        h = heights[ip]
+        while True:     # along the straight-line code from `ip`
+            c, x = codes[ip], operands[ip]
+            eff = effects[c] if 0 <= c < NUM_OPS else None
+            if eff is not None:
+                pops, pushes = eff
+            elif c == _POPN:
+                pops, pushes = x, 0
+            elif c == _STACKALLOC:
+                pops, pushes = 0, x
+            elif c in _CALLS:
+                pops, pushes = call_effect(c, x)
+            else:
+                raise StackVerificationError(f'unknown opcode {c:#x} at #{ip} of "{name}"')
+            if pops > h:
+                raise StackVerificationError(f'{_NAMES.get(c, hex(c))} at #{ip} of "{name}" pops {pops} slots from {h}')
+            h += pushes - pops
+            if h > max_depth:
+                max_depth = h
+            if c in _BRANCHES:
+                target = x if absolute_branches else ip + 1 + x
+                if not 0 <= target <= n:
+                    raise StackVerificationError(f'{_NAMES[c]} at #{ip} of "{name}" jumps out of the function (to #{target})')
+                reach(target, h, ip)
+            if c in _NO_FALLTHROUGH:
+                break
+            ip += 1
+            if ip < n and heights[ip] is None:
+                heights[ip] = h
+            else:
+                reach(ip, h, ip - 1)
+                break
+    return FuncStackInfo(name=name, max_depth=max_depth, heights=heights)
+
+
+def verify_funcs(global_symbols: List, global_funcs: List) -> Dict[str, FuncStackInfo]:
+    r"""
+    Verifies the functions produced by `SyntacticAnalyzer` (`FuncAttrs.instructions`), before they are assembled.
+    The operand of CALLNAME is the global holding the name of the callee, a function or a builtin.
+    """
+    names: Dict[int, str] = {s.offset: s.val for s in global_symbols if isinstance(getattr(s, 'val', None), str)}
+    funcs = {f.name: f for f in global_funcs}
+    
+    def call_effect(c: int, x: int) -> Tuple[int, int]:
+        name = names.get(x, None) if c == InstrType.CALLNAME.value else global_funcs[x].name if x < len(global_funcs) else None
+        f = funcs.get(name, None)
+        return _callee_effect(name, None if f is None else (f.num_ret_vals, len(f.arg_types)))
+    
+    return {
+        f.name: verify_code(
+            f.name, [i.instr_type.value for i in f.instructions], [i.operand for i in f.instructions], call_effect,
+            may_fall_off=f.name == '_start',
+        )
+        for f in global_funcs
+    }
+
+
+def verify_o0(program) -> Dict[str, FuncStackInfo]:
+    r"""
+    Verifies the functions of a loaded o0 file (see `vm.loader.O0Program`).
+    """
+    funcs = {f.name: f for f in program.functions}
+    
+    def call_effect(c: int, x: int) -> Tuple[int, int]:
+        if c == InstrType.CALL.value:
+            name = program.functions[x].name if x < len(program.functions) else None
+        else:
+            name = program.globals[x].value.decode('ascii', errors='replace') if x < len(program.globals) else None
+        f = funcs.get(name, None)
+        return _callee_effect(name, None if f is None else (f.num_ret_vals, f.num_args))
+    
+    return {
+        f.name: verify_code(
+            f.name, [it.value for it, _ in f.instructions], [x for _, x in f.instructions], call_effect,
+            may_fall_off=f.name == '_start',
+        )
+        for f in program.functions
+    }
+
+
+def _callee_effect(name: Optional[str], ret_and_args: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    if ret_and_args is not None:
+        num_ret, num_args = ret_and_args
+        return num_ret + num_args, num_ret
+    if name in BUILTIN_STACK_EFFECTS:
+        return BUILTIN_STACK_EFFECTS[name]
+    raise StackVerificationError(f'call of "{name}" which is neither a function nor a builtin')
+
+
+def frame_bound(num_loc_vars: List[int], max_depths: List[int], callees: List[Set[int]], entry: int) -> Optional[int]:
+    r"""
+    An upper bound of the stack slots used by a run from the function `entry`: the largest sum of the locals and the
+    maximum operand stack depths along a chain of calls (the arguments of a call are counted in the depth of the
+    caller and again in the frame of the callee). None if the functions can call themselves, directly or not.
+    """
+    bounds: List[Optional[int]] = [None] * len(num_loc_vars)
+    on_path = [False] * len(num_loc_vars)
+    on_path[entry] = True
+    stack = [(entry, iter(callees[entry]))]
+    while stack:
+        fi, it = stack[-1]
+        for c in it:
+            if on_path[c]:
+                return None     # recursion
+            if bounds[c] is None:
+                on_path[c] = True
+                stack.append((c, iter(callees[c])))
+                break
+        else:
+            stack.pop()
+            on_path[fi] = False
+            bounds[fi] = num_loc_vars[fi] + max_depths[fi] + max((bounds[c] for c in callees[fi]), default=0)
+    return bounds[entry]
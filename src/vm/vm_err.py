@@ -0,0 +1,39 @@
+# Copyright (C) 2020, Keyu Tian, Beihang University.
+# This file is a part of my compiler assignment for Compilation Principles.
+# All rights reserved.
+
+
+class VirtualMachineError(Exception):
+    pass
+
+
+class VmLoadErr(VirtualMachineError):
+    pass
+
+
+class VmIllegalInstrErr(VirtualMachineError):
+    pass
+
+
+class VmStackErr(VirtualMachineError):
+    pass
+
+
+class VmMemoryErr(VirtualMachineError):
+    pass
+
+
+class VmArithmeticErr(VirtualMachineError):
+    pass
+
+
+class VmCallErr(VirtualMachineError):
+    pass
+
+
+class VmIOErr(VirtualMachineError):
+    pass
+
+
+class VmPanicErr(VirtualMachineError):
+    pass